@@ -0,0 +1,218 @@
+"""
+Headless JSON query API (FastAPI), with the Gradio UI mounted at /ui.
+
+Usage (each worker process loads the index memory-mapped, see `index.mmap`
+in the config, so workers share the index pages through the OS page cache):
+
+    python -m src.api --config configs/app.yaml --index-dir data/index --workers 4
+    # or: uvicorn --factory src.api:create_app --host 0.0.0.0 --port 8000 --workers 4
+    #     (paths from BOOK_RAG_CONFIG / BOOK_RAG_INDEX_DIR)
+
+Endpoints:
+    POST /query   {"query": ..., "k": 5, "filters": {"book": "dorian"}, "include_hits": true}
+    GET  /query?q=...&k=5   same, for load-testing tools (wrk, ab, hey)
+    GET  /health
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import os
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from src.app import (load_resources, build_interface, embed_queries, hybrid_options, toc_options,
+                     make_answer_cache)
+from src.retrieve import retrieve_batch
+from src.compose import compose_answer
+from src.serving import MicroBatcher
+
+CONFIG_ENV = 'BOOK_RAG_CONFIG'
+INDEX_DIR_ENV = 'BOOK_RAG_INDEX_DIR'
+
+# Internal hit fields that are large and meaningless to clients
+_INTERNAL_FIELDS = ('sentence_spans', 'sentence_vectors')
+
+
+class QueryRequest(BaseModel):
+    query: str
+    k: Optional[int] = None
+    filters: Optional[Dict[str, Any]] = None
+    include_hits: bool = True
+
+
+def jsonable(value):
+    """Recursively convert a payload (numpy scalars/arrays, tuples) to plain JSON types."""
+    if isinstance(value, dict):
+        return {key: jsonable(item) for key, item in value.items() if key not in _INTERNAL_FIELDS}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def query_payloads(queries: List[str], resources: dict, k: int = None, filters: dict = None,
+                   payload_cache=None) -> List[Dict]:
+    """
+    Structured answers for a batch of queries: one encode call and one index search.
+
+    Returns:
+        One dict per query: {query, answer, quotes, references, hits}, where
+        quotes/references are the compose_answer payload and hits the raw
+        retrieve() results (score, chunk_id, text, meta). When composing one
+        query's answer fails, that payload has answer None and an 'error'
+        message (and is not cached); the other queries are unaffected.
+    """
+    config = resources['config']
+    metadata = resources['metadata']
+    k = k or config.get('top_k', 5)
+    max_quotes = config.get('max_answer_tokens', 300) // 100  # Same heuristic as predict()
+
+    payloads = [None] * len(queries)
+    cache_keys = {}
+    pending = []
+    for i, query in enumerate(queries):
+        if payload_cache is not None:
+            cache_keys[i] = payload_cache.key(query, k, True, filters)
+            cached = payload_cache.get(cache_keys[i])
+            if cached is not None:
+                # Cached under the normalized query: echo this caller's own string
+                payloads[i] = {'query': query, **cached}
+                continue
+        pending.append(i)
+    if not pending:
+        return payloads
+
+    query_vecs = {}
+    def embed_fn(batch: list) -> np.ndarray:
+        embeddings = embed_queries(batch, resources['model'], cache=resources['query_cache'])
+        query_vecs.update(zip(batch, embeddings))
+        return embeddings
+
+    exclude_toc, predicate = toc_options(metadata, filter_toc=True)
+    results = retrieve_batch(
+        [queries[i] for i in pending],
+        resources['index'],
+        embed_fn,
+        metadata,
+        chunks_lookup=resources['chunks_lookup'],
+        k=k,
+        exclude_toc=exclude_toc,
+        filters=filters,
+        predicate=predicate,
+        **hybrid_options(config, metadata)
+    )
+
+    semantic = config.get('quote_scoring') == 'semantic'
+    for i, retrieved in zip(pending, results):
+        query = queries[i]
+        try:
+            composed = compose_answer(query, retrieved, max_quotes=max_quotes,
+                                      query_vec=query_vecs.get(query) if semantic else None)
+        except Exception as compose_error:
+            # Only this query fails (it may share a micro-batch); clients still get its hits
+            payloads[i] = jsonable({'query': query, 'answer': None, 'quotes': [], 'references': [],
+                                    'error': f"Error composing answer: {compose_error}", 'hits': retrieved})
+            continue
+        payload = jsonable({**composed, 'hits': retrieved})
+        if payload_cache is not None:
+            payload_cache.put(cache_keys[i], payload)
+        payloads[i] = {'query': query, **payload}
+    return payloads
+
+
+def create_app(config_path: str = None, index_dir: str = None, resources: dict = None,
+               mount_ui: bool = None) -> FastAPI:
+    """
+    Build the FastAPI app over loaded resources (loads them from config/index paths if not given).
+
+    Plain queries go through a MicroBatcher (see `serving:` config), so
+    concurrent requests share one encode + search; requests with their own
+    k or filters run as single-query batches.
+
+    Args:
+        config_path: Config YAML (default: $BOOK_RAG_CONFIG or configs/app.yaml)
+        index_dir: Index directory (default: $BOOK_RAG_INDEX_DIR or data/index)
+        resources: Already loaded resources (from app.load_resources) to share
+        mount_ui: Mount the Gradio UI at /ui (default: `api.mount_ui` config, true)
+    """
+    if resources is None:
+        resources = load_resources(config_path or os.environ.get(CONFIG_ENV, 'configs/app.yaml'),
+                                   index_dir or os.environ.get(INDEX_DIR_ENV, 'data/index'))
+    config = resources['config']
+    payload_cache = make_answer_cache(config, resources['index_dir'], index=resources['index'])
+    default_k = config.get('top_k', 5)
+
+    serving_config = config.get('serving') or {}
+    batcher = MicroBatcher(
+        lambda queries: query_payloads(queries, resources, payload_cache=payload_cache),
+        max_batch_size=serving_config.get('max_batch_size', 32),
+        max_wait_ms=serving_config.get('max_wait_ms', 5),
+    )
+
+    app = FastAPI(title="Classics RAG Q&A API")
+
+    async def answer(request: QueryRequest) -> Dict:
+        if not request.query or not request.query.strip():
+            raise HTTPException(status_code=400, detail="Please enter a question.")
+        try:
+            if request.filters or (request.k and request.k != default_k):
+                payload = (await run_in_threadpool(
+                    query_payloads, [request.query], resources, request.k, request.filters, payload_cache))[0]
+            else:
+                payload = await batcher.submit(request.query)
+        except ValueError as e:  # e.g. unknown filter keys
+            raise HTTPException(status_code=400, detail=str(e))
+        if not request.include_hits:
+            payload = {key: value for key, value in payload.items() if key != 'hits'}
+        return payload
+
+    @app.post("/query")
+    async def post_query(request: QueryRequest):
+        return await answer(request)
+
+    @app.get("/query")
+    async def get_query(q: str, k: Optional[int] = None, include_hits: bool = True):
+        return await answer(QueryRequest(query=q, k=k, include_hits=include_hits))
+
+    @app.get("/health")
+    async def health():
+        return {
+            'status': 'ok',
+            'pid': os.getpid(),
+            'vectors': int(resources['index'].ntotal),
+            'batching': batcher.stats(),
+        }
+
+    api_config = config.get('api') or {}
+    if mount_ui if mount_ui is not None else api_config.get('mount_ui', True):
+        import gradio as gr
+        app = gr.mount_gradio_app(app, build_interface(resources), path="/ui")
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the JSON query API (and Gradio UI at /ui).")
+    parser.add_argument("--config", default="configs/app.yaml", help="Config YAML")
+    parser.add_argument("--index-dir", default="data/index", help="Index directory or sharded index root")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes (default: api.workers from the config, 1)")
+    args = parser.parse_args()
+
+    import uvicorn
+    import yaml
+    with open(args.config, 'r', encoding='utf-8') as f:
+        api_config = (yaml.safe_load(f) or {}).get('api') or {}
+    # Workers import the app factory themselves; paths reach them through the environment
+    os.environ[CONFIG_ENV] = args.config
+    os.environ[INDEX_DIR_ENV] = args.index_dir
+    uvicorn.run("src.api:create_app", factory=True, host=args.host, port=args.port,
+                workers=args.workers or api_config.get('workers', 1))
+
+
+if __name__ == "__main__":
+    main()
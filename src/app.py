@@ -2,72 +2,127 @@
 Gradio demo wiring: input question -> retrieve -> compose_answer -> show quotes.
 """
 from pathlib import Path
-import yaml
+from typing import TYPE_CHECKING
 import numpy as np
 import faiss
-import gradio as gr
-import re
-from sentence_transformers import SentenceTransformer
 from src.embed_index import load_index
-from src.retrieve import retrieve
+from src.shards import ShardedIndex, MANIFEST_FILE as SHARD_MANIFEST_FILE
+from src.retrieve import retrieve, retrieve_batch
 from src.compose import compose_answer
+from src.chunk import is_toc_or_header_chunk
+from src.cache import QueryEmbeddingCache, AnswerCache
+from src.serving import MicroBatcher
+from src.startup import phase
+from src.config import load_config as load_config_file
+from src.embed_backend import load_embedding_model, embedding_model_id
+
+# gradio and sentence-transformers (torch) take seconds to import; they are
+# imported where first needed so retrieval-only callers start fast.
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 
 def load_config(config_path="../configs/app.yaml"):
-    """Load configuration from YAML file."""
-    with open(config_path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+    """Load configuration from YAML file (path settings resolved against its directory, see src.config)."""
+    return load_config_file(config_path)
+
 
+def embed_query(query: str, model: "SentenceTransformer", cache: QueryEmbeddingCache = None) -> np.ndarray:
+    """
+    Embed a query string using the model. Returns normalized embedding.
 
-def embed_query(query: str, model: SentenceTransformer) -> np.ndarray:
-    """Embed a query string using the model. Returns normalized embedding."""
+    With a `cache`, repeated (normalized) queries skip the transformer entirely.
+    """
+    if cache is not None:
+        cached = cache.get_embedding(query)
+        if cached is not None:
+            return cached
     embedding = model.encode([query], normalize_embeddings=True, show_progress_bar=False)
     embedding = np.array(embedding, dtype=np.float32)
     faiss.normalize_L2(embedding)  # Normalize for IndexFlatIP
+    if cache is not None:
+        cache.put_embedding(query, embedding[0])
     return embedding[0]  # Return 1D array (retrieve expects this)
 
 
-def is_toc_or_header_chunk(result: dict) -> bool:
+def embed_queries(queries: list, model: "SentenceTransformer", batch_size: int = 64,
+                  cache: QueryEmbeddingCache = None) -> np.ndarray:
     """
-    Detect if a chunk is a TOC, header, or low-content chunk.
-    Returns True if it should be filtered out.
+    Embed many query strings in one encode call. Returns (n, d) normalized embeddings.
+
+    With a `cache`, only queries that miss the cache are sent to the model.
     """
-    text = result.get('text', '')
-    chunk_id = result.get('chunk_id', '')
-    meta = result.get('meta', {})
-    
-    # Filter out chunk 0 (usually TOC/preface)
-    if chunk_id.endswith('_chunk_0') or meta.get('para_idx_start', -1) == 0:
-        # But allow it if it has substantial content (not just TOC)
-        if 'Contents' in text and text.count('CHAPTER') > 5:
-            return True  # It's a TOC
-    
-    # Filter very short chunks
-    if len(text) < 150:
-        return True
-    
-    # Filter chunks with too many newlines (indicates headers/TOC)
-    newline_ratio = text.count('\n') / len(text) if len(text) > 0 else 0
-    if newline_ratio > 0.15:  # More than 15% newlines
-        return True
-    
-    # Filter chunks that are mostly chapter titles
-    lines = text.split('\n')
-    chapter_lines = [line for line in lines if 'CHAPTER' in line.upper() or 
-                     re.match(r'^CHAPTER\s+[IVX]+', line, re.IGNORECASE)]
-    if len(chapter_lines) > 3:  # More than 3 chapter title lines
-        return True
-    
-    # Filter chunks that start with title/author/contents pattern
-    first_100 = text[:100].lower()
-    if ('contents' in first_100 and 'chapter' in first_100) or \
-       (text.startswith('The Picture of') and 'by Oscar Wilde' in first_100):
-        # Check if it's mostly TOC (many short lines)
-        short_lines = [line for line in lines[:30] if len(line.strip()) < 50]
-        if len(short_lines) > 10:  # More than 10 short lines in first 30
-            return True
-    
-    return False
+    queries = list(queries)
+    if not queries:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    cached = [cache.get_embedding(q) for q in queries] if cache is not None else [None] * len(queries)
+    missing = [i for i, vec in enumerate(cached) if vec is None]
+    
+    new_embeddings = None
+    if missing:
+        new_embeddings = model.encode([queries[i] for i in missing], batch_size=batch_size,
+                                      normalize_embeddings=True, show_progress_bar=False)
+        new_embeddings = np.array(new_embeddings, dtype=np.float32)
+        faiss.normalize_L2(new_embeddings)  # Normalize for IndexFlatIP
+        if len(missing) == len(queries):
+            embeddings = new_embeddings
+        else:
+            embeddings = np.empty((len(queries), new_embeddings.shape[1]), dtype=np.float32)
+            embeddings[missing] = new_embeddings
+    else:
+        embeddings = np.empty((len(queries), cached[0].shape[0]), dtype=np.float32)
+    
+    for i, vec in enumerate(cached):
+        if vec is not None:
+            embeddings[i] = vec
+    if cache is not None and new_embeddings is not None:
+        for i, vec in zip(missing, new_embeddings):
+            cache.put_embedding(queries[i], vec)
+    return embeddings  # 2D array (retrieve_batch expects this)
+
+
+def make_query_cache(config) -> QueryEmbeddingCache:
+    """
+    Build the query-embedding cache from the `query_cache:` config section.
+
+    Returns None when caching is disabled.
+    """
+    cache_config = config.get('query_cache') or {}
+    if not cache_config.get('enabled', True):
+        return None
+    cache = QueryEmbeddingCache(
+        model_name=embedding_model_id(config['embedding_model'], config.get('embedding_backend')),
+        maxsize=cache_config.get('maxsize', 4096),
+        ttl=cache_config.get('ttl_seconds'),
+        path=cache_config.get('path'),
+    )
+    if cache.path is not None:
+        cache.load()
+    return cache
+
+
+def make_answer_cache(config, index_dir: str, index=None) -> AnswerCache:
+    """
+    Build the end-to-end answer cache from the `answer_cache:` config section.
+
+    With a ShardedIndex as `index`, a change of the index files also makes it
+    re-read shards.json (ShardedIndex.refresh), so shards rebuilt by
+    `python -m src.pipeline --shard-root` are served without a restart. A
+    single-directory index is not reloaded: restart to serve a rebuild.
+
+    Returns None when caching is disabled.
+    """
+    cache_config = config.get('answer_cache') or {}
+    if not cache_config.get('enabled', True):
+        return None
+    return AnswerCache(
+        index_dir=index_dir,
+        config=config,
+        maxsize=cache_config.get('maxsize', 1024),
+        ttl=cache_config.get('ttl_seconds'),
+        check_interval=cache_config.get('check_interval_seconds', 1.0),
+        on_change=getattr(index, 'refresh', None),
+    )
 
 
 def filter_results(results: list, filter_toc: bool = True) -> list:
@@ -107,19 +162,47 @@ def format_composed_answer(composed: dict) -> str:
     return output
 
 
-def predict(query: str, index, metadata_df, model: SentenceTransformer, config, 
-            chunks_lookup: dict = None, filter_toc: bool = True):
+def hybrid_options(config: dict, metadata) -> dict:
+    """
+    retrieve() keyword arguments for hybrid BM25 + dense retrieval from the `retrieval:` config.
+
+    Empty (dense only) when hybrid retrieval is disabled or the index has no BM25 index.
+    With hybrid retrieval each hit's score is the fused score (e.g. an RRF value
+    around 0.016-0.033), not a cosine similarity.
+    """
+    options = config.get('retrieval') or {}
+    sparse_index = getattr(metadata, 'sparse', None)
+    if not options.get('hybrid', False) or sparse_index is None:
+        return {}
+    return {
+        'sparse_index': sparse_index,
+        'fusion': options.get('fusion', 'rrf'),
+        'candidates': options.get('candidates', 50),
+        'rrf_k': options.get('rrf_k', 60),
+        'dense_weight': options.get('dense_weight', 0.5),
+    }
+
+
+def predict(query: str, index, metadata_df, model: "SentenceTransformer", config, 
+            chunks_lookup: dict = None, filter_toc: bool = True,
+            query_cache: QueryEmbeddingCache = None, answer_cache: AnswerCache = None,
+            filters: dict = None):
     """
     Main prediction function: retrieve chunks, compose answer, and format for display.
     
     Args:
         query: User's question
         index: FAISS index
-        metadata_df: Metadata DataFrame
+        metadata_df: MetadataStore from load_index (or a metadata DataFrame)
         model: SentenceTransformer model
         config: Configuration dict
-        chunks_lookup: Dict mapping chunk_id to chunk data
+        chunks_lookup: Optional dict mapping chunk_id to chunk data (when metadata has no text)
         filter_toc: Whether to filter out TOC/header chunks
+        query_cache: Optional query-embedding cache shared across requests
+        answer_cache: Optional cache of final outputs; identical requests skip
+            retrieval, filtering and composition
+        filters: Optional retrieval filters, e.g. {'book': 'dorian', 'para_range': (0, 200)};
+            k matching chunks are returned whenever the index has them
     
     Returns:
         Formatted markdown string with answer and citations
@@ -130,9 +213,20 @@ def predict(query: str, index, metadata_df, model: SentenceTransformer, config,
     k = config.get('top_k', 5)
     max_quotes = config.get('max_answer_tokens', 300) // 100  # Rough estimate: ~3 quotes
     
-    # Create embedding function for retrieve()
+    cache_key = None
+    if answer_cache is not None:
+        cache_key = answer_cache.key(query, k, filter_toc, filters)
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    # Create embedding function for retrieve(); the query vector is kept for semantic quote scoring
+    query_vecs = {}
     def embed_fn(q: str) -> np.ndarray:
-        return embed_query(q, model)
+        query_vecs[q] = embed_query(q, model, cache=query_cache)
+        return query_vecs[q]
+    
+    exclude_toc, predicate = toc_options(metadata_df, filter_toc)
     
     # Retrieve top-k chunks using the retrieve() function
     try:
@@ -142,83 +236,256 @@ def predict(query: str, index, metadata_df, model: SentenceTransformer, config,
             embed_fn=embed_fn,
             metadata_df=metadata_df,
             chunks_lookup=chunks_lookup,
-            k=k
+            k=k,
+            exclude_toc=exclude_toc,
+            filters=filters,
+            predicate=predicate,
+            **hybrid_options(config, metadata_df)
         )
-        
-        if not retrieved:
-            return "No results found. Try a different query."
-        
-        # Filter out TOC/header chunks if enabled
-        if filter_toc:
-            retrieved = filter_results(retrieved, filter_toc=True)
-            if not retrieved:
-                return "No relevant content found after filtering. Try a different query."
-        
-        # Compose answer using retrieved chunks
-        try:
-            composed = compose_answer(query, retrieved, max_quotes=max_quotes)
-            output = format_composed_answer(composed)
-            return output
-        except Exception as compose_error:
-            # Fallback: show raw retrieval results if composition fails
-            error_msg = f"Error composing answer: {compose_error}\n\n"
-            error_msg += f"Retrieved {len(retrieved)} chunks. Showing top result:\n\n"
-            if retrieved:
-                top_result = retrieved[0]
-                error_msg += f"**Chunk:** {top_result.get('chunk_id', 'unknown')}\n"
-                error_msg += f"**Score:** {top_result.get('score', 0):.4f}\n"
-                error_msg += f"**Text:** {top_result.get('text', '')[:300]}...\n"
-            return error_msg
-        
+        query_vec = query_vecs.get(query) if config.get('quote_scoring') == 'semantic' else None
+        return render_answer(query, retrieved, max_quotes, query_vec=query_vec,
+                             filtered=bool(filters) or predicate is not None,
+                             answer_cache=answer_cache, cache_key=cache_key)
     except Exception as e:
         return f"Error processing query: {str(e)}\n\nPlease try rephrasing your question."
 
 
-def launch_app(config_path="../configs/app.yaml", index_dir="../data/index"):
+def predict_batch(queries: list, index, metadata_df, model: "SentenceTransformer", config,
+                  chunks_lookup: dict = None, filter_toc: bool = True,
+                  query_cache: QueryEmbeddingCache = None, answer_cache: AnswerCache = None,
+                  filters: dict = None) -> list:
     """
-    Start a Gradio Interface for the RAG system.
+    predict() for many queries: one encode call and one index search for the whole batch.
+
+    Answer-cache hits and empty questions are answered without touching the
+    model; the rest go through retrieve_batch(), then each answer is composed
+    separately. Outputs match predict() query by query.
+    
+    Returns:
+        List of formatted markdown strings, in input order
+    """
+    queries = list(queries)
+    outputs = [None] * len(queries)
+    k = config.get('top_k', 5)
+    max_quotes = config.get('max_answer_tokens', 300) // 100  # Rough estimate: ~3 quotes
+    
+    cache_keys = {}
+    pending = []
+    for i, query in enumerate(queries):
+        if not query or not query.strip():
+            outputs[i] = "Please enter a question."
+            continue
+        if answer_cache is not None:
+            cache_keys[i] = answer_cache.key(query, k, filter_toc, filters)
+            cached = answer_cache.get(cache_keys[i])
+            if cached is not None:
+                outputs[i] = cached
+                continue
+        pending.append(i)
+    if not pending:
+        return outputs
+    
+    query_vecs = {}
+    def embed_fn(batch: list) -> np.ndarray:
+        embeddings = embed_queries(batch, model, cache=query_cache)
+        query_vecs.update(zip(batch, embeddings))
+        return embeddings
+    
+    exclude_toc, predicate = toc_options(metadata_df, filter_toc)
+    try:
+        results = retrieve_batch(
+            [queries[i] for i in pending],
+            index,
+            embed_fn,
+            metadata_df,
+            chunks_lookup=chunks_lookup,
+            k=k,
+            exclude_toc=exclude_toc,
+            filters=filters,
+            predicate=predicate,
+            **hybrid_options(config, metadata_df)
+        )
+    except Exception as e:
+        for i in pending:
+            outputs[i] = f"Error processing query: {str(e)}\n\nPlease try rephrasing your question."
+        return outputs
+    
+    semantic = config.get('quote_scoring') == 'semantic'
+    for i, retrieved in zip(pending, results):
+        query_vec = query_vecs.get(queries[i]) if semantic else None
+        outputs[i] = render_answer(queries[i], retrieved, max_quotes, query_vec=query_vec,
+                                   filtered=bool(filters) or predicate is not None,
+                                   answer_cache=answer_cache, cache_key=cache_keys.get(i))
+    return outputs
+
+
+def toc_options(metadata_df, filter_toc: bool = True):
+    """
+    (exclude_toc, predicate) for retrieve(): how TOC/header chunks are kept out of results.
+
+    Chunks flagged at index time are skipped inside the search itself; older
+    indexes without flags check each hit instead (oversampling until k pass).
+    """
+    exclude_toc = filter_toc and getattr(metadata_df, 'is_toc', None) is not None
+    predicate = (lambda hit: not is_toc_or_header_chunk(hit)) if filter_toc and not exclude_toc else None
+    return exclude_toc, predicate
+
+
+def render_answer(query: str, retrieved: list, max_quotes: int, query_vec: np.ndarray = None,
+                  filtered: bool = False, answer_cache: AnswerCache = None, cache_key=None) -> str:
+    """
+    Compose and format the answer for one query's retrieved chunks (cached on success).
+
+    Falls back to showing the top raw result if composition fails.
+    """
+    if not retrieved:
+        if filtered:
+            return "No relevant content found after filtering. Try a different query."
+        return "No results found. Try a different query."
+    
+    # Compose answer using retrieved chunks
+    try:
+        composed = compose_answer(query, retrieved, max_quotes=max_quotes, query_vec=query_vec)
+        output = format_composed_answer(composed)
+        if cache_key is not None:
+            answer_cache.put(cache_key, output)
+        return output
+    except Exception as compose_error:
+        # Fallback: show raw retrieval results if composition fails
+        error_msg = f"Error composing answer: {compose_error}\n\n"
+        error_msg += f"Retrieved {len(retrieved)} chunks. Showing top result:\n\n"
+        top_result = retrieved[0]
+        error_msg += f"**Chunk:** {top_result.get('chunk_id', 'unknown')}\n"
+        error_msg += f"**Score:** {top_result.get('score', 0):.4f}\n"
+        error_msg += f"**Text:** {top_result.get('text', '')[:300]}...\n"
+        return error_msg
+
+
+def load_resources(config_path="../configs/app.yaml", index_dir="../data/index",
+                   load_model: bool = True, profiler=None) -> dict:
+    """
+    Load everything a serving process needs: config, index, metadata, model and caches.
+
+    Shared by the Gradio app and the JSON API (src/api.py), so both serve the
+    same loaded objects. With `index.mmap` in the config the FAISS index is
+    memory-mapped, so several worker processes share one copy of its pages.
     
     Args:
         config_path: Path to config YAML file
-        index_dir: Directory containing the FAISS index and metadata
+        index_dir: Directory containing the FAISS index and metadata, or a sharded
+            index root with shards.json
+        load_model: Load the embedding model (and import sentence-transformers);
+            jobs that never embed queries can skip it (model is None)
+        profiler: Optional startup.StartupProfiler timing the config, index,
+            metadata, chunks and model phases
     
     Returns:
-        Gradio Interface object
+        Dict with config, index, metadata, chunks_lookup, model, query_cache, answer_cache
     """
     # Load configuration
-    config = load_config(config_path)
+    with phase(profiler, 'config'):
+        config = load_config(config_path)
     
     print("📚 Loading FAISS index and metadata...")
-    index, metadata_df = load_index(index_dir)
-    
-    print(f"🤖 Loading embedding model: {config['embedding_model']}...")
-    model = SentenceTransformer(config['embedding_model'])
+    index_config = config.get('index') or {}
+    if (Path(index_dir) / SHARD_MANIFEST_FILE).exists():
+        # Multi-book layout: one coordinator acts as both index and metadata
+        with phase(profiler, 'index'):
+            index = metadata_store = ShardedIndex(index_dir, nprobe=index_config.get('nprobe'),
+                                                  ef_search=index_config.get('ef_search'),
+                                                  mmap=index_config.get('mmap', False))
+    else:
+        index, metadata_store = load_index(index_dir, nprobe=index_config.get('nprobe'),
+                                           ef_search=index_config.get('ef_search'),
+                                           mmap=index_config.get('mmap', False), profiler=profiler)
     
-    # Load chunks data for retrieve() function (needs text for compose_answer)
+    # Indexes built without a chunk text store fall back to the chunks JSON
+    # (needed by compose_answer); the text is packed into the store.
     chunks_lookup = None
-    try:
-        import json
-        book_name = config['book']
-        chunks_file = Path(f"data/interim/chunks/{book_name}_chunks.json")
-        if chunks_file.exists():
-            with open(chunks_file, 'r', encoding='utf-8') as f:
-                chunks_list = json.load(f)
-                chunks_lookup = {chunk['id']: chunk for chunk in chunks_list}
-            print(f"✅ Loaded {len(chunks_lookup)} chunks for retrieval and composition")
-        else:
-            print(f"⚠️  Chunks file not found: {chunks_file}")
+    with phase(profiler, 'chunks'):
+        attach_chunks_file(config, metadata_store)
+    
+    model = None
+    if load_model:
+        backend = (config.get('embedding_backend') or {}).get('type', 'torch')
+        print(f"🤖 Loading embedding model: {config['embedding_model']} ({backend})...")
+        with phase(profiler, 'model'):
+            model = load_embedding_model(config['embedding_model'], config.get('embedding_backend'))
+    
+    query_cache = make_query_cache(config)
+    if query_cache is not None and query_cache.path is not None:
+        import atexit
+        atexit.register(query_cache.save)
+    answer_cache = make_answer_cache(config, index_dir, index=index)
+    
+    return {
+        'config': config,
+        'index_dir': index_dir,
+        'index': index,
+        'metadata': metadata_store,
+        'chunks_lookup': chunks_lookup,
+        'model': model,
+        'query_cache': query_cache,
+        'answer_cache': answer_cache,
+    }
+
+
+def attach_chunks_file(config: dict, metadata_store):
+    """Pack text from data/interim/chunks/<book>_chunks.json into a store saved without chunk text."""
+    if metadata_store.text is None and hasattr(metadata_store, 'attach_text'):
+        try:
+            import json
+            book_name = config['book']
+            chunks_file = Path(f"data/interim/chunks/{book_name}_chunks.json")
+            if chunks_file.exists():
+                with open(chunks_file, 'r', encoding='utf-8') as f:
+                    chunks_list = json.load(f)
+                    metadata_store.attach_text({chunk['id']: chunk for chunk in chunks_list})
+                print(f"✅ Loaded {len(chunks_list)} chunks for retrieval and composition")
+                print("   Rebuild the index with save_index(..., chunks=chunks) to memory-map chunk text instead")
+            else:
+                print(f"⚠️  Chunks file not found: {chunks_file}")
+                print("   Retrieval will work but compose_answer may not have chunk text")
+        except Exception as e:
+            print(f"⚠️  Could not load chunks data: {e}")
             print("   Retrieval will work but compose_answer may not have chunk text")
-    except Exception as e:
-        print(f"⚠️  Could not load chunks data: {e}")
-        print("   Retrieval will work but compose_answer may not have chunk text")
+
+
+def build_interface(resources: dict):
+    """
+    Gradio Interface over loaded resources (see load_resources).
+    
+    Returns:
+        Gradio Interface object
+    """
+    config = resources['config']
+    index, metadata_store = resources['index'], resources['metadata']
+    model, chunks_lookup = resources['model'], resources['chunks_lookup']
+    query_cache, answer_cache = resources['query_cache'], resources['answer_cache']
     
     # Create prediction function with loaded resources
     def predict_wrapper(query: str):
-        return predict(query, index, metadata_df, model, config, chunks_lookup, filter_toc=True)
+        return predict(query, index, metadata_store, model, config, chunks_lookup, filter_toc=True,
+                       query_cache=query_cache, answer_cache=answer_cache)
+    
+    # Async mode: concurrent questions are coalesced into one encode + one search
+    serving_config = config.get('serving') or {}
+    batching = serving_config.get('batching', False)
+    if batching:
+        batcher = MicroBatcher(
+            lambda queries: predict_batch(queries, index, metadata_store, model, config, chunks_lookup,
+                                          filter_toc=True, query_cache=query_cache, answer_cache=answer_cache),
+            max_batch_size=serving_config.get('max_batch_size', 32),
+            max_wait_ms=serving_config.get('max_wait_ms', 5),
+        )
+        
+        async def predict_async(query: str):
+            return await batcher.submit(query)
     
     # Create Gradio interface
+    import gradio as gr
     interface = gr.Interface(
-        fn=predict_wrapper,
+        fn=predict_async if batching else predict_wrapper,
         inputs=gr.Textbox(
             label="Question",
             placeholder="Ask a question about the book...",
@@ -249,11 +516,29 @@ def launch_app(config_path="../configs/app.yaml", index_dir="../data/index"):
         ],
         theme=gr.themes.Soft(),
     )
+    if batching:
+        # Let many events reach the batcher at once instead of one at a time
+        interface.queue(default_concurrency_limit=serving_config.get('concurrency', 64))
     
     print("✅ Gradio interface ready!")
     return interface
 
 
+def launch_app(config_path="../configs/app.yaml", index_dir="../data/index"):
+    """
+    Start a Gradio Interface for the RAG system.
+    
+    Args:
+        config_path: Path to config YAML file
+        index_dir: Directory containing the FAISS index and metadata, or a sharded
+            index root with shards.json
+    
+    Returns:
+        Gradio Interface object
+    """
+    return build_interface(load_resources(config_path, index_dir))
+
+
 if __name__ == "__main__":
     interface = launch_app()
     interface.launch(share=False, server_name="0.0.0.0", server_port=7860)
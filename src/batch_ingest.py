@@ -0,0 +1,170 @@
+"""
+Parallel multi-book ingestion: download (thread pool) -> clean + chunk (process pool).
+
+Usage:
+    python -m src.batch_ingest books.yaml --raw-dir data/raw --interim-dir data/interim
+
+Manifest (YAML or JSON), either a list or a mapping:
+
+    books:
+      - {book: dorian, url: "https://www.gutenberg.org/files/174/174-0.txt"}
+      - {book: iliad,  url: "https://www.gutenberg.org/files/6130/6130-0.txt"}
+    # or:  books: {dorian: "https://...", iliad: "https://..."}
+"""
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import json
+import os
+import time
+import yaml
+from src.ingest import download_book
+from src.clean import clean_text
+from src.chunk import split_into_paragraphs, iter_chunks
+
+CHUNK_MANIFEST_FILE = 'chunks_manifest.json'
+
+
+def load_book_manifest(manifest_path: str) -> List[Dict]:
+    """Read a book manifest and return a list of {book, url} dicts."""
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f)  # YAML is a superset of JSON
+    books = data.get('books', data) if isinstance(data, dict) else data
+    if isinstance(books, dict):
+        books = [{'book': name, 'url': url} for name, url in books.items()]
+    entries = []
+    for entry in books:
+        if 'book' not in entry:
+            raise ValueError(f"Manifest entry without 'book': {entry}")
+        entries.append({'book': entry['book'], 'url': entry.get('url')})
+    return entries
+
+
+def clean_and_chunk_book(book: str, raw_path: str, interim_dir: str, size: int, overlap: int) -> Dict:
+    """
+    Clean and chunk one downloaded book and write its outputs (runs in a worker process).
+
+    Writes {interim_dir}/{book}_cleaned.txt and {interim_dir}/chunks/{book}_chunks.json,
+    the same files notebooks 01 and 02 produce.
+    """
+    start = time.perf_counter()
+    interim_path = Path(interim_dir)
+    chunks_dir = interim_path / 'chunks'
+    chunks_dir.mkdir(parents=True, exist_ok=True)
+
+    cleaned = clean_text(raw_path)
+    cleaned_path = interim_path / f"{book}_cleaned.txt"
+    cleaned_path.write_text(cleaned, encoding='utf-8')
+
+    paragraphs = split_into_paragraphs(cleaned)
+    chunks = list(iter_chunks(paragraphs, size, overlap, book))
+    chunks_path = chunks_dir / f"{book}_chunks.json"
+    with open(chunks_path, 'w', encoding='utf-8') as f:
+        json.dump(chunks, f, ensure_ascii=False, indent=2)
+
+    return {
+        'book': book,
+        'raw_path': str(raw_path),
+        'cleaned_path': str(cleaned_path),
+        'chunks_path': str(chunks_path),
+        'n_chars': len(cleaned),
+        'n_paragraphs': len(paragraphs),
+        'n_chunks': len(chunks),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def ingest_books(entries: List[Dict], raw_dir: str, interim_dir: str, size: int, overlap: int,
+                 download_workers: int = 8, workers: int = None) -> Dict:
+    """
+    Download, clean and chunk many books concurrently.
+
+    Downloads are I/O-bound and run on a thread pool; each finished download is
+    handed straight to a process pool for the CPU-bound cleaning and chunking,
+    so both stages overlap. Failures are recorded per book and do not stop the batch.
+
+    Args:
+        entries: List of {book, url} dicts (url may be None for built-in books)
+        raw_dir: Directory for raw downloads
+        interim_dir: Directory for cleaned text and chunk files
+        size: Chunk size in characters
+        overlap: Chunk overlap in characters
+        download_workers: Download threads
+        workers: Clean/chunk processes (default: os.cpu_count())
+
+    Returns:
+        Combined chunk manifest (also written to {interim_dir}/chunks/chunks_manifest.json).
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    books, errors = [], []
+
+    with ThreadPoolExecutor(max_workers=download_workers) as downloads, \
+            ProcessPoolExecutor(max_workers=workers) as processing:
+        download_futures = {
+            downloads.submit(download_book, entry['book'], raw_dir, entry['url']): entry['book']
+            for entry in entries
+        }
+        process_futures = {}
+        for future in as_completed(download_futures):
+            book = download_futures[future]
+            try:
+                raw_path = future.result()
+            except Exception as e:
+                errors.append({'book': book, 'stage': 'download', 'error': str(e)})
+                continue
+            process_futures[processing.submit(
+                clean_and_chunk_book, book, raw_path, interim_dir, size, overlap)] = book
+
+        for future in as_completed(process_futures):
+            book = process_futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append({'book': book, 'stage': 'clean_chunk', 'error': str(e)})
+                continue
+            books.append(result)
+            print(f"✅ {book}: {result['n_chunks']} chunks ({result['seconds']:.2f}s)")
+
+    books.sort(key=lambda entry: entry['book'])
+    manifest = {
+        'chunk_size': size,
+        'chunk_overlap': overlap,
+        'books': books,
+        'errors': errors,
+        'total_chunks': sum(entry['n_chunks'] for entry in books),
+        'total_chars': sum(entry['n_chars'] for entry in books),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+    chunks_dir = Path(interim_dir) / 'chunks'
+    chunks_dir.mkdir(parents=True, exist_ok=True)
+    with open(chunks_dir / CHUNK_MANIFEST_FILE, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"📚 Ingested {len(books)}/{len(entries)} books, {manifest['total_chunks']} chunks "
+          f"in {manifest['seconds']:.1f}s ({workers} processes)")
+    for error in errors:
+        print(f"⚠️  {error['book']} failed during {error['stage']}: {error['error']}")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download, clean and chunk many books in parallel.")
+    parser.add_argument("manifest", help="YAML/JSON manifest of books and URLs")
+    parser.add_argument("--config", default="configs/app.yaml", help="Config YAML (chunk_size, chunk_overlap)")
+    parser.add_argument("--raw-dir", default="data/raw", help="Directory for raw downloads")
+    parser.add_argument("--interim-dir", default="data/interim", help="Directory for cleaned text and chunks")
+    parser.add_argument("--download-workers", type=int, default=8, help="Download threads")
+    parser.add_argument("--workers", type=int, default=None, help="Clean/chunk processes (default: all cores)")
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    ingest_books(load_book_manifest(args.manifest), args.raw_dir, args.interim_dir,
+                 config['chunk_size'], config['chunk_overlap'],
+                 download_workers=args.download_workers, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+"""
+Benchmark harness: latency percentiles, throughput and peak RSS for every pipeline stage.
+
+Usage:
+    python -m src.bench run --size 2000 --queries 200                 # synthetic corpus
+    python -m src.bench run --raw data/raw/dorian.txt --size 5000     # real book, cycled/truncated to 5000 paragraphs
+    python -m src.bench compare data/bench/<old>.json data/bench/<new>.json
+
+Stages: clean_text, chunk_paragraphs, embed_texts, build_faiss_index,
+retrieve, compose_answer. retrieve runs as the app and API serve it, with
+TOC/header chunks excluded inside the search. Corpus stages run `repeats` times
+over the whole corpus; embed_texts is timed per batch and the query stages
+per query. Results are written as JSON named after the git commit, so two
+runs can be compared to catch regressions.
+
+With `--embedder stub` (or `auto` when the model can't be loaded, e.g.
+offline without cached weights) a deterministic hashed bag-of-words
+embedder stands in for the SentenceTransformer: timings of the embedding
+stage then say nothing about the model, but every other stage runs on
+real vectors of the same shape.
+"""
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+import numpy as np
+from src.clean import clean_text, iter_clean_paragraphs
+from src.chunk import split_into_paragraphs, chunk_paragraphs
+from src.embed_index import embed_texts, build_faiss_index
+from src.retrieve import retrieve
+from src.compose import compose_answer
+from src.config import load_config
+from src.sparse import tokenize
+from src.store import MetadataStore
+from src.app import toc_options
+
+
+class HashEmbedder:
+    """
+    Offline stand-in for a SentenceTransformer: signed hashed bag-of-words vectors.
+
+    Deterministic across processes and runs, and texts sharing words get
+    similar vectors, so retrieval and quote selection behave sensibly.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = True,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                h = zlib.crc32(token.encode('utf-8'))
+                vectors[row, (h >> 1) % self.dim] += 1.0 if h & 1 else -1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.maximum(norms, 1e-12)
+        return vectors[0] if single else vectors
+
+
+def synthetic_book(n_paragraphs: int = 2000, seed: int = 0, chapter_every: int = 40) -> str:
+    """
+    A raw Gutenberg-style book (markers, title, contents, chapters) of `n_paragraphs` paragraphs.
+
+    Words follow a Zipf-like frequency distribution and paragraph lengths
+    vary widely (1-12 sentences), like real prose.
+    """
+    rng = np.random.default_rng(seed)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    vocab = [''.join(rng.choice(letters, size=rng.integers(2, 10))) for _ in range(3000)]
+    weights = 1.0 / np.arange(1, len(vocab) + 1)
+    weights /= weights.sum()
+
+    def sentence() -> str:
+        words = [vocab[i] for i in rng.choice(len(vocab), size=rng.integers(6, 25), p=weights)]
+        return ' '.join(words).capitalize() + rng.choice(['.', '.', '.', '?', '!'])
+
+    def wrap(text: str, width: int = 70) -> List[str]:
+        lines, line = [], ''
+        for word in text.split(' '):
+            if line and len(line) + 1 + len(word) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        return lines + [line]
+
+    n_chapters = max(1, -(-n_paragraphs // chapter_every))
+    numerals = [_roman(i + 1) for i in range(n_chapters)]
+    lines = ["The Project Gutenberg eBook of Synthetic Book", "",
+             "*** START OF THE PROJECT GUTENBERG EBOOK 0 ***", "",
+             "Synthetic Book", "", "by Bench Mark", "", "Contents", ""]
+    lines += [f"CHAPTER {numeral}." for numeral in numerals] + [""]
+    for p in range(n_paragraphs):
+        if p % chapter_every == 0:
+            lines += ["", f"CHAPTER {numerals[p // chapter_every]}.", ""]
+        lines += wrap(' '.join(sentence() for _ in range(rng.integers(1, 13)))) + [""]
+    lines += ["*** END OF THE PROJECT GUTENBERG EBOOK 0 ***", ""]
+    return '\n'.join(lines)
+
+
+def _roman(n: int) -> str:
+    numerals = ((1000, 'M'), (900, 'CM'), (500, 'D'), (400, 'CD'), (100, 'C'), (90, 'XC'),
+                (50, 'L'), (40, 'XL'), (10, 'X'), (9, 'IX'), (5, 'V'), (4, 'IV'), (1, 'I'))
+    out = ''
+    for value, symbol in numerals:
+        while n >= value:
+            out += symbol
+            n -= value
+    return out
+
+
+def make_corpus(out_path: str, raw_path: str = None, n_paragraphs: int = None, seed: int = 0) -> str:
+    """
+    Write the benchmark's raw input file and return its path.
+
+    Without `raw_path` a synthetic book of `n_paragraphs` (default 2000) is
+    written. A real book is used as is, or, with `n_paragraphs`, its cleaned
+    paragraphs are cycled or truncated to that count and re-wrapped in
+    Gutenberg markers, so corpus size can be scaled independently of the book.
+    """
+    if raw_path is None:
+        text = synthetic_book(n_paragraphs or 2000, seed=seed)
+    elif n_paragraphs is None:
+        return str(raw_path)
+    else:
+        paragraphs = list(iter_clean_paragraphs(raw_path))
+        paragraphs = [paragraphs[i % len(paragraphs)] for i in range(n_paragraphs)]
+        text = '\n\n'.join(["*** START OF THE PROJECT GUTENBERG EBOOK 0 ***", *paragraphs,
+                            "*** END OF THE PROJECT GUTENBERG EBOOK 0 ***"])
+    with open(out_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return str(out_path)
+
+
+def sample_queries(chunks: List[Dict], n: int, seed: int = 0) -> List[str]:
+    """Questions made of 3-6 consecutive words from random chunks (deterministic for a seed)."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(0, len(chunks), size=n):
+        words = chunks[i]['text'].split()
+        length = int(rng.integers(3, 7))
+        start = int(rng.integers(0, max(1, len(words) - length)))
+        queries.append(' '.join(words[start:start + length]))
+    return queries
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize(stage: str, latencies: List[float], items: int, unit: str) -> Dict:
+    """
+    Stage row from per-call latencies (seconds).
+
+    Returns:
+        {stage, calls, unit, items, p50_ms, p95_ms, p99_ms, mean_ms, throughput, peak_rss_mb}
+        where throughput is `unit`s per second over all timed calls and
+        peak_rss_mb the process high-water mark once the stage has run.
+    """
+    ms = np.asarray(latencies) * 1000.0
+    return {
+        'stage': stage,
+        'calls': len(latencies),
+        'unit': unit,
+        'items': items,
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'mean_ms': round(float(ms.mean()), 3),
+        'throughput': round(items / max(float(np.sum(latencies)), 1e-12), 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _time_calls(fn, args_list) -> tuple:
+    """Call fn(*args) for each args tuple; return (latencies, last result)."""
+    latencies, result = [], None
+    for args in args_list:
+        start = time.perf_counter()
+        result = fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies, result
+
+
+def load_embedder(embedder: str = 'auto', model_name: str = None, backend_config=None, dim: int = 384):
+    """
+    Model for the embedding stages: 'model' (configured SentenceTransformer),
+    'stub' (HashEmbedder) or 'auto' (the model if it loads, else the stub).
+
+    Returns:
+        (model, description)
+    """
+    if embedder not in ('auto', 'model', 'stub'):
+        raise ValueError(f"Unknown embedder: {embedder}. Must be one of ('auto', 'model', 'stub').")
+    if embedder != 'stub' and model_name:
+        try:
+            from src.embed_backend import load_embedding_model, embedding_model_id
+            return load_embedding_model(model_name, backend_config), embedding_model_id(model_name, backend_config)
+        except Exception as e:
+            if embedder == 'model':
+                raise
+            print(f"⚠️  Could not load {model_name} ({type(e).__name__}); using the stub embedder")
+    return HashEmbedder(dim), f"stub-hash-{dim}"
+
+
+def run_benchmarks(raw_path: str = None, size: int = None, n_queries: int = 200, repeats: int = 5,
+                   k: int = 5, chunk_size: int = 800, overlap: int = 120, embed_batch: int = 64,
+                   embedder: str = 'auto', model_name: str = None, backend_config=None,
+                   index_config: dict = None, max_quotes: int = 3, seed: int = 0) -> Dict:
+    """
+    Time every pipeline stage on one corpus.
+
+    Args:
+        raw_path: Real Gutenberg book; None = synthetic corpus
+        size: Corpus size in paragraphs (synthetic default 2000; real books are cycled/truncated)
+        n_queries: Queries timed through retrieve (TOC excluded) / compose_answer
+        repeats: Runs of each whole-corpus stage (clean, chunk, index build)
+        k: Results per query
+        chunk_size / overlap: chunk_paragraphs settings
+        embed_batch: Chunks per timed embed_texts call
+        embedder / model_name / backend_config: see load_embedder
+        index_config: `index:` config section for build_faiss_index
+        max_quotes: compose_answer quotes per answer
+        seed: Seed for the synthetic corpus and query sampling
+
+    Returns:
+        {'meta': {...run environment and corpus...}, 'stages': [summarize() rows]}
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_corpus(str(Path(tmp) / 'corpus.txt'), raw_path=raw_path, n_paragraphs=size, seed=seed)
+        mb = Path(path).stat().st_size / 1e6
+
+        latencies, cleaned = _time_calls(clean_text, [(path,)] * repeats)
+        rows.append(summarize('clean_text', latencies, round(mb * repeats, 3), 'MB'))
+
+    paragraphs = split_into_paragraphs(cleaned)
+    latencies, chunks = _time_calls(chunk_paragraphs, [(paragraphs, chunk_size, overlap, 'bench')] * repeats)
+    rows.append(summarize('chunk_paragraphs', latencies, len(paragraphs) * repeats, 'paragraphs'))
+
+    model, model_id = load_embedder(embedder, model_name, backend_config)
+    texts = [chunk['text'] for chunk in chunks]
+    batches = [(texts[i:i + embed_batch], model_id, None, embed_batch, None, model, False)
+               for i in range(0, len(texts), embed_batch)]
+    embed_texts(*batches[0])  # warm-up (first-call allocations, lazy kernels)
+    latencies, embeddings = [], []
+    for batch in batches:
+        start = time.perf_counter()
+        embeddings.append(embed_texts(*batch)[0])
+        latencies.append(time.perf_counter() - start)
+    embeddings = np.vstack(embeddings)
+    rows.append(summarize('embed_texts', latencies, len(texts), 'chunks'))
+
+    latencies, index = _time_calls(build_faiss_index, [(embeddings, index_config)] * repeats)
+    rows.append(summarize('build_faiss_index', latencies, len(texts) * repeats, 'vectors'))
+
+    metadata = MetadataStore.from_frame({
+        'chunk_id': [chunk['id'] for chunk in chunks],
+        'book': [chunk['meta']['book'] for chunk in chunks],
+        'para_idx_start': [chunk['meta']['para_idx_start'] for chunk in chunks],
+        'para_idx_end': [chunk['meta']['para_idx_end'] for chunk in chunks],
+        'char_count': [chunk['meta']['char_count'] for chunk in chunks],
+        'text': texts,
+    })
+    queries = sample_queries(chunks, n_queries, seed=seed)
+    embed_fn = lambda query: model.encode([query], normalize_embeddings=True, show_progress_bar=False)[0]
+    exclude_toc, predicate = toc_options(metadata, filter_toc=True)
+    retrieve(queries[0], index, embed_fn, metadata, k=k, exclude_toc=exclude_toc, predicate=predicate)  # warm-up
+
+    stage_latencies = {'retrieve': [], 'compose_answer': []}
+    for query in queries:
+        start = time.perf_counter()
+        results = retrieve(query, index, embed_fn, metadata, k=k, exclude_toc=exclude_toc, predicate=predicate)
+        composed_at = time.perf_counter()
+        compose_answer(query, results, max_quotes=max_quotes)
+        end = time.perf_counter()
+        stage_latencies['retrieve'].append(composed_at - start)
+        stage_latencies['compose_answer'].append(end - composed_at)
+    for stage, latencies in stage_latencies.items():
+        rows.append(summarize(stage, latencies, len(queries), 'queries'))
+
+    meta = {
+        **git_revision(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': {
+            'source': str(raw_path) if raw_path else 'synthetic',
+            'size': size,
+            'seed': seed,
+            'mb': round(mb, 3),
+            'paragraphs': len(paragraphs),
+            'chunks': len(chunks),
+        },
+        'embedder': model_id,
+        'settings': {'n_queries': n_queries, 'repeats': repeats, 'k': k, 'chunk_size': chunk_size,
+                     'overlap': overlap, 'embed_batch': embed_batch, 'index': index_config or {}},
+    }
+    return {'meta': meta, 'stages': rows}
+
+
+def git_revision() -> Dict:
+    """{'commit': short hash, 'dirty': bool} of the working tree (commit None outside git)."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                capture_output=True, text=True, check=True).stdout
+        return {'commit': commit, 'dirty': bool(status.strip())}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+def print_report(report: Dict):
+    """Print the stage table of a run_benchmarks() report."""
+    corpus = report['meta']['corpus']
+    print(f"📊 {corpus['source']}: {corpus['mb']} MB, {corpus['paragraphs']} paragraphs, "
+          f"{corpus['chunks']} chunks, embedder {report['meta']['embedder']}")
+    print(f"{'stage':<18} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'throughput':>22} {'peak MB':>8}")
+    for row in report['stages']:
+        throughput = f"{row['throughput']:.1f} {row['unit']}/s"
+        print(f"{row['stage']:<18} {row['calls']:>6} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} "
+              f"{row['p99_ms']:>9.3f} {throughput:>22} {row['peak_rss_mb'] or 0:>8.1f}")
+
+
+def save_report(report: Dict, out_path: str = None, out_dir: str = "data/bench") -> str:
+    """Write a report as JSON (default: <out_dir>/<commit>[-dirty].json) and return the path."""
+    if out_path is None:
+        meta = report['meta']
+        name = (meta.get('commit') or 'nogit') + ('-dirty' if meta.get('dirty') else '')
+        out_path = Path(out_dir) / f"{name}.json"
+    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Saved benchmark results: {out_path}")
+    return str(out_path)
+
+
+def compare_reports(baseline: Dict, current: Dict, threshold: float = 0.10,
+                    metrics=('p50_ms', 'p95_ms')) -> List[Dict]:
+    """
+    Per-stage latency change from `baseline` to `current` (run_benchmarks() reports or JSON paths).
+
+    A stage regresses when any of `metrics` grows by more than `threshold`
+    (0.10 = 10%). p99 is left out by default: with few calls it is the
+    single slowest one and too noisy to gate on.
+
+    Returns:
+        One row per stage in both reports: {stage, <metric>_base, <metric>_new,
+        <metric>_change, regressed}; changes are relative (0.25 = 25% slower).
+    """
+    reports = []
+    for report in (baseline, current):
+        if not isinstance(report, dict):
+            with open(report, 'r', encoding='utf-8') as f:
+                report = json.load(f)
+        reports.append(report)
+    baseline, current = reports
+
+    for key in ('corpus', 'embedder', 'settings'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print(f"⚠️  Runs differ in {key}; latency changes may not be comparable")
+
+    base_rows = {row['stage']: row for row in baseline['stages']}
+    rows = []
+    for new in current['stages']:
+        base = base_rows.get(new['stage'])
+        if base is None:
+            continue
+        row = {'stage': new['stage']}
+        for metric in metrics:
+            row[f'{metric}_base'] = base[metric]
+            row[f'{metric}_new'] = new[metric]
+            row[f'{metric}_change'] = round(new[metric] / base[metric] - 1.0, 3) if base[metric] else 0.0
+        row['regressed'] = any(row[f'{metric}_change'] > threshold for metric in metrics)
+        rows.append(row)
+
+    print(f"📊 {baseline['meta'].get('commit')} -> {current['meta'].get('commit')} "
+          f"(regression threshold {threshold:.0%})")
+    print(f"{'stage':<18} " + ' '.join(f"{metric + ' base':>12} {metric + ' new':>12} {'change':>8}"
+                                        for metric in metrics))
+    for row in rows:
+        cells = ' '.join(f"{row[f'{metric}_base']:>12.3f} {row[f'{metric}_new']:>12.3f} "
+                         f"{row[f'{metric}_change']:>+8.1%}" for metric in metrics)
+        print(f"{row['stage']:<18} {cells} {'⚠️  regression' if row['regressed'] else ''}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages and compare runs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Benchmark every stage and save JSON results")
+    run.add_argument("--raw", default=None, help="Real raw Gutenberg book (default: synthetic corpus)")
+    run.add_argument("--size", type=int, default=None, help="Corpus size in paragraphs")
+    run.add_argument("--queries", type=int, default=200, help="Queries for the retrieval/composition stages")
+    run.add_argument("--repeats", type=int, default=5, help="Runs of each whole-corpus stage")
+    run.add_argument("--embedder", default="auto", choices=("auto", "model", "stub"),
+                     help="auto: configured model if it loads, else the offline stub")
+    run.add_argument("--config", default="configs/app.yaml", help="Config YAML (model, chunking, index, top_k)")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--out", default=None, help="Output JSON (default: data/bench/<commit>.json)")
+
+    compare = commands.add_parser("compare", help="Compare two saved runs")
+    compare.add_argument("baseline", help="Baseline results JSON")
+    compare.add_argument("current", help="New results JSON")
+    compare.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown counted as regression")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        rows = compare_reports(args.baseline, args.current, threshold=args.threshold)
+        sys.exit(1 if any(row['regressed'] for row in rows) else 0)
+
+    config = load_config(args.config)
+    report = run_benchmarks(
+        raw_path=args.raw,
+        size=args.size,
+        n_queries=args.queries,
+        repeats=args.repeats,
+        k=config.get('top_k', 5),
+        chunk_size=config.get('chunk_size', 800),
+        overlap=config.get('chunk_overlap', 120),
+        embedder=args.embedder,
+        model_name=config.get('embedding_model'),
+        backend_config=config.get('embedding_backend'),
+        index_config=config.get('index'),
+        max_quotes=config.get('max_answer_tokens', 300) // 100,  # Same heuristic as predict()
+        seed=args.seed,
+    )
+    print_report(report)
+    save_report(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
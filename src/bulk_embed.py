@@ -0,0 +1,244 @@
+"""
+Bulk corpus embedding for index builds: length-bucketed batches, a process pool,
+a preallocated output matrix, and checkpoint/resume.
+
+Usage:
+    python -m src.pipeline --book dorian --out-dir data/index --bulk-workers 4   # index build
+    python -m src.bulk_embed data/interim/chunks/dorian_chunks.json --out-dir data/embeddings --workers 4
+
+    # or, in a build script (call under `if __name__ == "__main__":`, workers are spawned):
+    embeddings = embed_corpus([c['text'] for c in chunks], config['embedding_model'], 'data/embeddings', workers=4)
+    build_index_streaming(chunks, config['embedding_model'], 'data/index', embeddings=embeddings)
+
+Chunk length is measured in characters (a proxy for tokens). Each worker
+process gets cores // workers math-library threads, so processes don't
+compete for cores and throughput grows with the number of processes.
+
+Output directory:
+
+    embeddings.f32        float32 (n, d) matrix, row i = text i (memory-mapped, preallocated)
+    embeddings.json       {model_id, n, dim, corpus digest, batch plan settings}
+    embeddings_done.npy   bool per planned batch; a rerun encodes only unfinished batches
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+from src.cache import text_digest
+from src.config import load_config
+from src.embed_backend import load_embedding_model, embedding_model_id
+
+VECTORS_FILE = 'embeddings.f32'
+META_FILE = 'embeddings.json'
+DONE_FILE = 'embeddings_done.npy'
+
+
+def plan_batches(texts: List[str], max_batch_chars: int = 32768, max_batch_size: int = 256) -> List[np.ndarray]:
+    """
+    Group texts of similar length into batches sized for a constant padded cost.
+
+    Texts are sorted by length, so each batch pads to a length close to that of
+    its members; a batch grows while batch_size * longest_text stays within
+    `max_batch_chars`, which gives short chunks large batches and the
+    paragraph-overshoot outliers small ones.
+
+    Returns:
+        List of row-index arrays (deterministic for the same texts and settings).
+    """
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    order = np.argsort(lengths, kind='stable')
+    batches, start = [], 0
+    while start < len(order):
+        end = start + 1
+        # Sorted ascending: the last member is the longest, so the padded cost is size * its length
+        while (end < len(order) and end - start < max_batch_size
+               and (end - start + 1) * max(1, lengths[order[end]]) <= max_batch_chars):
+            end += 1
+        batches.append(order[start:end])
+        start = end
+    return batches
+
+
+def corpus_digest(texts: List[str]) -> str:
+    """SHA-1 over the texts' digests in order (identifies the corpus a checkpoint belongs to)."""
+    sha = hashlib.sha1()
+    for text in texts:
+        sha.update(text_digest(text))
+    return sha.hexdigest()
+
+
+# Worker process state: the model and the output matrix, opened once per process
+_worker = {}
+
+
+def _init_worker(model_name: str, backend_config, threads: int):
+    if threads:
+        # Keep per-process BLAS/OpenMP pools small so processes don't oversubscribe cores
+        for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+            os.environ[var] = str(threads)
+    _worker['model'] = load_embedding_model(model_name, backend_config)
+    if threads:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+
+
+def _worker_dimension() -> int:
+    return _worker['model'].get_sentence_embedding_dimension()
+
+
+def _encode_batch(batch_no: int, rows: np.ndarray, texts: List[str], vectors_path: str, shape) -> int:
+    """Encode one batch and write it straight into the shared output matrix."""
+    vectors = _worker['model'].encode(texts, batch_size=len(texts), normalize_embeddings=True,
+                                      show_progress_bar=False)
+    if 'vectors' not in _worker:
+        # The matrix is created after the pool starts (its width comes from the model), so map it on first use
+        _worker['vectors'] = np.memmap(vectors_path, dtype=np.float32, mode='r+', shape=tuple(shape))
+    out = _worker['vectors']
+    out[rows] = np.asarray(vectors, dtype=np.float32)
+    out.flush()
+    return batch_no
+
+
+def _save_done(out_path: Path, done: np.ndarray):
+    tmp_path = out_path / (DONE_FILE + '.tmp.npy')
+    np.save(tmp_path, done)
+    tmp_path.replace(out_path / DONE_FILE)
+
+
+def embed_corpus(texts: List[str], model_name: str, out_dir: str, backend_config=None, workers: int = 1,
+                 max_batch_chars: int = 32768, max_batch_size: int = 256, threads_per_worker: int = None,
+                 checkpoint_every: int = 16) -> np.memmap:
+    """
+    Embed a whole corpus into a preallocated, memory-mapped (n, d) matrix.
+
+    Batches come from plan_batches (length-bucketed). With workers > 1 each
+    batch runs in a process pool; every worker loads the model once and
+    writes its rows directly into the shared output file, so only row
+    indices and texts cross process boundaries. Finished batches are
+    recorded every `checkpoint_every` batches (and at the end); rerunning
+    with the same texts and settings resumes where an interrupted build
+    stopped.
+
+    Args:
+        texts: Chunk texts, in index row order
+        model_name: SentenceTransformer model name
+        out_dir: Directory for the matrix and checkpoint files
+        backend_config: Optional `embedding_backend:` config (torch, onnx, onnx_int8)
+        workers: Encoding processes (1 = encode in this process)
+        max_batch_chars / max_batch_size: Batch planning limits (see plan_batches)
+        threads_per_worker: Math-library threads per process (default: cores // workers)
+        checkpoint_every: Batches between checkpoint writes
+
+    Returns:
+        Read-only np.memmap of shape (n, d), row-aligned with `texts` (a plain
+        empty array when there are no texts).
+    """
+    start = time.perf_counter()
+    texts = list(texts)
+    if not texts:
+        # Nothing to encode, and an empty matrix file can't be memory-mapped
+        _init_worker(model_name, backend_config, None)
+        dim = _worker_dimension()
+        _worker.clear()
+        return np.zeros((0, dim), dtype=np.float32)
+    out_path = Path(out_dir)
+    out_path.mkdir(parents=True, exist_ok=True)
+    batches = plan_batches(texts, max_batch_chars=max_batch_chars, max_batch_size=max_batch_size)
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // max(1, workers))
+    meta = {
+        'model_id': embedding_model_id(model_name, backend_config),
+        'n': len(texts),
+        'corpus_digest': corpus_digest(texts),
+        'max_batch_chars': max_batch_chars,
+        'max_batch_size': max_batch_size,
+        'n_batches': len(batches),
+    }
+
+    # Resume only a checkpoint of the same corpus, model and batch plan
+    done = np.zeros(len(batches), dtype=bool)
+    meta_path = out_path / META_FILE
+    if meta_path.exists() and (out_path / DONE_FILE).exists():
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        if {key: saved.get(key) for key in meta} == meta:
+            done = np.load(out_path / DONE_FILE)
+            meta['dim'] = saved['dim']
+            print(f"📦 Resuming: {int(done.sum())}/{len(batches)} batches already embedded")
+        else:
+            print(f"⚠️  Ignoring checkpoint in {out_path}: different corpus, model or batch plan")
+
+    vectors_path = out_path / VECTORS_FILE
+    pending = [b for b in range(len(batches)) if not done[b]]
+    ctx = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                               initializer=_init_worker,
+                               initargs=(model_name, backend_config, threads)) if workers > 1 and pending else None
+    try:
+        if 'dim' not in meta:
+            if pool is not None:
+                meta['dim'] = pool.submit(_worker_dimension).result()
+            else:
+                _init_worker(model_name, backend_config, None)
+                meta['dim'] = _worker_dimension()
+            # Preallocate the full matrix once; batches fill their own rows
+            with open(vectors_path, 'wb') as f:
+                f.truncate(len(texts) * meta['dim'] * 4)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=2)
+            _save_done(out_path, done)
+        shape = (len(texts), meta['dim'])
+
+        tasks = ((b, batches[b], [texts[i] for i in batches[b]], str(vectors_path), shape) for b in pending)
+        if pool is not None:
+            futures = [pool.submit(_encode_batch, *task) for task in tasks]
+            finished = (future.result() for future in as_completed(futures))
+        else:
+            if 'model' not in _worker:
+                _init_worker(model_name, backend_config, None)
+            finished = (_encode_batch(*task) for task in tasks)
+        for n_finished, batch_no in enumerate(finished, 1):
+            done[batch_no] = True
+            if n_finished % checkpoint_every == 0:
+                _save_done(out_path, done)
+    finally:
+        _save_done(out_path, done)
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        _worker.clear()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Embedded {len(texts)} texts in {len(batches)} batches with {workers} process(es) "
+          f"in {elapsed:.1f}s ({len(texts) / max(elapsed, 1e-9):.0f} texts/s)")
+    return np.memmap(vectors_path, dtype=np.float32, mode='r', shape=shape)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed chunk files into a preallocated matrix (resumable).")
+    parser.add_argument("chunk_files", nargs='+', help="Chunk JSON files (notebook 02 / batch_ingest output)")
+    parser.add_argument("--config", default="configs/app.yaml", help="Config YAML (embedding_model, embedding_backend)")
+    parser.add_argument("--out-dir", default="data/embeddings", help="Output directory")
+    parser.add_argument("--workers", type=int, default=1, help="Encoding processes")
+    parser.add_argument("--max-batch-chars", type=int, default=32768, help="Padded characters per batch")
+    parser.add_argument("--max-batch-size", type=int, default=256, help="Texts per batch")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    texts = []
+    for path in args.chunk_files:
+        with open(path, 'r', encoding='utf-8') as f:
+            texts.extend(chunk['text'] for chunk in json.load(f))
+    embed_corpus(texts, config['embedding_model'], args.out_dir, backend_config=config.get('embedding_backend'),
+                 workers=args.workers, max_batch_chars=args.max_batch_chars, max_batch_size=args.max_batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Bounded in-process caches (LRU + optional TTL) with hit/miss/eviction counters.
+"""
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable
+import hashlib
+import json
+import threading
+import time
+import numpy as np
+
+
+_MISSING = object()
+
+
+def normalize_query(query: str) -> str:
+    """
+    Canonical cache key for a query: trimmed, whitespace-collapsed, lowercased.
+
+    Safe for uncased embedding models such as all-MiniLM-L6-v2, whose tokenizer
+    lowercases and splits on whitespace anyway.
+    """
+    return " ".join(query.lower().split())
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with optional time-to-live.
+
+    Args:
+        maxsize: Maximum number of entries; the least recently used entry is evicted beyond it
+        ttl: Optional entry lifetime in seconds (None = entries never expire)
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = int(maxsize)
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default=None):
+        """Return the cached value for `key` (marking it recently used), or `default`."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            stored_at, value = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, stored_at: float = None):
+        """Insert or refresh `key`, evicting least recently used entries beyond `maxsize`."""
+        with self._lock:
+            self._data[key] = (time.time() if stored_at is None else stored_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all entries (counters are kept)."""
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        """Snapshot of (key, stored_at, value) tuples, least recently used first."""
+        with self._lock:
+            return [(key, stored_at, value) for key, (stored_at, value) in self._data.items()]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def stats(self) -> Dict[str, float]:
+        """Counters plus hit rate, for logging and dashboards."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class QueryEmbeddingCache(LRUCache):
+    """
+    LRU/TTL cache of query embeddings keyed on (model name, normalized query).
+
+    Optionally persisted to a `.npz` file so warm entries survive restarts.
+
+    Args:
+        model_name: Embedding model the vectors belong to (part of every key)
+        maxsize: Maximum number of cached queries
+        ttl: Optional entry lifetime in seconds
+        path: Optional .npz path used by load() / save()
+    """
+
+    def __init__(self, model_name: str, maxsize: int = 4096, ttl: float = None, path: str = None):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.model_name = model_name
+        self.path = Path(path) if path else None
+
+    def key(self, query: str):
+        return (self.model_name, normalize_query(query))
+
+    def get_embedding(self, query: str):
+        """Return the cached embedding for `query`, or None."""
+        return self.get(self.key(query))
+
+    def put_embedding(self, query: str, embedding: np.ndarray):
+        """Cache a read-only copy of `embedding` for `query`."""
+        vector = np.array(embedding, dtype=np.float32)
+        vector.flags.writeable = False
+        self.put(self.key(query), vector)
+
+    def save(self, path: str = None):
+        """Write live entries for this model to a .npz file."""
+        path = Path(path) if path else self.path
+        if path is None:
+            raise ValueError("No cache path configured")
+        now = time.time()
+        entries = [
+            (key[1], stored_at, vector) for key, stored_at, vector in self.items()
+            if key[0] == self.model_name and (self.ttl is None or now - stored_at <= self.ttl)
+        ]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        queries = np.array([q for q, _, _ in entries], dtype=str)
+        stored = np.array([t for _, t, _ in entries], dtype=np.float64)
+        vectors = np.stack([v for _, _, v in entries]) if entries else np.zeros((0, 0), dtype=np.float32)
+        with open(path, 'wb') as f:
+            np.savez(f, model_name=np.array(self.model_name), queries=queries,
+                     stored_at=stored, vectors=vectors)
+        print(f"✅ Saved {len(entries)} cached query embeddings to: {path}")
+
+    def load(self, path: str = None) -> int:
+        """Load entries saved for the same model; returns the number of entries restored."""
+        path = Path(path) if path else self.path
+        if path is None or not path.exists():
+            return 0
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['model_name']) != self.model_name:
+                print(f"⚠️  Ignoring query cache {path}: built for {data['model_name']}")
+                return 0
+            now = time.time()
+            restored = 0
+            # Oldest first so the most recent entries end up most recently used
+            for i in np.argsort(data['stored_at'], kind='stable'):
+                stored_at = float(data['stored_at'][i])
+                if self.ttl is not None and now - stored_at > self.ttl:
+                    continue
+                vector = np.array(data['vectors'][i], dtype=np.float32)
+                vector.flags.writeable = False
+                self.put((self.model_name, str(data['queries'][i])), vector, stored_at=stored_at)
+                restored += 1
+        print(f"✅ Restored {restored} cached query embeddings from: {path}")
+        return restored
+
+
+def index_fingerprint(index_dir: str) -> str:
+    """
+    Version string for the index files on disk (names, sizes, modification times).
+
+    Changes whenever any file in `index_dir` is rewritten, added or removed.
+    For a sharded index root, the files of every shard directory listed in
+    its shards.json count too, so rebuilding a shard in place is detected
+    as well as a manifest change.
+    """
+    index_path = Path(index_dir)
+    if not index_path.exists():
+        return "missing"
+    digest = hashlib.sha1()
+    _hash_dir_files(digest, index_path)
+    manifest_path = index_path / 'shards.json'  # shards.MANIFEST_FILE (shards imports this module)
+    if manifest_path.exists():
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f).get('shards', {})
+        except (OSError, ValueError):
+            entries = {}
+        for name in sorted(entries):
+            digest.update(f"[{name}:{entries[name]['path']}]".encode('utf-8'))
+            _hash_dir_files(digest, index_path / entries[name]['path'])
+    return digest.hexdigest()[:16]
+
+
+def _hash_dir_files(digest, directory: Path):
+    if not directory.is_dir():
+        return
+    for path in sorted(p for p in directory.iterdir() if p.is_file()):
+        stat = path.stat()
+        digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns};".encode('utf-8'))
+
+
+def config_hash(config: dict) -> str:
+    """Stable short hash of a configuration dict."""
+    payload = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class AnswerCache(LRUCache):
+    """
+    LRU/TTL cache of final `predict()` outputs.
+
+    Keys are (normalized query, top_k, filter_toc, index version, config hash).
+    The index version is re-read from disk at most every `check_interval`
+    seconds; when the index files change, `on_change` is called (e.g.
+    ShardedIndex.refresh, which starts serving rebuilt shards) and every
+    cached answer is dropped.
+
+    Dropping answers does not reload the index a process searches: without
+    an `on_change` that does, a rebuilt single-directory index is only
+    served after a restart, and answers until then come from the index
+    loaded at start-up.
+
+    Args:
+        index_dir: Directory holding the served index files
+        config: Configuration dict the answers are produced with
+        maxsize: Maximum number of cached answers
+        ttl: Optional entry lifetime in seconds
+        check_interval: Seconds between index fingerprint checks
+        on_change: Optional function called (no arguments) when the index files change
+    """
+
+    def __init__(self, index_dir: str, config: dict, maxsize: int = 1024, ttl: float = None,
+                 check_interval: float = 1.0, on_change=None):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.index_dir = index_dir
+        self.config_hash = config_hash(config)
+        self.check_interval = check_interval
+        self.on_change = on_change
+        self.index_version = index_fingerprint(index_dir)
+        self.invalidations = 0
+        self._checked_at = time.monotonic()
+
+    def _refresh_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = index_fingerprint(self.index_dir)
+        if version != self.index_version:
+            self.index_version = version
+            self.invalidations += 1
+            if self.on_change is not None:
+                try:
+                    self.on_change()
+                except Exception as e:
+                    print(f"⚠️  Could not reload the index after a change on disk: {e}")
+            self.clear()
+
+    def key(self, query: str, top_k: int, filter_toc: bool, filters: Dict = None):
+        self._refresh_version()
+        filter_key = tuple(sorted((name, repr(value)) for name, value in (filters or {}).items()))
+        return (normalize_query(query), top_k, filter_toc, filter_key, self.index_version, self.config_hash)
+
+    def stats(self) -> Dict[str, float]:
+        stats = super().stats()
+        stats['invalidations'] = self.invalidations
+        stats['index_version'] = self.index_version
+        return stats
+
+
+def text_digest(text: str) -> bytes:
+    """SHA-1 digest of a chunk's UTF-8 text (20 bytes)."""
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+class ChunkEmbeddingCache:
+    """
+    Persistent embedding cache keyed on (model name, SHA-1 of chunk text).
+
+    Each model gets its own directory holding an append-only float32 matrix
+    (`vectors.f32`, memory-mapped for reads), the row-aligned digests
+    (`hashes.npy`) and a small `meta.json` whose row count is written last,
+    so an interrupted append is simply ignored on the next open.
+
+    Args:
+        cache_dir: Root directory of the cache
+        model_name: Embedding model the vectors belong to
+    """
+
+    VECTORS_FILE = 'vectors.f32'
+    HASHES_FILE = 'hashes.npy'
+    META_FILE = 'meta.json'
+
+    def __init__(self, cache_dir: str, model_name: str):
+        safe_name = "".join(c if c.isalnum() or c in '-_.' else '_' for c in model_name)
+        self.path = Path(cache_dir) / safe_name
+        self.model_name = model_name
+        self.dim = None
+        self.count = 0
+        self._hashes = np.zeros(0, dtype='S20')
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._order = np.zeros(0, dtype=np.int64)
+        self._sorted = self._hashes
+        self._open()
+
+    def _open(self):
+        meta_path = self.path / self.META_FILE
+        if not meta_path.exists():
+            return
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('model_name') != self.model_name:
+            raise ValueError(f"Embedding cache {self.path} belongs to {meta.get('model_name')}")
+        self.dim = int(meta['dim'])
+        self.count = int(meta['count'])
+        self._hashes = np.load(self.path / self.HASHES_FILE)[:self.count]
+        if self.count:
+            self._vectors = np.memmap(self.path / self.VECTORS_FILE, dtype=np.float32, mode='r',
+                                      shape=(self.count, self.dim))
+        # Sorted view of the digests for vectorized lookups
+        self._order = np.argsort(self._hashes, kind='stable')
+        self._sorted = self._hashes[self._order]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def lookup(self, digests: np.ndarray) -> np.ndarray:
+        """Return the cache row for each digest, or -1 when it is not cached."""
+        digests = np.asarray(digests, dtype='S20')
+        rows = np.full(len(digests), -1, dtype=np.int64)
+        if self.count == 0 or len(digests) == 0:
+            return rows
+        pos = np.searchsorted(self._sorted, digests)
+        pos_clipped = np.minimum(pos, self.count - 1)
+        found = self._sorted[pos_clipped] == digests
+        rows[found] = self._order[pos_clipped[found]]
+        return rows
+
+    def get(self, rows: np.ndarray) -> np.ndarray:
+        """Copy the cached vectors at `rows` into memory."""
+        return np.array(self._vectors[np.asarray(rows, dtype=np.int64)], dtype=np.float32)
+
+    def add(self, digests: np.ndarray, vectors: np.ndarray):
+        """Append new (digest, vector) pairs and persist them."""
+        digests = np.asarray(digests, dtype='S20')
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(digests) == 0:
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d vectors, got {vectors.shape[1]}-d")
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / self.VECTORS_FILE, 'r+b' if self.count else 'wb') as f:
+            # Truncate any tail left by an interrupted append before writing
+            f.truncate(self.count * self.dim * 4)
+            f.seek(0, 2)
+            f.write(vectors.tobytes())
+        np.save(self.path / self.HASHES_FILE, np.concatenate([self._hashes, digests]))
+        with open(self.path / self.META_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'model_name': self.model_name, 'dim': self.dim,
+                       'count': self.count + len(digests)}, f)
+        self._open()
@@ -1,7 +1,12 @@
 """
 Paragraphization and fixed-size character chunking with overlap.
 """
-from typing import List, Dict
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Iterable, Iterator, List, Dict
+import re
+
+_CHAPTER_TITLE = re.compile(r'^CHAPTER\s+[IVX]+', re.IGNORECASE)
 
 
 def split_into_paragraphs(cleaned: str) -> list:
@@ -18,7 +23,7 @@ def split_into_paragraphs(cleaned: str) -> list:
     return [p.strip() for p in paragraphs if len(p.strip()) > 0]
 
 
-def chunk_paragraphs(paragraphs: list, size: int, overlap: int, book: str) -> List[Dict]:
+def chunk_paragraphs(paragraphs: list, size: int, overlap: int, book: str, verbose: bool = False) -> List[Dict]:
     """
     Make fixed-size chunks with overlap; attach source metadata (book, para_idx, char_span).
 
@@ -28,113 +33,184 @@ def chunk_paragraphs(paragraphs: list, size: int, overlap: int, book: str) -> Li
 
     # Acceptance:
     # - Returns list of dicts: {id, text, meta:{book, para_idx_start, para_idx_end, span}}
+
+    Paragraph offsets in the joined text ("\n\n".join(paragraphs)) are kept as
+    prefix sums, so each window end and overlap start is a binary search and
+    each chunk's text is a single slice of the joined text: O(n) overall.
+
+    Args:
+        paragraphs: Paragraph strings (from split_into_paragraphs)
+        size: Target chunk size in characters (a chunk ends at the first paragraph reaching it)
+        overlap: Characters of trailing paragraphs repeated at the start of the next chunk
+        book: Book name used in chunk ids and metadata
+        verbose: Print a summary line and one line per chunk
+
+    Returns:
+        List of dicts: {id, text, meta:{book, para_idx_start, para_idx_end, char_count, char_span}}
+        where char_span is [start, end) of the chunk in "\n\n".join(paragraphs).
     """
     chunks = []
-    chunk_id = 0
-    i = 0  # Start from first paragraph
     total_paragraphs = len(paragraphs)
-    last_i = -1  # Track last position to detect infinite loops
+    if verbose:
+        print(f"📚 Chunking '{book}': {total_paragraphs} paragraphs, size={size}, overlap={overlap}")
+    if total_paragraphs == 0 or size <= 0:
+        return chunks
+
+    # starts[p] / ends[p]: character offsets of paragraph p in the joined text
+    lengths = [len(para) for para in paragraphs]
+    starts = [0, *accumulate(length + 2 for length in lengths[:-1])]  # +2 for the "\n\n" separator
+    ends = [start + length for start, length in zip(starts, lengths)]
+    text = "\n\n".join(paragraphs)
+
+    i = 0
+    while i < total_paragraphs:
+        # Window end: first paragraph whose end reaches `size` chars past the chunk start
+        para_end_idx = min(bisect_left(ends, starts[i] + size, lo=i), total_paragraphs - 1)
+        span = [starts[i], ends[para_end_idx]]
+        chunk_text = text[span[0]:span[1]]
+
+        chunks.append({
+            'id': f'{book}_chunk_{len(chunks)}',
+            'text': chunk_text,
+            'meta': {
+                'book': book,
+                'para_idx_start': i,
+                'para_idx_end': para_end_idx,
+                'char_count': len(chunk_text),
+                'char_span': span
+            }
+        })
+        if verbose:
+            progress_pct = (para_end_idx + 1) / total_paragraphs * 100
+            print(f"  Chunk {len(chunks) - 1}: paras {i}-{para_end_idx}, {len(chunk_text)} chars ({progress_pct:.1f}% complete)")
+
+        # Next chunk starts at the shortest run of trailing paragraphs covering `overlap`
+        # chars, as long as that run starts strictly inside this chunk; otherwise no overlap
+        next_i = para_end_idx + 1
+        if next_i < total_paragraphs and overlap > 0 and len(chunk_text) > size - overlap:
+            overlap_start = bisect_right(starts, span[1] - overlap, lo=i, hi=para_end_idx + 1) - 1
+            if i < overlap_start < para_end_idx:
+                next_i = overlap_start
+        i = next_i
+
+    if verbose:
+        print(f"✅ Created {len(chunks)} chunks from '{book}'")
+    return chunks
+
+
+def iter_chunks(paragraphs: Iterable[str], size: int, overlap: int, book: str) -> Iterator[Dict]:
+    """
+    Streaming version of chunk_paragraphs: consume paragraphs lazily, yield chunks one by one.
+
+    Uses the same window and overlap rules as chunk_paragraphs and produces the
+    same chunks (including char_span), but only keeps the paragraphs of the current window in memory,
+    so it works on paragraph generators of any length.
+    """
+    if size <= 0:
+        return
+
+    source = iter(paragraphs)
+    window = []      # paragraphs[base:] that may still be part of a chunk
+    base = 0         # paragraph index of window[0]
+    base_offset = 0  # character offset of window[0] in "\n\n".join(paragraphs)
+    exhausted = False
+
+    def available(idx: int) -> bool:
+        """Pull paragraphs until `idx` is buffered; False if the input ends first."""
+        nonlocal exhausted
+        while not exhausted and base + len(window) <= idx:
+            try:
+                window.append(next(source))
+            except StopIteration:
+                exhausted = True
+        return idx < base + len(window)
+
+    chunk_id = 0
+    i = 0
+    while available(i):
+        # Forget paragraphs that precede the current chunk
+        base_offset += sum(len(para) + 2 for para in window[:i - base])
+        del window[:i - base]
+        base = i
+
+        # Add paragraphs until we reach or exceed the target size
+        j = i
+        length = 0
+        while length < size and available(j):
+            length += len(window[j - base]) + (2 if j > i else 0)
+            j += 1
+        para_end_idx = j - 1
+        chunk_text = "\n\n".join(window[:j - base])
+
+        yield {
+            'id': f'{book}_chunk_{chunk_id}',
+            'text': chunk_text,
+            'meta': {
+                'book': book,
+                'para_idx_start': i,
+                'para_idx_end': para_end_idx,
+                'char_count': len(chunk_text),
+                'char_span': [base_offset, base_offset + len(chunk_text)]
+            }
+        }
+        chunk_id += 1
+
+        # Next chunk starts at the shortest trailing run of paragraphs covering
+        # `overlap` chars, if that run excludes the first and last paragraph
+        # boundaries of this chunk (same rule as chunk_paragraphs)
+        next_i = j
+        if available(j) and overlap > 0 and length > size - overlap:
+            chars_from_end = 0
+            for back in range(para_end_idx, i - 1, -1):
+                chars_from_end += len(window[back - base]) + (2 if back < para_end_idx else 0)
+                if chars_from_end >= overlap:
+                    if i < back < para_end_idx:
+                        next_i = back
+                    break
+        i = next_i
+
+
+def is_toc_or_header_chunk(result: dict) -> bool:
+    """
+    Detect if a chunk is a TOC, header, or low-content chunk.
+    Returns True if it should be filtered out.
+
+    A pure function of the chunk, so indexes store the result as an `is_toc`
+    metadata column and retrieval skips flagged vectors (see retrieve's exclude_toc).
+    """
+    text = result.get('text', '')
+    chunk_id = result.get('chunk_id', '')
+    meta = result.get('meta', {})
     
-    print(f"📚 Chunking '{book}': {total_paragraphs} paragraphs, size={size}, overlap={overlap}")
+    # Filter out chunk 0 (usually TOC/preface)
+    if chunk_id.endswith('_chunk_0') or meta.get('para_idx_start', -1) == 0:
+        # But allow it if it has substantial content (not just TOC)
+        if 'Contents' in text and text.count('CHAPTER') > 5:
+            return True  # It's a TOC
     
-    while i < len(paragraphs):
-        # Safety check: prevent infinite loops
-        if i == last_i:
-            print(f"⚠️  Warning: Stuck at paragraph {i}, forcing forward progress")
-            i += 1
-            if i >= len(paragraphs):
-                break
-        last_i = i
-        # Accumulate paragraphs until we reach the target size
-        chunk_paras = []
-        chunk_text = ""
-        para_start_idx = i
-        
-        # Add paragraphs until we reach or exceed the target size
-        while i < len(paragraphs) and len(chunk_text) < size:
-            para = paragraphs[i]
-            # Add paragraph with separator
-            if chunk_text:
-                chunk_text += "\n\n" + para
-            else:
-                chunk_text = para
-            chunk_paras.append(i)
-            i += 1
-        
-        # If we have content, create a chunk
-        if chunk_text:
-            para_end_idx = chunk_paras[-1] if chunk_paras else para_start_idx
-            
-            chunks.append({
-                'id': f'{book}_chunk_{chunk_id}',
-                'text': chunk_text,
-                'meta': {
-                    'book': book,
-                    'para_idx_start': para_start_idx,
-                    'para_idx_end': para_end_idx,
-                    'char_count': len(chunk_text)
-                }
-            })
-            
-            # Print progress
-            progress_pct = (i / total_paragraphs) * 100
-            print(f"  Chunk {chunk_id}: paras {para_start_idx}-{para_end_idx}, {len(chunk_text)} chars ({progress_pct:.1f}% complete)")
-            
-            chunk_id += 1
-            
-            # Slide back by (size - overlap) characters for next chunk
-            # This creates overlapping chunks
-            if i < len(paragraphs) and overlap > 0:
-                slide_back = size - overlap
-                
-                # Find which paragraph to start the next chunk from
-                # We want to keep 'overlap' characters from the end of current chunk
-                if len(chunk_text) > slide_back:
-                    # Work backwards from the end of chunk_text to find where overlap starts
-                    # Count characters from the end backwards
-                    chars_from_end = 0
-                    para_idx_back = len(chunk_paras) - 1
-                    
-                    # Find the paragraph that contains the start of the overlap region
-                    while para_idx_back >= 0:
-                        para_idx = chunk_paras[para_idx_back]
-                        para_len = len(paragraphs[para_idx])
-                        # Add separator length (2 chars for \n\n) if not the last para
-                        separator_len = 2 if para_idx_back < len(chunk_paras) - 1 else 0
-                        chars_from_end += para_len + separator_len
-                        
-                        # If we've covered at least 'overlap' chars, we found our starting point
-                        if chars_from_end >= overlap:
-                            # Start next chunk from this paragraph (included in overlap)
-                            next_start_idx = para_idx
-                            # CRITICAL: Only move backwards if:
-                            # 1. We're going to a different position
-                            # 2. It's before the current 'i' (which is already past this chunk)
-                            # 3. It's different from where we just were (prevents getting stuck)
-                            if next_start_idx < para_end_idx and next_start_idx != last_i:
-                                i = next_start_idx
-                            else:
-                                # Can't safely move backwards, just continue forward from current i
-                                # This prevents infinite loops
-                                pass
-                            break
-                        
-                        para_idx_back -= 1
-                    
-                    # Safety check: if we didn't find a good position, just continue forward
-                    # This prevents infinite loops
-                    if para_idx_back < 0:
-                        # Couldn't find overlap point, just continue from where we are
-                        # Ensure we at least move forward by 1 paragraph to prevent infinite loops
-                        if i <= para_end_idx:
-                            i = para_end_idx + 1
-                else:
-                    # Chunk is smaller than slide_back, can't create meaningful overlap
-                    # Just continue from current position
-                    pass
-        else:
-            # No more content
-            break
+    # Filter very short chunks
+    if len(text) < 150:
+        return True
     
-    print(f"✅ Created {len(chunks)} chunks from '{book}'")
-    return chunks
+    # Filter chunks with too many newlines (indicates headers/TOC)
+    newline_ratio = text.count('\n') / len(text) if len(text) > 0 else 0
+    if newline_ratio > 0.15:  # More than 15% newlines
+        return True
+    
+    # Filter chunks that are mostly chapter titles
+    lines = text.split('\n')
+    chapter_lines = [line for line in lines if 'CHAPTER' in line.upper() or 
+                     _CHAPTER_TITLE.match(line)]
+    if len(chapter_lines) > 3:  # More than 3 chapter title lines
+        return True
+    
+    # Filter chunks that start with title/author/contents pattern
+    first_100 = text[:100].lower()
+    if ('contents' in first_100 and 'chapter' in first_100) or \
+       (text.startswith('The Picture of') and 'by Oscar Wilde' in first_100):
+        # Check if it's mostly TOC (many short lines)
+        short_lines = [line for line in lines[:30] if len(line.strip()) < 50]
+        if len(short_lines) > 10:  # More than 10 short lines in first 30
+            return True
+    
+    return False
@@ -2,18 +2,12 @@
 Clean raw text: remove Gutenberg headers/footers, normalize whitespace, keep chapter markers.
 """
 import re
+import time
 
-def clean_text(raw_path: str) -> str:
+def _clean_text_reference(raw_path: str) -> str:
     """
-    Load raw text and return a cleaned string.
-
-    # TODO hints:
-    # - Strip front/back matter by searching for known separators.
-    # - Normalize whitespace with regex; keep blank lines between paragraphs.
-    # - Preserve CHAPTER markers if present.
-
-    # Acceptance:
-    # - Returns a non-empty cleaned string.
+    Original multi-pass clean_text, kept as the reference the single-pass cleaner
+    is checked against (see benchmark_clean_text).
     """
     with open(raw_path, 'r', encoding='utf-8') as file:
         text = file.read()
@@ -98,3 +92,222 @@ def clean_text(raw_path: str) -> str:
     text = text.strip()
 
     return text
+
+
+# Precompiled patterns for the single-pass cleaners (same rules as _clean_text_reference)
+_START_MARKER = re.compile(r'\*\*\* START OF THE PROJECT GUTENBERG EBOOK \d+ \*\*\*', re.IGNORECASE)
+_ALT_START_MARKER = re.compile(r'\*\*\* START OF THIS PROJECT GUTENBERG EBOOK \*\*\*', re.IGNORECASE)
+_END_MARKER = re.compile(r'\*\*\* END OF THE PROJECT GUTENBERG EBOOK \d+ \*\*\*', re.IGNORECASE)
+_ALT_END_MARKER = re.compile(r'\*\*\* END OF THIS PROJECT GUTENBERG EBOOK \*\*\*', re.IGNORECASE)
+_TOC_CHAPTER = re.compile(r'^CHAPTER [IVX]+\.?$', re.IGNORECASE)
+_TITLE_LINE = re.compile(r'^[A-Z][a-z]+( [A-Z][a-z]+){1,3}$')
+_BYLINE = re.compile(r'^by [A-Z][a-z]+ [A-Z]', re.IGNORECASE)
+_SPACES = re.compile(r'[ \t]+')
+
+
+def clean_text(raw_path: str) -> str:
+    """
+    Load raw text and return a cleaned string.
+
+    # TODO hints:
+    # - Strip front/back matter by searching for known separators.
+    # - Normalize whitespace with regex; keep blank lines between paragraphs.
+    # - Preserve CHAPTER markers if present.
+
+    # Acceptance:
+    # - Returns a non-empty cleaned string.
+
+    Single pass over the lines between the Gutenberg markers with precompiled
+    patterns; returns exactly what the original multi-pass implementation
+    (_clean_text_reference) returns.
+    """
+    with open(raw_path, 'r', encoding='utf-8') as file:
+        text = file.read()
+
+    # Content between the START and END markers (the END marker is searched after the start)
+    start_match = _START_MARKER.search(text) or _ALT_START_MARKER.search(text)
+    body_start = start_match.end() if start_match else 0
+    end_match = _END_MARKER.search(text, body_start) or _ALT_END_MARKER.search(text, body_start)
+    body_end = end_match.start() if end_match else len(text)
+
+    return '\n'.join(_iter_clean_lines(text[body_start:body_end].split('\n'))).strip()
+
+
+def _read_lines(raw_path: str):
+    """Yield the lines of a UTF-8 file without their trailing newline, one at a time."""
+    with open(raw_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            yield line[:-1] if line.endswith('\n') else line
+
+
+def _locate_body(lines):
+    """
+    Find where the book body starts and ends, mirroring clean_text's marker rules.
+
+    Returns ((start_line, start_col), end) where `end` is (end_line, end_col) or None.
+    The primary START marker wins over the alternative one, and the END marker is
+    searched only after the chosen start.
+    """
+    # Candidate starts: primary marker, alternative marker, or the top of the file
+    starts = {'primary': None, 'alt': None, 'none': (0, 0)}
+    ends = {name: [None, None] for name in starts}  # [primary END, alternative END]
+
+    for n, line in enumerate(lines):
+        for name, pattern in (('primary', _START_MARKER), ('alt', _ALT_START_MARKER)):
+            if name in starts and starts[name] is None:
+                match = pattern.search(line)
+                if match:
+                    starts[name] = (n, match.end())
+
+        for name, start in starts.items():
+            if start is None:
+                continue
+            pos = start[1] if start[0] == n else 0
+            for slot, pattern in enumerate((_END_MARKER, _ALT_END_MARKER)):
+                if ends[name][slot] is None:
+                    match = pattern.search(line, pos)
+                    if match:
+                        ends[name][slot] = (n, match.start())
+
+        # Once the primary start has been seen, the other candidates can never win
+        if starts['primary'] is not None:
+            starts = {'primary': starts['primary']}
+            if ends['primary'][0] is not None:
+                break
+
+    name = 'primary' if starts.get('primary') else 'alt' if starts.get('alt') else 'none'
+    primary_end, alt_end = ends[name]
+    return starts[name], primary_end if primary_end is not None else alt_end
+
+
+def _iter_body_lines(lines, start, end):
+    """Yield the lines between the start and end marker positions."""
+    start_line, start_col = start
+    for n, line in enumerate(lines):
+        if n < start_line:
+            continue
+        if end is not None and n == end[0]:
+            yield line[start_col if n == start_line else 0:end[1]]
+            return
+        yield line[start_col:] if n == start_line else line
+
+
+def _iter_clean_lines(lines):
+    """
+    Drop front matter (title, byline, table of contents) and normalize whitespace, line by line.
+
+    Yields normalized lines with runs of blank lines collapsed to one. Joining the
+    output with '\\n' and stripping it gives exactly what clean_text returns.
+    """
+    lines = iter(lines)
+    in_toc = False  # Track if we're in table of contents
+    content_started = False
+
+    # Front matter: run the title/byline/TOC rules until the content starts
+    for line in lines:
+        line_stripped = line.strip()
+
+        # Skip empty lines at the very beginning
+        if not line_stripped:
+            continue
+        # Detect table of contents section
+        if not in_toc and line_stripped.lower() == 'contents':
+            in_toc = True
+            continue
+
+        # Skip table of contents entries (simple chapter lists)
+        if in_toc:
+            if _TOC_CHAPTER.match(line_stripped) or len(line_stripped) <= 20:
+                continue
+            # End of TOC when we hit actual content
+            in_toc = False
+            content_started = True
+        else:
+            # Skip simple title/author lines
+            if _TITLE_LINE.match(line_stripped) and len(line_stripped) < 50:
+                continue
+            if _BYLINE.match(line_stripped):
+                continue
+            if len(line_stripped) > 20 or 'CHAPTER' in line_stripped.upper():
+                content_started = True
+
+        # Lines kept here are never blank, so no blank-run bookkeeping is needed yet
+        yield _SPACES.sub(' ', line).strip(' ')
+        if content_started:
+            break
+
+    # Body: collapse spaces/tabs, trim them around line breaks, keep one blank line max
+    previous_blank = False
+    for line in lines:
+        if '\t' in line or '  ' in line:
+            line = _SPACES.sub(' ', line)
+        line = line.strip(' ')
+        if line:
+            previous_blank = False
+            yield line
+        elif not previous_blank:
+            previous_blank = True
+            yield line
+
+
+def iter_clean_paragraphs(raw_path: str):
+    """
+    Stream cleaned paragraphs from a raw Gutenberg file with bounded memory.
+
+    Reads the file twice line by line (once to locate the START/END markers,
+    once to clean) and never holds more than one paragraph in memory. Yields
+    exactly `split_into_paragraphs(clean_text(raw_path))`.
+    """
+    start, end = _locate_body(_read_lines(raw_path))
+    paragraph_lines = []
+    for line in _iter_clean_lines(_iter_body_lines(_read_lines(raw_path), start, end)):
+        if line:
+            paragraph_lines.append(line)
+            continue
+        paragraph = '\n'.join(paragraph_lines).strip()
+        paragraph_lines = []
+        if paragraph:
+            yield paragraph
+    paragraph = '\n'.join(paragraph_lines).strip()
+    if paragraph:
+        yield paragraph
+
+
+def benchmark_clean_text(raw_paths, repeats: int = 5) -> list:
+    """
+    Compare clean_text against the original implementation on real books.
+
+    Args:
+        raw_paths: Raw Gutenberg files (e.g. data/raw/iliad.txt, data/raw/dorian.txt)
+        repeats: Timed runs per implementation; the best run is reported
+
+    Returns:
+        One row per file: {path, mb, reference_mb_s, clean_mb_s, speedup, identical}
+    """
+    rows = []
+    for path in raw_paths:
+        with open(path, 'rb') as f:
+            mb = len(f.read()) / 1e6
+        timings = {}
+        outputs = {}
+        for name, fn in (('reference', _clean_text_reference), ('clean', clean_text)):
+            best = float('inf')
+            for _ in range(repeats):
+                start = time.perf_counter()
+                outputs[name] = fn(path)
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best
+        rows.append({
+            'path': str(path),
+            'mb': round(mb, 3),
+            'reference_mb_s': round(mb / timings['reference'], 2),
+            'clean_mb_s': round(mb / timings['clean'], 2),
+            'speedup': round(timings['reference'] / timings['clean'], 2),
+            'identical': outputs['clean'].encode('utf-8') == outputs['reference'].encode('utf-8'),
+        })
+
+    print(f"{'file':<30} {'MB':>7} {'old MB/s':>9} {'new MB/s':>9} {'speedup':>8} identical")
+    for row in rows:
+        print(f"{row['path'][-30:]:<30} {row['mb']:>7.2f} {row['reference_mb_s']:>9.1f} "
+              f"{row['clean_mb_s']:>9.1f} {row['speedup']:>7.2f}x {'✅' if row['identical'] else '⚠️ '}")
+    return rows
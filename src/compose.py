@@ -5,6 +5,31 @@ This module defines a *deterministic, reproducible* pipeline that never invents
 """
 from typing import List, Dict, Tuple
 import re
+import numpy as np
+
+_WORD = re.compile(r'\w+')  # same tokens as r'\b\w+\b'
+_SENTENCE_END = re.compile(r'[.!?]+')
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    Character spans (start, end) of the sentences segment_sentences returns.
+
+    Computed once per chunk at index build time and stored next to the chunk
+    text, so select_quotes can slice sentences instead of re-segmenting.
+    """
+    spans = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.end()
+        piece = text[start:end]
+        sentence = piece.strip()
+        # Keep sentences that are at least 20 chars or contain meaningful content
+        if len(sentence) >= 20:
+            lead = len(piece) - len(piece.lstrip())
+            spans.append((start + lead, start + lead + len(sentence)))
+        start = end
+    return spans if spans else [(0, len(text))]  # Fallback to full text if no sentences found
 
 
 def segment_sentences(text: str) -> List[str]:
@@ -12,31 +37,22 @@ def segment_sentences(text: str) -> List[str]:
     Split text into sentences using punctuation boundaries.
     
     Returns non-empty sentences (minimum 20 chars or contains query terms).
+    Text after the last sentence-ending punctuation is not a sentence.
     """
-    # Split on sentence boundaries (. ! ?) while keeping punctuation
-    sentences = re.split(r'([.!?]+)', text)
-    
-    # Recombine sentences with their punctuation
-    result = []
-    for i in range(0, len(sentences) - 1, 2):
-        if i + 1 < len(sentences):
-            sentence = (sentences[i] + sentences[i + 1]).strip()
-        else:
-            sentence = sentences[i].strip()
-        
-        # Keep sentences that are at least 20 chars or contain meaningful content
-        if len(sentence) >= 20:
-            result.append(sentence)
-    
-    return result if result else [text]  # Fallback to full text if no sentences found
+    return [text[start:end] for start, end in sentence_spans(text)]
 
 
-def score_sentence(query: str, sentence: str, sent_vec=None) -> float:
+def score_sentence(query: str, sentence: str, sent_vec=None, query_vec=None) -> float:
     """
     Score how well a sentence supports the query.
     
-    Simple lexical overlap score (0-1 range).
+    Simple lexical overlap score (0-1 range). When both the sentence embedding
+    and the query embedding are given (normalized), returns their cosine
+    similarity instead.
     """
+    if sent_vec is not None and query_vec is not None:
+        return float(np.dot(np.asarray(sent_vec, dtype=np.float32), np.asarray(query_vec, dtype=np.float32)))
+
     # Normalize to lowercase for comparison
     query_lower = query.lower()
     sentence_lower = sentence.lower()
@@ -59,52 +75,132 @@ def score_sentence(query: str, sentence: str, sent_vec=None) -> float:
     return score
 
 
-def select_quotes(query: str, retrieved: List[Dict], n: int = 3) -> List[Dict]:
+def query_terms(query: str) -> List[str]:
+    """Unique lowercase word tokens of the query, in first-seen order (same tokens as score_sentence)."""
+    return list(dict.fromkeys(_WORD.findall(query.lower())))
+
+
+def score_sentences(terms: List[str], sentences: List[str]) -> np.ndarray:
+    """
+    Score many sentences against pre-tokenized query terms at once.
+
+    Equivalent to [score_sentence(query, s) for s in sentences] with
+    terms = query_terms(query), but the sentences are lowercased and scanned
+    in one regex pass that only matches query terms; the (sentence, term)
+    hits form a sparse term matrix whose row counts give the overlap.
+
+    Returns:
+        float64 array of scores, one per sentence
+    """
+    n_sentences = len(sentences)
+    if not terms or n_sentences == 0:
+        return np.zeros(n_sentences, dtype=np.float64)
+
+    lowered = [sentence.lower() for sentence in sentences]
+    starts = np.zeros(n_sentences, dtype=np.int64)
+    np.cumsum([len(s) + 1 for s in lowered[:-1]], out=starts[1:])  # +1 for the '\n' joiner
+
+    # Whole-word matches of query terms only; terms are \w+ runs, so \b...\b means a full token
+    term_ids = {term: j for j, term in enumerate(terms)}
+    pattern = re.compile(r'\b(?:' + '|'.join(
+        re.escape(term) for term in sorted(terms, key=len, reverse=True)) + r')\b')
+    positions, hit_terms = [], []
+    for match in pattern.finditer('\n'.join(lowered)):
+        positions.append(match.start())
+        hit_terms.append(term_ids[match.group()])
+
+    overlap = np.zeros(n_sentences, dtype=np.int64)
+    if positions:
+        rows = np.searchsorted(starts, np.asarray(positions, dtype=np.int64), side='right') - 1
+        pairs = np.unique(rows * len(terms) + np.asarray(hit_terms, dtype=np.int64))
+        overlap = np.bincount(pairs // len(terms), minlength=n_sentences)
+
+    lengths = np.fromiter(map(len, sentences), dtype=np.float64, count=n_sentences)
+    coverage = overlap / len(terms)
+    brevity_bonus = np.minimum(1.0, 100 / lengths) * 0.1
+    return np.minimum(1.0, coverage + brevity_bonus)
+
+
+def _ranked(scores: np.ndarray, m: int) -> np.ndarray:
+    """
+    Indices of the top-m scores, best first, ties in original order (like a stable sort).
+
+    argpartition finds the m-th best score; everything tied with it is kept so
+    the stable order of the prefix is exact.
+    """
+    if m >= len(scores):
+        candidates = np.arange(len(scores))
+    else:
+        threshold = np.partition(scores, len(scores) - m)[len(scores) - m]
+        candidates = np.flatnonzero(scores >= threshold)
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def select_quotes(query: str, retrieved: List[Dict], n: int = 3, query_vec: np.ndarray = None) -> List[Dict]:
     """
     Select top-N quotes from retrieved chunks with diversity.
     
     Simple implementation: segment into sentences, score them, pick top-N.
+    The query is tokenized once, all sentences are scored in bulk, and only the
+    best-ranked candidates are ordered (argpartition instead of a full sort).
+    Hits carrying precomputed 'sentence_spans' (from the index) are sliced
+    instead of re-segmented.
+
+    Semantic mode: when `query_vec` is given and every hit carries
+    'sentence_vectors' (sentence embeddings stored at build time), sentences are
+    scored by cosine similarity with one matrix-vector product; otherwise the
+    lexical score is used.
     """
-    all_sentences = []
-    
-    # For each retrieved chunk, segment and score sentences
+    if n <= 0:
+        return []
+
+    # Segment every retrieved chunk; keep parallel lists instead of a dict per sentence
+    sentences, owners, vectors = [], [], []
     for item in retrieved:
         text = item.get('text', '')
         if not text:
             continue
-        
-        sentences = segment_sentences(text)
-        for sent in sentences:
-            score = score_sentence(query, sent)
-            all_sentences.append({
-                'text': sent,
-                'score': score,
+        spans = item.get('sentence_spans')
+        if spans is not None:
+            chunk_sentences = [text[start:end] for start, end in spans]
+        else:
+            chunk_sentences = segment_sentences(text)
+        sentences.extend(chunk_sentences)
+        owners.extend([item] * len(chunk_sentences))
+        vectors.append(item.get('sentence_vectors') if spans is not None else None)
+
+    if query_vec is not None and sentences and all(v is not None for v in vectors):
+        query_vec = np.asarray(query_vec, dtype=np.float32).ravel()
+        scores = (np.concatenate(vectors) @ query_vec).astype(np.float64)
+    else:
+        scores = score_sentences(query_terms(query), sentences)
+
+    # Simple diversity: skip a sentence whose chunk and first 50 chars match an already selected one
+    selected = []
+    seen = set()
+    ranked_upto = 0
+    m = n
+    while len(selected) < n and ranked_upto < len(sentences):
+        # Widen the candidate pool only when duplicates ate into it
+        order = _ranked(scores, m)
+        for i in order[ranked_upto:].tolist():
+            item = owners[i]
+            key = (item.get('chunk_id', ''), sentences[i][:50])
+            if key in seen:
+                continue
+            seen.add(key)
+            selected.append({
+                'text': sentences[i],
+                'score': float(scores[i]),
                 'chunk_id': item.get('chunk_id', ''),
                 'cite': item.get('meta', {})
             })
-    
-    # Sort by score and take top-N
-    all_sentences.sort(key=lambda x: x['score'], reverse=True)
-    
-    # Simple diversity: skip sentences that are too similar to already selected ones
-    selected = []
-    for sent_data in all_sentences:
-        if len(selected) >= n:
-            break
-        
-        # Check if too similar to already selected (simple check: same chunk or very similar text)
-        is_duplicate = False
-        for existing in selected:
-            if sent_data['chunk_id'] == existing['chunk_id']:
-                # Same chunk - only add if significantly different
-                if sent_data['text'][:50] == existing['text'][:50]:
-                    is_duplicate = True
-                    break
-        
-        if not is_duplicate:
-            selected.append(sent_data)
-    
-    return selected[:n]
+            if len(selected) >= n:
+                break
+        ranked_upto = len(order)
+        m *= 2
+
+    return selected
 
 
 def synthesize_answer(query: str, quotes: List[Dict]) -> str:
@@ -170,10 +266,13 @@ def render_citations(quotes: List[Dict]) -> List[str]:
     return citations
 
 
-def compose_answer(query: str, retrieved: List[Dict], max_quotes: int = 3) -> Dict:
+def compose_answer(query: str, retrieved: List[Dict], max_quotes: int = 3, query_vec: np.ndarray = None) -> Dict:
     """
     Main composition entrypoint called by app layer.
     
+    Pass the query embedding as `query_vec` to rank quotes semantically
+    (needs sentence embeddings in the index, see select_quotes).
+    
     Returns structured payload for UI.
     """
     if not retrieved:
@@ -184,7 +283,7 @@ def compose_answer(query: str, retrieved: List[Dict], max_quotes: int = 3) -> Di
         }
     
     # Select top quotes
-    quotes = select_quotes(query, retrieved, n=max_quotes)
+    quotes = select_quotes(query, retrieved, n=max_quotes, query_vec=query_vec)
     
     # Synthesize answer
     answer = synthesize_answer(query, quotes)
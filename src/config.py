@@ -0,0 +1,37 @@
+"""
+Load configs/app.yaml with its path settings resolved against the config file.
+
+Relative paths in the config (CONFIG_PATH_KEYS) are relative to the directory
+of the config file, not to the working directory, so the command-line tools
+run from the repository root and the notebooks run from notebooks/ read and
+write the same files.
+"""
+from pathlib import Path
+import os
+import yaml
+
+# (section, key) of every path setting; section None = top-level key
+CONFIG_PATH_KEYS = (
+    ('embedding_backend', 'export_dir'),
+    ('query_cache', 'path'),
+    (None, 'embedding_cache_dir'),
+)
+
+
+def resolve_config_paths(config: dict, config_dir) -> dict:
+    """Make the relative CONFIG_PATH_KEYS settings of `config` relative to `config_dir` (in place)."""
+    for section, key in CONFIG_PATH_KEYS:
+        values = config if section is None else config.get(section)
+        if not isinstance(values, dict) or not values.get(key):
+            continue
+        path = Path(values[key])
+        if not path.is_absolute():
+            values[key] = os.path.normpath(Path(config_dir) / path)
+    return config
+
+
+def load_config(config_path: str = "configs/app.yaml") -> dict:
+    """Load a config YAML file, resolving its path settings (see resolve_config_paths)."""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    return resolve_config_paths(config, Path(config_path).parent)
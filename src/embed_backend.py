@@ -0,0 +1,177 @@
+"""
+Embedding backends: the same sentence-transformers model run by PyTorch or ONNX Runtime.
+
+Select under `embedding_backend:` in configs/app.yaml:
+
+    torch       SentenceTransformer on PyTorch (default)
+    onnx        exported ONNX graph in ONNX Runtime
+    onnx_int8   ONNX graph with int8 dynamic quantization (smallest, fastest on CPU)
+
+The ONNX backends need the optional extras (pip install "sentence-transformers[onnx]").
+ONNX exports are written once to `export_dir/<model>/onnx/` and reused.
+Every backend returns a SentenceTransformer, so `model.encode` callers
+(embed_query, embed_texts, ...) don't change. Check a backend against
+PyTorch with check_backend_parity / benchmark_embedding_backends.
+"""
+from pathlib import Path
+from typing import Dict, List
+import time
+import numpy as np
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx_int8")
+
+DEFAULT_BACKEND_CONFIG = {
+    'type': 'torch',
+    'quantization': 'avx2',        # onnx_int8: arm64 | avx2 | avx512 | avx512_vnni
+    'export_dir': 'data/models',   # where exported ONNX models are kept
+}
+
+
+def resolve_backend_config(backend_config=None) -> dict:
+    """Merge an `embedding_backend:` config section (or just a type name) with the defaults."""
+    if isinstance(backend_config, str):
+        backend_config = {'type': backend_config}
+    params = dict(DEFAULT_BACKEND_CONFIG)
+    params.update(backend_config or {})
+    params['type'] = str(params['type']).lower()
+    if params['type'] not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {params['type']}. Must be one of {EMBEDDING_BACKENDS}.")
+    return params
+
+
+def embedding_model_id(model_name: str, backend_config=None) -> str:
+    """
+    Name under which a model's vectors are cached.
+
+    torch and onnx produce the same vectors (up to float rounding) and share
+    caches; int8 vectors differ slightly, so they get their own cache entries.
+    """
+    params = resolve_backend_config(backend_config)
+    if params['type'] == 'onnx_int8':
+        return f"{model_name}@int8-{params['quantization']}"
+    return model_name
+
+
+def _export_dir(model_name: str, params: dict) -> Path:
+    safe_name = "".join(c if c.isalnum() or c in '-_.' else '_' for c in model_name)
+    return Path(params['export_dir']) / safe_name
+
+
+def _quantized_file(model_dir: Path, quantization: str):
+    """Relative path of the int8 export for `quantization` (qint8 or quint8 naming), or None."""
+    matches = sorted((model_dir / 'onnx').glob(f"model_q*int8_{quantization}.onnx"))
+    return f"onnx/{matches[0].name}" if matches else None
+
+
+def load_embedding_model(model_name: str, backend_config=None):
+    """
+    Load `model_name` on the configured backend, exporting it to ONNX on first use.
+
+    Args:
+        model_name: SentenceTransformer model name or path
+        backend_config: `embedding_backend:` config section, or a backend name
+
+    Returns:
+        SentenceTransformer (use model.encode as usual)
+    """
+    from sentence_transformers import SentenceTransformer
+
+    params = resolve_backend_config(backend_config)
+    if params['type'] == 'torch':
+        return SentenceTransformer(model_name)
+
+    try:
+        import onnxruntime  # noqa: F401
+        import optimum.onnxruntime  # noqa: F401
+    except ImportError as e:
+        raise ImportError(f"embedding_backend type '{params['type']}' needs ONNX Runtime and Optimum: "
+                          f"pip install \"sentence-transformers[onnx]\"") from e
+
+    model_dir = _export_dir(model_name, params)
+    if not (model_dir / 'onnx' / 'model.onnx').exists():
+        print(f"📦 Exporting {model_name} to ONNX: {model_dir}")
+        SentenceTransformer(model_name, backend='onnx').save_pretrained(str(model_dir))
+    if params['type'] == 'onnx':
+        return SentenceTransformer(str(model_dir), backend='onnx')
+
+    file_name = _quantized_file(model_dir, params['quantization'])
+    if file_name is None:
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        print(f"📦 Quantizing ONNX model to int8 ({params['quantization']})")
+        export_dynamic_quantized_onnx_model(SentenceTransformer(str(model_dir), backend='onnx'),
+                                            params['quantization'], str(model_dir))
+        file_name = _quantized_file(model_dir, params['quantization'])
+    return SentenceTransformer(str(model_dir), backend='onnx', model_kwargs={'file_name': file_name})
+
+
+def _encode(model, texts: List[str], batch_size: int) -> np.ndarray:
+    return np.asarray(model.encode(texts, batch_size=batch_size, normalize_embeddings=True,
+                                   show_progress_bar=False), dtype=np.float32)
+
+
+def check_backend_parity(reference_model, model, texts: List[str], min_cosine: float = 0.99) -> Dict:
+    """
+    Compare a backend's embeddings with the reference (PyTorch) model text by text.
+
+    Returns:
+        {min_cosine, mean_cosine, passed}; passed when every text's cosine
+        similarity between the two embeddings is at least `min_cosine`.
+    """
+    cosines = np.sum(_encode(reference_model, texts, 64) * _encode(model, texts, 64), axis=1)
+    result = {
+        'min_cosine': float(cosines.min()),
+        'mean_cosine': float(cosines.mean()),
+        'passed': bool(cosines.min() >= min_cosine),
+    }
+    status = '✅' if result['passed'] else '⚠️ '
+    print(f"{status} Parity: min cosine {result['min_cosine']:.4f}, mean {result['mean_cosine']:.4f} "
+          f"({len(texts)} texts, threshold {min_cosine})")
+    return result
+
+
+def benchmark_embedding_backends(model_name: str, texts: List[str], backends=EMBEDDING_BACKENDS,
+                                 batch_sizes=(1, 64), repeats: int = 3, backend_config: dict = None) -> List[Dict]:
+    """
+    Latency of each backend at each batch size, plus cosine parity with PyTorch.
+
+    Args:
+        model_name: SentenceTransformer model name
+        texts: Sample texts (queries or chunks); at least max(batch_sizes) are used per batch
+        backends: Backend names to compare
+        batch_sizes: Batch sizes to time (1 = one query per request, 64 = bulk encoding)
+        repeats: Timed runs per point; the best is reported
+        backend_config: Shared backend settings (quantization, export_dir)
+
+    Returns:
+        List of dicts: {backend, batch_size, ms_per_batch, texts_per_s, min_cosine, mean_cosine}
+    """
+    texts = list(texts)
+    models = {name: load_embedding_model(model_name, {**(backend_config or {}), 'type': name})
+              for name in backends}
+    reference = models.get('torch') or load_embedding_model(model_name, 'torch')
+
+    rows = []
+    for name, model in models.items():
+        parity = check_backend_parity(reference, model, texts)
+        for batch_size in batch_sizes:
+            batch = (texts * (batch_size // max(1, len(texts)) + 1))[:batch_size]
+            _encode(model, batch, batch_size)  # warm-up
+            best = float('inf')
+            for _ in range(repeats):
+                start = time.perf_counter()
+                _encode(model, batch, batch_size)
+                best = min(best, time.perf_counter() - start)
+            rows.append({
+                'backend': name,
+                'batch_size': batch_size,
+                'ms_per_batch': round(best * 1000, 2),
+                'texts_per_s': round(batch_size / best, 1),
+                'min_cosine': round(parity['min_cosine'], 4),
+                'mean_cosine': round(parity['mean_cosine'], 4),
+            })
+
+    print(f"{'backend':<10} {'batch':>5} {'ms/batch':>9} {'texts/s':>9} {'min cos':>8}")
+    for row in rows:
+        print(f"{row['backend']:<10} {row['batch_size']:>5} {row['ms_per_batch']:>9.2f} "
+              f"{row['texts_per_s']:>9.1f} {row['min_cosine']:>8.4f}")
+    return rows
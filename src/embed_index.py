@@ -1,10 +1,13 @@
 """
 Embeddings + FAISS index build/save/load.
 """
-from typing import List
+from typing import Iterable, Iterator, List, Dict
 from pathlib import Path
+import json
 import os
 import platform
+import shutil
+import time
 
 # On macOS, FAISS and PyTorch both ship libomp and loading both copies without
 # telling LibOMP they're duplicates aborts the interpreter. Setting this flag
@@ -14,33 +17,312 @@ if platform.system() == "Darwin":
 
 import numpy as np
 # Import FAISS before torch/sentence-transformers so libomp loads in a safe order on macOS.
+# sentence-transformers (torch, via src.embed_backend) and pandas are imported inside the
+# functions that need them, so loading an index for search doesn't pay for them.
 import faiss
-from sentence_transformers import SentenceTransformer
-import pandas as pd
+from src.cache import ChunkEmbeddingCache, text_digest
+from src.store import (MetadataStore, StringColumn, StringColumnWriter, SpanColumn, SpanColumnWriter,
+                       TEXT_DATA_FILE, TEXT_OFFSETS_FILE, SENTENCE_INDPTR_FILE, SENTENCE_SPANS_FILE,
+                       SENTENCE_VECTORS_FILE, SENTENCE_VECTORS_META_FILE)
+from src.compose import sentence_spans
+from src.chunk import is_toc_or_header_chunk
+from src.sparse import BM25Builder, BM25Index, build_bm25
+from src.startup import phase
+from src.embed_backend import load_embedding_model, embedding_model_id
 
 
-def embed_texts(texts: List[str], model_name: str):
+def _embed_with_cache(texts: List[str], model_name: str, cache: ChunkEmbeddingCache, model=None,
+                      batch_size: int = 32, show_progress_bar: bool = True, backend_config=None):
+    """
+    Embed texts through a ChunkEmbeddingCache, encoding only distinct uncached texts.
+
+    Returns (embeddings, model, n_encoded); `model` is loaded only if something was encoded.
+    """
+    digests = np.array([text_digest(t) for t in texts], dtype='S20')
+    rows = cache.lookup(digests)
+    missing = np.flatnonzero(rows < 0)
+
+    if len(missing):
+        # Encode each distinct new text once, then persist it
+        new_digests, first, inverse = np.unique(digests[missing], return_index=True, return_inverse=True)
+        if model is None:
+            model = load_embedding_model(model_name, backend_config)
+        new_vectors = model.encode([texts[i] for i in missing[first]], batch_size=batch_size,
+                                   normalize_embeddings=True, show_progress_bar=show_progress_bar)
+        new_vectors = np.array(new_vectors, dtype=np.float32)
+        cache.add(new_digests, new_vectors)
+
+    if len(texts) == 0:
+        return np.zeros((0, cache.dim or 0), dtype=np.float32), model, 0
+    embeddings = np.empty((len(texts), cache.dim), dtype=np.float32)
+    hit = rows >= 0
+    if hit.any():
+        embeddings[hit] = cache.get(rows[hit])
+    if len(missing):
+        embeddings[missing] = new_vectors[inverse]
+    return embeddings, model, len(missing)
+
+
+def embed_texts(texts: List[str], model_name: str, cache_dir: str = None, batch_size: int = 32,
+                backend_config=None, model=None, show_progress_bar: bool = True):
     """
     Return matrix of embeddings for texts.
 
+    Args:
+        texts: Chunk texts to embed
+        model_name: SentenceTransformer model name
+        cache_dir: Optional persistent embedding cache directory; only texts whose
+            content hash is not cached yet are encoded, so rebuilds after small
+            chunking or cleaning changes re-embed just the new/changed chunks
+        batch_size: Encode batch size
+        backend_config: Optional `embedding_backend:` config (torch, onnx, onnx_int8)
+        model: Already loaded model (anything with SentenceTransformer's encode); skips loading
+        show_progress_bar: Show the encode progress bar
+
     # TODO hints:
     # - Load SentenceTransformer by name; encode with normalize_embeddings=True if available.
     # - Batch encode; return numpy array (n, d).
 
     # Acceptance:
-    # - Returns embeddings and model reference (if needed).
+    # - Returns embeddings and model reference (if needed; None when every text was cached).
     """
-    model = SentenceTransformer(model_name)
-    embeddings = model.encode(texts, normalize_embeddings=True, show_progress_bar=True)
-    # Ensure numpy array and float32 for FAISS compatibility
-    embeddings = np.array(embeddings, dtype=np.float32)
+    if cache_dir is None:
+        if model is None:
+            model = load_embedding_model(model_name, backend_config)
+        embeddings = model.encode(texts, batch_size=batch_size, normalize_embeddings=True,
+                                  show_progress_bar=show_progress_bar)
+        # Ensure numpy array and float32 for FAISS compatibility
+        embeddings = np.array(embeddings, dtype=np.float32)
+        return embeddings, model
+
+    cache = ChunkEmbeddingCache(cache_dir, embedding_model_id(model_name, backend_config))
+    embeddings, model, n_encoded = _embed_with_cache(texts, model_name, cache, model=model, batch_size=batch_size,
+                                                     show_progress_bar=show_progress_bar,
+                                                     backend_config=backend_config)
+    print(f"📦 Embedding cache: {len(texts) - n_encoded}/{len(texts)} chunks cached, "
+          f"{n_encoded} encoded")
     return embeddings, model
 
 
-def build_faiss_index(embeddings):
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[list]:
+    """Group any iterable into lists of at most `batch_size` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Index types selectable under `index:` in configs/app.yaml
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq_fp16", "sq_int8")
+
+# Types whose quantizers are trained on a sample before vectors are added
+TRAINED_INDEX_TYPES = ("ivf_flat", "ivf_pq", "sq_int8")
+
+# Exhaustive scalar-quantized types: vectors stored as float16 (2x smaller) or int8 (4x smaller)
+SCALAR_QUANTIZER_TYPES = {
+    'sq_fp16': faiss.ScalarQuantizer.QT_fp16,
+    'sq_int8': faiss.ScalarQuantizer.QT_8bit,
+}
+
+DEFAULT_INDEX_CONFIG = {
+    'type': 'flat',
+    'nlist': 100,             # IVF: number of coarse clusters
+    'pq_m': 16,               # IVF-PQ: sub-quantizers (must divide the embedding dimension)
+    'pq_nbits': 8,            # IVF-PQ: bits per sub-quantizer code
+    'hnsw_m': 32,             # HNSW: neighbours per graph node
+    'ef_construction': 80,    # HNSW: build-time beam width
+    'train_sample': 50000,    # IVF: max vectors used to train the quantizers
+    'nprobe': 8,              # IVF: clusters visited per query
+    'ef_search': 64,          # HNSW: query-time beam width
+}
+
+INDEX_CONFIG_FILE = 'index_config.json'
+
+
+def staging_dir(out_dir) -> Path:
+    """
+    Fresh, empty hidden sibling of `out_dir` to write a new build into.
+
+    It lives on the same filesystem as `out_dir`, so publish_dir can move
+    its files into place with atomic renames.
+    """
+    out_path = Path(out_dir)
+    staging = out_path.parent / f".{out_path.name}.building-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    return staging
+
+
+def publish_dir(staging: Path, out_dir):
+    """
+    Move every file built in `staging` into `out_dir` (os.replace), then remove `staging`.
+
+    Each file gets a new inode instead of being truncated and rewritten in
+    place, so a process that still has the old index.faiss, chunk text or
+    BM25 postings memory-mapped keeps reading the old version until it
+    reloads, instead of dying with SIGBUS. index.faiss is moved last, so
+    the new build only becomes loadable once its other files are in place.
+    """
+    out_path = Path(out_dir)
+    out_path.mkdir(parents=True, exist_ok=True)
+    for path in sorted(staging.iterdir(), key=lambda p: p.name == 'index.faiss'):
+        os.replace(path, out_path / path.name)
+    staging.rmdir()
+
+
+def resolve_index_config(index_config: dict = None) -> dict:
+    """Merge a (possibly partial) `index:` config section with the defaults and validate it."""
+    params = dict(DEFAULT_INDEX_CONFIG)
+    params.update(index_config or {})
+    params['type'] = str(params['type']).lower()
+    if params['type'] not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {params['type']}. Must be one of {INDEX_TYPES}.")
+    return params
+
+
+def make_faiss_index(dimension: int, index_config: dict = None, n_vectors: int = None):
+    """
+    Create an empty (untrained) inner-product FAISS index of the configured type.
+
+    Args:
+        dimension: Embedding dimension
+        index_config: `index:` section of configs/app.yaml (type, nlist, pq_m, ...)
+        n_vectors: Expected corpus size; IVF/PQ sizes are clamped so small corpora still train
+
+    Returns:
+        FAISS index (call train_faiss_index before adding vectors if `index.is_trained` is False)
+    """
+    params = resolve_index_config(index_config)
+    index_type = params['type']
+
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dimension)
+
+    if index_type in SCALAR_QUANTIZER_TYPES:
+        return faiss.IndexScalarQuantizer(dimension, SCALAR_QUANTIZER_TYPES[index_type],
+                                          faiss.METRIC_INNER_PRODUCT)
+
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, int(params['hnsw_m']), faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = int(params['ef_construction'])
+        index.hnsw.efSearch = int(params['ef_search'])
+        return index
+
+    nlist = int(params['nlist'])
+    if n_vectors is not None:
+        # FAISS wants ~39 training points per centroid
+        nlist = max(1, min(nlist, n_vectors // 39))
+    quantizer = faiss.IndexFlatIP(dimension)
+
+    if index_type == 'ivf_flat':
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+    else:
+        pq_m = int(params['pq_m'])
+        if dimension % pq_m != 0:
+            raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dimension}")
+        nbits = int(params['pq_nbits'])
+        if n_vectors is not None:
+            # PQ trains 2**nbits centroids per sub-quantizer
+            nbits = max(1, min(nbits, int(np.log2(max(n_vectors, 2)))))
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, nbits, faiss.METRIC_INNER_PRODUCT)
+
+    index.nprobe = min(int(params['nprobe']), nlist)
+    return index
+
+
+def train_faiss_index(index, embeddings: np.ndarray, train_sample: int = None, seed: int = 0):
+    """
+    Train an IVF index (or the int8 scalar quantizer's per-dimension ranges) on a
+    random sample of the (normalized float32) embeddings.
+
+    No-op for index types that need no training (flat, HNSW, float16).
+    """
+    if index.is_trained:
+        return index
+    if train_sample is None:
+        train_sample = DEFAULT_INDEX_CONFIG['train_sample']
+    sample = embeddings
+    if len(embeddings) > train_sample:
+        rng = np.random.default_rng(seed)
+        sample = embeddings[np.sort(rng.choice(len(embeddings), size=train_sample, replace=False))]
+    index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    return index
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """
+    Apply query-time accuracy/speed knobs to a FAISS index.
+
+    Args:
+        index: FAISS index (flat, IVF or HNSW)
+        nprobe: IVF clusters visited per query (ignored for non-IVF indexes)
+        ef_search: HNSW search beam width (ignored for non-HNSW indexes)
+    """
+    if nprobe is not None:
+        try:
+            ivf = faiss.extract_index_ivf(index)
+        except RuntimeError:
+            ivf = None
+        if ivf is not None:
+            ivf.nprobe = min(int(nprobe), ivf.nlist)
+    if ef_search is not None and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = int(ef_search)
+    return index
+
+
+def index_config_from_index(index) -> dict:
+    """
+    The `index:` settings of a built index (type, structure and query-time parameters), read from FAISS.
+
+    Used when an index is saved without the config it was built with, so
+    index_config.json records the index's own nprobe / efSearch instead of defaults.
+    """
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return {'type': 'hnsw', 'hnsw_m': base.hnsw.nb_neighbors(1),
+                'ef_construction': base.hnsw.efConstruction, 'ef_search': base.hnsw.efSearch}
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        for name, qtype in SCALAR_QUANTIZER_TYPES.items():
+            if base.sq.qtype == qtype:
+                return {'type': name}
+        return {}
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return {'type': 'flat'} if isinstance(base, faiss.IndexFlat) else {}
+    config = {'nlist': ivf.nlist, 'nprobe': ivf.nprobe}
+    ivf = faiss.downcast_index(ivf)
+    if isinstance(ivf, faiss.IndexIVFPQ):
+        return {'type': 'ivf_pq', **config, 'pq_m': ivf.pq.M, 'pq_nbits': ivf.pq.nbits}
+    return {'type': 'ivf_flat', **config}
+
+
+def describe_index(index) -> str:
+    """Short human-readable description of an index type and its search parameters."""
+    name = type(index).__name__
+    if hasattr(index, 'hnsw'):
+        return f"{name}(M={index.hnsw.nb_neighbors(1)}, efSearch={index.hnsw.efSearch})"
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        return f"{name}(nlist={ivf.nlist}, nprobe={ivf.nprobe})"
+    except RuntimeError:
+        return name
+
+
+def build_faiss_index(embeddings, index_config: dict = None):
     """
     Build a FAISS index and return it.
 
+    Args:
+        embeddings: (n, d) embedding matrix
+        index_config: Optional `index:` section of configs/app.yaml selecting
+            flat (default, exact), ivf_flat, ivf_pq, hnsw, or the compact exhaustive
+            sq_fp16 / sq_int8 (vectors stored as float16 / int8)
+
     # TODO hints:
     # - Use IndexFlatIP or L2; ensure vectors are normalized if using IP.
 
@@ -57,19 +339,367 @@ def build_faiss_index(embeddings):
     # (normalize_L2 modifies the array in-place)
     embeddings = embeddings.copy()
     
-    # Ensure embeddings are normalized for IndexFlatIP (inner product = cosine similarity)
+    # Ensure embeddings are normalized for inner-product indexes (inner product = cosine similarity)
     # Note: embeddings should already be normalized from embed_texts, but normalize_L2 is idempotent
     faiss.normalize_L2(embeddings)
     
-    # Create IndexFlatIP (Inner Product) for normalized vectors
+    # Create the configured inner-product index; IVF types are trained on a sample first
+    params = resolve_index_config(index_config)
     dimension = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dimension)
+    index = make_faiss_index(dimension, params, n_vectors=len(embeddings))
+    train_faiss_index(index, embeddings, train_sample=int(params['train_sample']))
     index.add(embeddings)
     
     return index
 
 
-def save_index(index, meta_rows, out_dir: str):
+def build_index_streaming(chunks: Iterable[Dict], model_name: str, out_dir: str,
+                          index_config: dict = None, batch_size: int = 256, cache_dir: str = None,
+                          backend_config=None, embeddings=None):
+    """
+    Embed and index a stream of chunks in fixed-size batches, writing all artifacts as it goes.
+
+    Chunks flow straight from the generator into `model.encode` and `index.add`;
+    metadata rows go to a Parquet writer and chunk text to the text store batch
+    by batch. Peak memory is bounded by the batch size (plus the IVF training
+    sample and the FAISS index itself), not by corpus size. Files are built in
+    a staging directory and swapped into `out_dir` once the build completes
+    (see publish_dir), so serving processes never see a half-written index.
+
+    Args:
+        chunks: Iterable of chunk dicts ({id, text, meta}), e.g. from chunk.iter_chunks
+        model_name: SentenceTransformer model name
+        out_dir: Output directory (same layout as save_index)
+        index_config: Optional `index:` config section
+        batch_size: Chunks per embedding batch
+        cache_dir: Optional persistent embedding cache directory
+        backend_config: Optional `embedding_backend:` config (torch, onnx, onnx_int8)
+        embeddings: Optional precomputed (n, d) matrix row-aligned with `chunks`, e.g.
+            the memory-mapped output of bulk_embed.embed_corpus; batches are sliced
+            from it instead of encoded, and no model is loaded
+
+    Returns:
+        The built FAISS index.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    params = resolve_index_config(index_config)
+    needs_training = params['type'] in TRAINED_INDEX_TYPES
+    train_sample = int(params['train_sample'])
+
+    cache = None
+    if embeddings is None and cache_dir:
+        cache = ChunkEmbeddingCache(cache_dir, embedding_model_id(model_name, backend_config))
+    model = None if cache or embeddings is not None else load_embedding_model(model_name, backend_config)
+    # Files are written to a staging directory and swapped in at the end (see publish_dir)
+    out_path = staging_dir(out_dir)
+    text_writer = StringColumnWriter(out_path / TEXT_DATA_FILE, out_path / TEXT_OFFSETS_FILE)
+    span_writer = SpanColumnWriter(out_path / SENTENCE_INDPTR_FILE, out_path / SENTENCE_SPANS_FILE)
+    bm25 = BM25Builder(spill_dir=out_path)  # postings runs spill into the staging directory
+    meta_writer = None
+    index = None
+    pending = []  # IVF / int8 only: vectors held back until the quantizer is trained
+
+    def flush_pending():
+        nonlocal index, pending
+        sample = np.concatenate(pending)
+        pending = []
+        index = make_faiss_index(sample.shape[1], params, n_vectors=len(sample))
+        train_faiss_index(index, sample, train_sample=train_sample)
+        index.add(sample)
+
+    try:
+        for batch_no, batch in enumerate(iter_batches(chunks, batch_size), 1):
+            texts = [chunk['text'] for chunk in batch]
+            if embeddings is not None:
+                start = len(text_writer)
+                if start + len(batch) > len(embeddings):
+                    raise ValueError(f"More chunks than precomputed embeddings ({len(embeddings)})")
+                vectors = np.array(embeddings[start:start + len(batch)], dtype=np.float32)
+            elif cache is not None:
+                vectors, model, _ = _embed_with_cache(texts, model_name, cache, model=model,
+                                                      batch_size=batch_size, show_progress_bar=False,
+                                                      backend_config=backend_config)
+            else:
+                vectors = np.array(model.encode(texts, batch_size=batch_size, normalize_embeddings=True,
+                                                show_progress_bar=False), dtype=np.float32)
+            faiss.normalize_L2(vectors)
+
+            if needs_training and index is None:
+                pending.append(vectors)
+                if sum(len(v) for v in pending) >= train_sample:
+                    flush_pending()
+            else:
+                if index is None:
+                    index = make_faiss_index(vectors.shape[1], params)
+                index.add(vectors)
+
+            # Metadata and text are row-aligned with the order vectors enter the index
+            rows = [{'chunk_id': chunk['id'], **chunk['meta'],
+                     'is_toc': is_toc_or_header_chunk({'text': chunk['text'], 'chunk_id': chunk['id'],
+                                                       'meta': chunk['meta']})}
+                    for chunk in batch]
+            table = pa.Table.from_pylist(rows)
+            if meta_writer is None:
+                meta_writer = pq.ParquetWriter(str(out_path / 'metadata.parquet'), table.schema)
+            meta_writer.write_table(table.cast(meta_writer.schema))
+            text_writer.append(texts)
+            span_writer.append(sentence_spans(text) for text in texts)
+            bm25.add(texts)
+
+            if batch_no % 10 == 0:
+                print(f"  Indexed {len(text_writer)} chunks...")
+
+        if pending:
+            flush_pending()
+        if embeddings is not None and len(text_writer) != len(embeddings):
+            raise ValueError(f"{len(text_writer)} chunks for {len(embeddings)} precomputed embeddings")
+    except BaseException:
+        text_writer.close()
+        span_writer.close()
+        if meta_writer is not None:
+            meta_writer.close()
+        shutil.rmtree(out_path, ignore_errors=True)
+        raise
+    text_writer.close()
+    span_writer.close()
+    if meta_writer is not None:
+        meta_writer.close()
+
+    if index is None:
+        shutil.rmtree(out_path, ignore_errors=True)
+        raise ValueError("No chunks to index")
+
+    faiss.write_index(index, str(out_path / 'index.faiss'))
+    with open(out_path / INDEX_CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump(params, f, indent=2)
+    bm25.save(out_path)
+    publish_dir(out_path, out_dir)
+
+    print(f"✅ Streamed {index.ntotal} chunks into {out_dir} ({describe_index(index)})")
+    return index
+
+
+def evaluate_index_tradeoff(embeddings, queries=None, index_configs: List[dict] = None,
+                            k: int = 10, nprobe_values=(1, 4, 8, 16, 32, 64),
+                            ef_search_values=(16, 32, 64, 128, 256), n_queries: int = 200,
+                            seed: int = 0) -> List[Dict]:
+    """
+    Measure recall@k versus query latency of ANN index types against the exact flat index.
+
+    Each index type is built once and then searched at every `nprobe` (IVF) or
+    `ef_search` (HNSW) operating point.
+
+    Args:
+        embeddings: (n, d) corpus embeddings
+        queries: Optional (m, d) query embeddings; defaults to a random sample of the corpus
+        index_configs: List of `index:` config dicts to compare (defaults to every ANN type)
+        k: Cut-off for recall@k
+        nprobe_values / ef_search_values: Query-time settings to sweep
+        n_queries: Number of corpus vectors sampled as queries when `queries` is None
+        seed: Sampling seed
+
+    Returns:
+        List of dicts: {type, nprobe, ef_search, recall_at_k, ms_per_query, build_s}.
+        The first row is the flat baseline (recall 1.0).
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).copy()
+    faiss.normalize_L2(embeddings)
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        pick = rng.choice(len(embeddings), size=min(n_queries, len(embeddings)), replace=False)
+        queries = embeddings[pick]
+    queries = np.ascontiguousarray(queries, dtype=np.float32).copy()
+    faiss.normalize_L2(queries)
+    k = min(k, len(embeddings))
+
+    if index_configs is None:
+        index_configs = [{'type': t} for t in INDEX_TYPES if t != 'flat']
+
+    def timed_search(index):
+        start = time.perf_counter()
+        _, ids = index.search(queries, k)
+        return ids, (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    flat = build_faiss_index(embeddings)
+    flat_build_s = time.perf_counter() - start
+    truth, flat_ms = timed_search(flat)
+    truth_sets = [set(row[row >= 0].tolist()) for row in truth]
+
+    def recall(ids):
+        hits = sum(len(truth_sets[i] & set(row[row >= 0].tolist())) for i, row in enumerate(ids))
+        return hits / max(1, sum(len(t) for t in truth_sets))
+
+    report = [{'type': 'flat', 'nprobe': None, 'ef_search': None, 'recall_at_k': 1.0,
+               'ms_per_query': flat_ms, 'build_s': flat_build_s, 'index_mb': index_mb(flat)}]
+
+    for config in index_configs:
+        params = resolve_index_config(config)
+        start = time.perf_counter()
+        index = build_faiss_index(embeddings, params)
+        build_s = time.perf_counter() - start
+
+        if params['type'] == 'hnsw':
+            sweep = [{'ef_search': ef} for ef in ef_search_values]
+        elif params['type'] in SCALAR_QUANTIZER_TYPES:
+            sweep = [{}]  # exhaustive: no query-time knob
+        else:
+            nlist = faiss.extract_index_ivf(index).nlist
+            sweep = [{'nprobe': p} for p in nprobe_values if p <= nlist]
+        for knobs in sweep:
+            set_search_params(index, **knobs)
+            ids, ms = timed_search(index)
+            report.append({'type': params['type'], 'nprobe': knobs.get('nprobe'),
+                           'ef_search': knobs.get('ef_search'), 'recall_at_k': recall(ids),
+                           'ms_per_query': ms, 'build_s': build_s, 'index_mb': index_mb(index)})
+
+    print(f"📊 Recall@{k} vs latency ({len(queries)} queries, {len(embeddings)} vectors)")
+    for row in report:
+        knob = (f"nprobe={row['nprobe']}" if row['nprobe'] is not None
+                else f"efSearch={row['ef_search']}" if row['ef_search'] is not None else "exact")
+        print(f"   {row['type']:<9} {knob:<14} recall={row['recall_at_k']:.3f}  "
+              f"{row['ms_per_query']:.3f} ms/query  {row['index_mb']:.1f} MB  (build {row['build_s']:.2f}s)")
+    return report
+
+
+def index_mb(index) -> float:
+    """Serialized size of a FAISS index in MB (what index.faiss takes on disk and when mapped)."""
+    return faiss.serialize_index(index).nbytes / 1e6
+
+
+def evaluate_quantization(embeddings, queries=None, k: int = 10, n_queries: int = 200, seed: int = 0) -> List[Dict]:
+    """
+    Accuracy report of the float16 / int8 scalar-quantized index types against float32.
+
+    Besides recall@k versus the exact float32 flat index, reports how far the
+    quantized inner-product scores drift from the exact ones.
+
+    Args:
+        embeddings: (n, d) corpus embeddings
+        queries: Optional (m, d) query embeddings; defaults to a random sample of the corpus
+        k: Cut-off for recall@k
+        n_queries: Number of corpus vectors sampled as queries when `queries` is None
+        seed: Sampling seed
+
+    Returns:
+        List of dicts: {type, index_mb, compression, recall_at_k, max_score_error, ms_per_query};
+        the first row is the float32 flat baseline.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).copy()
+    faiss.normalize_L2(embeddings)
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        queries = embeddings[rng.choice(len(embeddings), size=min(n_queries, len(embeddings)), replace=False)]
+    queries = np.ascontiguousarray(queries, dtype=np.float32).copy()
+    faiss.normalize_L2(queries)
+    k = min(k, len(embeddings))
+
+    report = []
+    truth_sets = None
+    for index_type in ('flat',) + tuple(SCALAR_QUANTIZER_TYPES):
+        index = build_faiss_index(embeddings, {'type': index_type})
+        start = time.perf_counter()
+        scores, ids = index.search(queries, k)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        if truth_sets is None:
+            truth_sets = [set(row[row >= 0].tolist()) for row in ids]
+        hits = sum(len(truth_sets[i] & set(row[row >= 0].tolist())) for i, row in enumerate(ids))
+        # Score of each returned id under this index vs its exact float32 inner product
+        exact = np.einsum('qd,qkd->qk', queries, embeddings[np.maximum(ids, 0)])
+        report.append({
+            'type': index_type,
+            'index_mb': index_mb(index),
+            'recall_at_k': hits / max(1, sum(len(t) for t in truth_sets)),
+            'max_score_error': float(np.abs(scores - exact)[ids >= 0].max()),
+            'ms_per_query': ms,
+        })
+    for row in report:
+        row['compression'] = report[0]['index_mb'] / row['index_mb']
+
+    print(f"📦 Scalar quantization vs float32 ({len(queries)} queries, {len(embeddings)} vectors)")
+    for row in report:
+        print(f"   {row['type']:<9} recall@{k}={row['recall_at_k']:.3f}  {row['index_mb']:.1f} MB "
+              f"({row['compression']:.1f}x smaller)  max score error {row['max_score_error']:.4f}  "
+              f"{row['ms_per_query']:.3f} ms/query")
+    return report
+
+
+def save_text_store(texts: List[str], out_dir: str):
+    """
+    Write chunk text as one contiguous UTF-8 blob plus an offsets array.
+
+    Row i of the store is the text of index vector i. `load_index` opens the
+    blob with mmap, so app workers skip parsing the chunks JSON entirely.
+    Sentence spans of every chunk are computed here once and saved alongside,
+    so answer composition never re-segments chunk text.
+    """
+    out_path = Path(out_dir)
+    out_path.mkdir(parents=True, exist_ok=True)
+    column = StringColumn.from_strings(texts)
+    column.save(out_path / TEXT_DATA_FILE, out_path / TEXT_OFFSETS_FILE)
+    sentences = SpanColumn.from_texts(texts)
+    sentences.save(out_path / SENTENCE_INDPTR_FILE, out_path / SENTENCE_SPANS_FILE)
+    print(f"✅ Saved chunk text store: {len(column)} chunks, {len(column.data) / 1024:.1f} KB, "
+          f"{len(sentences.spans)} sentences")
+
+
+def save_sentence_embeddings(index_dir: str, model_name: str, batch_size: int = 64, cache_dir: str = None,
+                             model=None, backend_config=None) -> int:
+    """
+    Embed every stored sentence once and write the vectors next to the chunk text.
+
+    Rows follow the sentence spans of the text store, so at query time the
+    sentence embeddings of a hit are a slice of one memory-mapped matrix and
+    semantic quote scoring (config `quote_scoring: semantic`) costs a
+    matrix-vector product instead of extra model forward passes.
+
+    Args:
+        index_dir: Index directory with a chunk text store and sentence spans
+        model_name: Embedding model (must be the one used for queries)
+        batch_size: Chunks per embedding batch
+        cache_dir: Optional persistent embedding cache directory
+        model: Optional already-loaded SentenceTransformer
+        backend_config: Optional `embedding_backend:` config (torch, onnx, onnx_int8)
+
+    Returns:
+        Number of sentence vectors written.
+    """
+    in_path = Path(index_dir)
+    text = StringColumn.open(in_path / TEXT_DATA_FILE, in_path / TEXT_OFFSETS_FILE)
+    sentences = SpanColumn.open(in_path / SENTENCE_INDPTR_FILE, in_path / SENTENCE_SPANS_FILE)
+    cache = ChunkEmbeddingCache(cache_dir, embedding_model_id(model_name, backend_config)) if cache_dir else None
+    if cache is None and model is None:
+        model = load_embedding_model(model_name, backend_config)
+
+    dim, count = None, 0
+    # A new file swapped in by os.replace: the current one may be memory-mapped by a serving process
+    tmp_path = in_path / (SENTENCE_VECTORS_FILE + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        for rows in iter_batches(range(len(text)), batch_size):
+            chunk_texts = text.take(rows)
+            batch = [chunk[start:end]
+                     for chunk, spans in zip(chunk_texts, sentences.take(rows)) for start, end in spans]
+            if cache is not None:
+                vectors, model, _ = _embed_with_cache(batch, model_name, cache, model=model,
+                                                      show_progress_bar=False, backend_config=backend_config)
+            else:
+                vectors = np.array(model.encode(batch, batch_size=64, normalize_embeddings=True,
+                                                show_progress_bar=False), dtype=np.float32)
+            faiss.normalize_L2(vectors)
+            f.write(vectors.tobytes())
+            dim, count = vectors.shape[1], count + len(vectors)
+    os.replace(tmp_path, in_path / SENTENCE_VECTORS_FILE)
+
+    # Written last: load_index ignores vectors without a matching count
+    with open(in_path / SENTENCE_VECTORS_META_FILE, 'w', encoding='utf-8') as f:
+        json.dump({'model_name': model_name, 'dim': dim, 'count': count}, f)
+    print(f"✅ Saved {count} sentence embeddings to: {in_path / SENTENCE_VECTORS_FILE}")
+    return count
+
+
+def save_index(index, meta_rows, out_dir: str, chunks=None, index_config: dict = None):
     """
     Persist FAISS index + metadata (CSV/Parquet) to data/index/.
 
@@ -77,6 +707,13 @@ def save_index(index, meta_rows, out_dir: str):
         index: FAISS index to save
         meta_rows: List of dicts or DataFrame with metadata (chunk IDs, source info)
         out_dir: Output directory path
+        chunks: Optional list of chunk dicts (or dict chunk_id -> chunk) whose text is
+            written to the memory-mapped chunk text store; a 'text' column in
+            meta_rows is used instead when present. With chunk text, an is_toc
+            column flagging TOC/header chunks is added to the metadata
+        index_config: Optional `index:` config the index was built with; stored in
+            index_config.json so load_index restores the same search parameters
+            (default: read from the index itself, see index_config_from_index)
 
     # TODO hints:
     # - Write index to .faiss and metadata to .parquet with chunk IDs and source info.
@@ -84,13 +721,35 @@ def save_index(index, meta_rows, out_dir: str):
     # Acceptance:
     # - Files exist in data/index/.
     """
-    out_path = Path(out_dir)
-    out_path.mkdir(parents=True, exist_ok=True)
-    
+    # Write into a staging directory and swap the files in at the end (see publish_dir):
+    # serving processes may have the current files memory-mapped
+    out_path = staging_dir(out_dir)
+    try:
+        n_rows = _write_index_files(index, meta_rows, out_path, chunks=chunks, index_config=index_config)
+    except BaseException:
+        shutil.rmtree(out_path, ignore_errors=True)
+        raise
+    publish_dir(out_path, out_dir)
+
+    print(f"✅ Saved index to: {Path(out_dir) / 'index.faiss'} ({describe_index(index)})")
+    print(f"✅ Saved metadata to: {Path(out_dir) / 'metadata.parquet'}")
+    print(f"   Index size: {index.ntotal} vectors")
+    print(f"   Metadata rows: {n_rows}")
+
+
+def _write_index_files(index, meta_rows, out_path: Path, chunks=None, index_config: dict = None) -> int:
+    """Write every save_index artifact into `out_path`; returns the number of metadata rows."""
     # Save FAISS index
     index_path = out_path / 'index.faiss'
     faiss.write_index(index, str(index_path))
     
+    # Record the index type and its query-time parameters
+    params = resolve_index_config(index_config) if index_config is not None else index_config_from_index(index)
+    with open(out_path / INDEX_CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump(params, f, indent=2)
+    
+    import pandas as pd
+    
     # Convert meta_rows to DataFrame if it's a list
     if isinstance(meta_rows, list):
         meta_df = pd.DataFrame(meta_rows)
@@ -99,50 +758,166 @@ def save_index(index, meta_rows, out_dir: str):
     else:
         raise ValueError("meta_rows must be a list of dicts or a pandas DataFrame")
     
+    # Chunk text goes to the binary text store, aligned with the metadata rows
+    texts = None
+    if 'text' in meta_df.columns:
+        texts = meta_df['text'].astype(str).tolist()
+        meta_df = meta_df.drop(columns=['text'])
+    elif chunks is not None:
+        if isinstance(chunks, list):
+            chunks = {chunk['id']: chunk for chunk in chunks}
+        missing = [cid for cid in meta_df['chunk_id'] if cid not in chunks]
+        if missing:
+            raise ValueError(f"{len(missing)} metadata rows have no chunk text, e.g. {missing[0]}")
+        texts = [chunks[cid]['text'] for cid in meta_df['chunk_id']]
+    if texts is not None:
+        save_text_store(texts, out_path)
+        build_bm25(texts, out_path)  # sparse leg for hybrid retrieval
+        if 'is_toc' not in meta_df.columns:
+            # TOC/header flag is a pure function of the chunk: compute it once here
+            meta_df = meta_df.assign(is_toc=[
+                is_toc_or_header_chunk({'text': text, 'chunk_id': cid, 'meta': {'para_idx_start': start}})
+                for text, cid, start in zip(texts, meta_df['chunk_id'], meta_df['para_idx_start'])
+            ])
+    
     # Save metadata
     metadata_path = out_path / 'metadata.parquet'
     meta_df.to_parquet(metadata_path, index=False)
-    
-    print(f"✅ Saved index to: {index_path}")
-    print(f"✅ Saved metadata to: {metadata_path}")
-    print(f"   Index size: {index.ntotal} vectors")
-    print(f"   Metadata rows: {len(meta_df)}")
+    return len(meta_df)
+
+
+def read_metadata_columns(metadata_path):
+    """
+    Read the MetadataStore columns of metadata.parquet as NumPy arrays.
+
+    Goes through pyarrow directly rather than pandas, which keeps pandas out
+    of the serving start-up path. Returns ({column: array}, n_rows).
+    """
+    import pyarrow.parquet as pq
 
+    parquet_file = pq.ParquetFile(metadata_path)
+    names = [name for name in MetadataStore.FRAME_COLUMNS if name in parquet_file.schema_arrow.names]
+    # use_pandas_metadata=False: the pandas index metadata would import pandas
+    table = parquet_file.read(columns=names, use_pandas_metadata=False)
+    # Plain lists: Arrow's to_numpy() imports pandas; from_frame packs them into arrays
+    return {name: table.column(name).to_pylist() for name in names}, table.num_rows
 
-def load_index(in_dir: str):
+
+def read_faiss_index(index_path, mmap: bool = False):
+    """
+    faiss.read_index, optionally memory-mapped.
+
+    IO_FLAG_MMAP_IFC maps the vector codes (flat, scalar-quantized, HNSW and
+    IVF lists) straight from the file; FAISS builds without it read normally.
+    """
+    flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+    if mmap and flag is not None:
+        try:
+            return faiss.read_index(str(index_path), flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            print(f"⚠️  Could not memory-map {index_path} ({e}); reading it into memory")
+    return faiss.read_index(str(index_path))
+
+
+def load_index(in_dir: str, chunks_lookup: dict = None, nprobe: int = None, ef_search: int = None,
+               mmap: bool = False, profiler=None):
     """
     Load FAISS index + metadata.
 
     Args:
         in_dir: Input directory path containing index.faiss and metadata.parquet
+        chunks_lookup: Optional dict mapping chunk_id to chunk dict with 'text' field;
+            only used for indexes saved without a chunk text store
+        nprobe: Optional IVF nprobe override (default: value saved with the index)
+        ef_search: Optional HNSW efSearch override (default: value saved with the index)
+        mmap: Memory-map the FAISS index file instead of reading it into memory
+            (read-only); processes serving the same index then share its pages
+        profiler: Optional startup.StartupProfiler; FAISS loading is timed as the
+            'index' phase, metadata / text / BM25 as 'metadata'
 
     # TODO hints:
     # - Read index and matching metadata frame; sanity-check row counts.
 
     # Acceptance:
-    # - Returns (index, metadata_df).
+    # - Returns (index, metadata) where metadata is a columnar MetadataStore
+    #   (call .to_frame() for a pandas DataFrame).
     """
     in_path = Path(in_dir)
     
-    # Load FAISS index
-    index_path = in_path / 'index.faiss'
-    if not index_path.exists():
-        raise FileNotFoundError(f"Index file not found: {index_path}")
-    index = faiss.read_index(str(index_path))
+    with phase(profiler, 'index'):
+        # Load FAISS index
+        index_path = in_path / 'index.faiss'
+        if not index_path.exists():
+            raise FileNotFoundError(f"Index file not found: {index_path}")
+        index = read_faiss_index(index_path, mmap=mmap)
+    
+        # Restore query-time parameters saved with the index, then apply overrides
+        config_path = in_path / INDEX_CONFIG_FILE
+        if config_path.exists():
+            with open(config_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            set_search_params(index, nprobe=saved.get('nprobe'), ef_search=saved.get('ef_search'))
+        set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    
+    with phase(profiler, 'metadata'):
+        # Load metadata
+        metadata_path = in_path / 'metadata.parquet'
+        if not metadata_path.exists():
+            raise FileNotFoundError(f"Metadata file not found: {metadata_path}")
+        meta_columns, n_rows = read_metadata_columns(metadata_path)
+    
+        # Sanity check: row counts should match
+        if index.ntotal != n_rows:
+            raise ValueError(
+                f"Mismatch: index has {index.ntotal} vectors but metadata has {n_rows} rows"
+            )
+    
+        # Pack metadata into compact columns; the Arrow table is discarded
+        store = MetadataStore.from_frame(meta_columns)
     
-    # Load metadata
-    metadata_path = in_path / 'metadata.parquet'
-    if not metadata_path.exists():
-        raise FileNotFoundError(f"Metadata file not found: {metadata_path}")
-    meta_df = pd.read_parquet(metadata_path)
+        # Chunk text: memory-mapped store written by save_index, else the caller's lookup
+        text_path = in_path / TEXT_DATA_FILE
+        if text_path.exists():
+            store.text = StringColumn.open(text_path, in_path / TEXT_OFFSETS_FILE)
+            if len(store.text) != len(store):
+                raise ValueError(
+                    f"Mismatch: chunk text store has {len(store.text)} rows but metadata has {len(store)} rows"
+                )
+            print(f"✅ Mapped chunk text store: {text_path}")
+            if (in_path / SENTENCE_INDPTR_FILE).exists():
+                store.sentences = SpanColumn.open(in_path / SENTENCE_INDPTR_FILE, in_path / SENTENCE_SPANS_FILE)
+                if len(store.sentences) != len(store):
+                    raise ValueError(
+                        f"Mismatch: sentence spans have {len(store.sentences)} rows but metadata has {len(store)} rows"
+                    )
+                vectors_meta_path = in_path / SENTENCE_VECTORS_META_FILE
+                if vectors_meta_path.exists():
+                    with open(vectors_meta_path, 'r', encoding='utf-8') as f:
+                        vectors_meta = json.load(f)
+                    if 0 < vectors_meta['count'] == len(store.sentences.spans):
+                        store.sentence_vectors = np.memmap(in_path / SENTENCE_VECTORS_FILE, dtype=np.float32, mode='r',
+                                                           shape=(vectors_meta['count'], vectors_meta['dim']))
+                        print(f"✅ Mapped sentence embeddings ({vectors_meta['model_name']})")
+                    else:
+                        print(f"⚠️  Ignoring sentence embeddings: {vectors_meta['count']} vectors for "
+                              f"{len(store.sentences.spans)} sentences")
+            else:
+                store.index_sentences()  # index saved before sentence spans were stored
+        elif chunks_lookup:
+            store.attach_text(chunks_lookup)
+        if store.is_toc is None and store.text is not None:
+            store.flag_toc_chunks()  # index saved before the is_toc column existed
     
-    # Sanity check: row counts should match
-    if index.ntotal != len(meta_df):
-        raise ValueError(
-            f"Mismatch: index has {index.ntotal} vectors but metadata has {len(meta_df)} rows"
-        )
+        # BM25 inverted index for hybrid retrieval (memory-mapped postings)
+        if BM25Index.exists(in_path):
+            store.sparse = BM25Index.open(in_path)
+            if len(store.sparse) != len(store):
+                raise ValueError(
+                    f"Mismatch: BM25 index has {len(store.sparse)} rows but metadata has {len(store)} rows"
+                )
+            print(f"✅ Mapped BM25 index: {len(store.sparse.term_ids)} terms")
     
-    print(f"✅ Loaded index: {index.ntotal} vectors, dimension {index.d}")
-    print(f"✅ Loaded metadata: {len(meta_df)} rows")
+    print(f"✅ Loaded index: {index.ntotal} vectors, dimension {index.d}, {describe_index(index)}")
+    print(f"✅ Loaded metadata: {len(store)} rows ({store.nbytes / 1024:.1f} KB in column store)")
     
-    return index, meta_df
+    return index, store
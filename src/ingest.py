@@ -45,14 +45,20 @@ def download_book(book: str, out_dir: str, url: str = None) -> str:
         print(f"File already exists: {out_path}")
         return str(out_path)
     
-    # Download the book
+    # Download the book, streaming it to disk in blocks so memory stays flat
     print(f"Downloading {book} from {url}...")
-    response = requests.get(url, timeout=30)
-    response.raise_for_status()
-    
-    # Save to file
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text(response.text, encoding="utf-8")
+    part_path = out_path.with_name(out_path.name + ".part")
+    with requests.get(url, timeout=30, stream=True) as response:
+        response.raise_for_status()
+        if response.encoding is None:
+            response.encoding = "utf-8"
+        # Write to a temporary file first so an interrupted download is never mistaken
+        # for a finished one by the "already exists" check above
+        with open(part_path, "w", encoding="utf-8") as f:
+            for block in response.iter_content(chunk_size=1 << 16, decode_unicode=True):
+                f.write(block)
+    part_path.replace(out_path)
     print(f"Saved to: {out_path}")
     
     return str(out_path)
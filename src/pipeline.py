@@ -0,0 +1,127 @@
+"""
+Streaming ingest -> clean -> chunk -> embed -> index pipeline with bounded memory.
+
+Usage:
+    python -m src.pipeline --config configs/app.yaml --book dorian --out-dir data/index
+    python -m src.pipeline --book iliad --shard-root data/index   # add/replace one shard
+    python -m src.pipeline --shard-root data/index --prune         # delete replaced shard builds
+    python -m src.pipeline --book dorian --bulk-workers 4          # embed with src.bulk_embed first
+
+A shard is built into a fresh shards/<book>-<timestamp> directory and only
+then registered in shards.json, so processes serving the root keep using the
+previous build until they switch to the new manifest (ShardedIndex.refresh).
+The previous build is kept; --prune deletes it once every server has switched.
+"""
+from pathlib import Path
+import argparse
+from src.config import load_config
+from src.ingest import download_book
+from src.clean import iter_clean_paragraphs
+from src.chunk import iter_chunks
+
+
+def stream_build_index(book: str, out_dir: str, config: dict, raw_dir: str = "data/raw",
+                       url: str = None, batch_size: int = 256, cache_dir: str = None,
+                       bulk_workers: int = None, embeddings_dir: str = None):
+    """
+    Download (if needed), clean, chunk, embed and index one book as a stream.
+
+    Paragraphs are generated line by line from the raw file, chunked with a
+    sliding window, and embedded/added to the index in fixed-size batches, so
+    memory use does not grow with the size of the input.
+
+    Args:
+        book: Book name (used in chunk ids and metadata)
+        out_dir: Index output directory
+        config: Configuration dict (chunk_size, chunk_overlap, embedding_model, index, ...)
+        raw_dir: Directory holding (or receiving) the raw text
+        url: Optional download URL override
+        batch_size: Chunks per embedding batch
+        cache_dir: Optional persistent embedding cache directory
+        bulk_workers: Embed every chunk up front with bulk_embed.embed_corpus on this
+            many processes (length-bucketed, resumable) and index the resulting
+            memory-mapped matrix; chunk texts are then held in memory, and the
+            embedding cache isn't used for the chunks
+        embeddings_dir: bulk_embed output/checkpoint directory (default: data/embeddings/<book>)
+
+    With `quote_scoring: semantic` in the config, sentence embeddings for quote
+    selection are written as well.
+
+    Returns:
+        The built FAISS index.
+    """
+    # Deferred: pulls in FAISS and sentence-transformers
+    from src.embed_index import build_index_streaming, save_sentence_embeddings
+
+    raw_path = download_book(book, raw_dir, url=url)
+    paragraphs = iter_clean_paragraphs(raw_path)
+    chunks = iter_chunks(paragraphs, config['chunk_size'], config['chunk_overlap'], book)
+    embeddings = None
+    if bulk_workers:
+        from src.bulk_embed import embed_corpus
+        chunks = list(chunks)
+        embeddings = embed_corpus([chunk['text'] for chunk in chunks], config['embedding_model'],
+                                  embeddings_dir or str(Path("data/embeddings") / book),
+                                  backend_config=config.get('embedding_backend'), workers=bulk_workers)
+    index = build_index_streaming(
+        chunks,
+        model_name=config['embedding_model'],
+        out_dir=out_dir,
+        index_config=config.get('index'),
+        batch_size=batch_size,
+        cache_dir=cache_dir,
+        backend_config=config.get('embedding_backend'),
+        embeddings=embeddings,
+    )
+    if config.get('quote_scoring') == 'semantic':
+        save_sentence_embeddings(out_dir, config['embedding_model'], cache_dir=cache_dir,
+                                 backend_config=config.get('embedding_backend'))
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a book through clean/chunk/embed into a FAISS index.")
+    parser.add_argument("--config", default="configs/app.yaml", help="Path to config YAML")
+    parser.add_argument("--book", default=None, help="Book name (default: config['book'])")
+    parser.add_argument("--url", default=None, help="Optional download URL override")
+    parser.add_argument("--raw-dir", default="data/raw", help="Directory for raw downloads")
+    parser.add_argument("--out-dir", default="data/index", help="Index output directory")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per embedding batch")
+    parser.add_argument("--shard-root", default=None,
+                        help="Build the book as a shard under this sharded index root and register it")
+    parser.add_argument("--prune", action="store_true",
+                        help="Delete shard directories under --shard-root no longer in shards.json, then exit")
+    parser.add_argument("--cache-dir", default=None, help="Optional persistent embedding cache directory")
+    parser.add_argument("--bulk-workers", type=int, default=None,
+                        help="Embed all chunks first with src.bulk_embed on this many processes")
+    parser.add_argument("--embeddings-dir", default=None,
+                        help="bulk_embed output/checkpoint directory (default: data/embeddings/<book>)")
+    args = parser.parse_args()
+
+    if args.prune:
+        if not args.shard_root:
+            parser.error("--prune needs --shard-root")
+        from src.shards import prune_shard_dirs
+        for path in prune_shard_dirs(args.shard_root):
+            print(f"🗑️  Deleted unused shard directory {path}")
+        return
+
+    config = load_config(args.config)
+    book = args.book or config['book']
+    out_dir = Path(args.out_dir)
+    if args.shard_root:
+        from src.shards import new_shard_dir
+        out_dir = new_shard_dir(args.shard_root, book)
+    stream_build_index(book, str(out_dir), config, raw_dir=args.raw_dir,
+                       url=args.url, batch_size=args.batch_size, cache_dir=args.cache_dir,
+                       bulk_workers=args.bulk_workers, embeddings_dir=args.embeddings_dir)
+    if args.shard_root:
+        from src.shards import register_shard
+        replaced = register_shard(args.shard_root, book, path=out_dir)
+        print(f"✅ Registered shard '{book}' ({out_dir}) in {args.shard_root}")
+        if replaced is not None:
+            print(f"   Previous build kept at {replaced}; delete it with --prune once every server has switched")
+
+
+if __name__ == "__main__":
+    main()
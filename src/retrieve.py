@@ -1,67 +1,469 @@
 """
-Top-k semantic retrieval against FAISS index.
+Top-k semantic retrieval against FAISS index (optionally fused with BM25).
 """
-from typing import List, Dict, Callable
+from typing import List, Dict, Callable, Optional
+import threading
 import numpy as np
 import faiss
+from src.store import MetadataStore
 
 
-def retrieve(query: str, index, embed_fn: Callable, metadata_df, chunks_lookup: dict = None, k: int = 5) -> List[Dict]:
+def _as_query_matrix(query_embeddings) -> np.ndarray:
+    """Coerce one or many query embeddings into a contiguous (n, d) float32 matrix."""
+    query_embeddings = np.asarray(query_embeddings)
+    if len(query_embeddings.shape) == 1:
+        query_embeddings = query_embeddings.reshape(1, -1)
+    if query_embeddings.dtype != np.float32:
+        query_embeddings = query_embeddings.astype(np.float32)
+    return np.ascontiguousarray(query_embeddings)
+
+
+def _hydrate_from_store(scores: np.ndarray, indices: np.ndarray, store: MetadataStore,
+                        chunks_lookup: dict = None) -> List[List[Dict]]:
+    """Turn FAISS (scores, indices) matrices into per-query result lists with one gather per query."""
+    n_rows = len(store)
+    batch_results = []
+    for score_row, idx_row in zip(scores, indices):
+        valid = (idx_row >= 0) & (idx_row < n_rows)
+        hits = [
+            {'score': float(score), **hit}
+            for score, hit in zip(score_row[valid].tolist(), store.gather(idx_row[valid]))
+        ]
+        if store.text is None and chunks_lookup:
+            for hit in hits:
+                if hit['chunk_id'] in chunks_lookup:
+                    hit['text'] = chunks_lookup[hit['chunk_id']].get('text', '')
+        batch_results.append(hits)
+    return batch_results
+
+
+def _hydrate_results(scores: np.ndarray, indices: np.ndarray, metadata_df, chunks_lookup: dict = None) -> List[List[Dict]]:
+    """
+    Turn FAISS (scores, indices) matrices into per-query result lists.
+
+    A `MetadataStore` (or anything with the same `gather` interface, such as a
+    `ShardedIndex`) is hydrated with vectorized column gathers. A plain
+    DataFrame is looked up with a single positional selection for the whole
+    batch instead of one `iloc` call per hit.
+    """
+    if hasattr(metadata_df, 'gather'):
+        return _hydrate_from_store(scores, indices, metadata_df, chunks_lookup)
+
+    n_rows = len(metadata_df)
+    valid = (indices >= 0) & (indices < n_rows)
+    unique_ids = np.unique(indices[valid])
+    rows = metadata_df.iloc[unique_ids].to_dict('records')
+    row_by_id = dict(zip(unique_ids.tolist(), rows))
+
+    batch_results = []
+    for score_row, idx_row, valid_row in zip(scores, indices, valid):
+        results = []
+        for score, idx in zip(score_row[valid_row].tolist(), idx_row[valid_row].tolist()):
+            row = row_by_id[idx]
+            chunk_id = row['chunk_id']
+
+            # Get text from chunks_lookup if available, otherwise use placeholder
+            if chunks_lookup and chunk_id in chunks_lookup:
+                text = chunks_lookup[chunk_id].get('text', '')
+            elif 'text' in row:
+                text = row['text']
+            else:
+                text = f"[Chunk {chunk_id} - text not available]"
+
+            results.append({
+                'score': float(score),
+                'text': text,
+                'chunk_id': chunk_id,
+                'meta': {
+                    'book': row['book'],
+                    'para_idx_start': int(row['para_idx_start']),
+                    'para_idx_end': int(row['para_idx_end']),
+                    'char_count': int(row['char_count'])
+                }
+            })
+        batch_results.append(results)
+
+    return batch_results
+
+
+FUSION_METHODS = ('rrf', 'weighted')
+FILTER_KEYS = ('book', 'para_range')
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    """Scale a leg's candidate scores to [0, 1] (all ones when they are equal)."""
+    if len(scores) == 0:
+        return scores
+    low, high = float(scores.min()), float(scores.max())
+    if high - low <= 1e-12:
+        return np.ones_like(scores, dtype=np.float64)
+    return (scores.astype(np.float64) - low) / (high - low)
+
+
+def fuse_rankings(dense_scores: np.ndarray, dense_ids: np.ndarray, sparse_hits: List, k: int,
+                  fusion: str = 'rrf', rrf_k: int = 60, dense_weight: float = 0.5):
+    """
+    Fuse dense (FAISS) and sparse (BM25) candidate lists into one top-k per query.
+
+    Args:
+        dense_scores / dense_ids: (n_queries, n_candidates) FAISS search output (-1 = no hit)
+        sparse_hits: Per query (scores, ids) from BM25Index.search
+        k: Results per query
+        fusion: 'rrf' (reciprocal rank fusion, sum of 1 / (rrf_k + rank)) or
+            'weighted' (dense_weight * dense + (1 - dense_weight) * bm25, each min-max scaled)
+        rrf_k: RRF rank offset
+        dense_weight: Weight of the dense leg for weighted fusion
+
+    Returns:
+        (scores, ids) matrices of shape (n_queries, k) holding fused scores; -1 pads missing hits.
+    """
+    if fusion not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion '{fusion}', expected one of {FUSION_METHODS}")
+    n_queries = len(dense_ids)
+    scores_out = np.full((n_queries, k), -np.inf, dtype=np.float32)
+    ids_out = np.full((n_queries, k), -1, dtype=np.int64)
+
+    for q in range(n_queries):
+        valid = dense_ids[q] >= 0
+        legs = [(dense_scores[q][valid], dense_ids[q][valid], dense_weight),
+                (sparse_hits[q][0], sparse_hits[q][1], 1.0 - dense_weight)]
+        fused = {}
+        for leg_scores, leg_ids, weight in legs:
+            if fusion == 'rrf':
+                contributions = 1.0 / (rrf_k + np.arange(1, len(leg_ids) + 1))
+            else:
+                contributions = weight * _min_max(leg_scores)
+            for doc, value in zip(leg_ids.tolist(), contributions.tolist()):
+                fused[doc] = fused.get(doc, 0.0) + value
+        # Best fused score first; ties keep the lower row id
+        ranked = sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:k]
+        for rank, (doc, value) in enumerate(ranked):
+            scores_out[q, rank] = value
+            ids_out[q, rank] = doc
+    return scores_out, ids_out
+
+
+def search_params_excluding(index, excluded: np.ndarray):
+    """
+    FAISS SearchParameters that skip the rows flagged in `excluded` (one bool per row).
+
+    The selector is a bitmap of allowed rows checked inside the search, so
+    flagged vectors never take a top-k slot.
+    """
+    return search_params_with_selector(index, _allowed_selector(~np.asarray(excluded, dtype=bool)))
+
+
+def search_params_with_selector(index, selector):
+    """
+    FAISS SearchParameters searching only the rows accepted by `selector`.
+
+    `selector` is a (bitmap, IDSelectorBitmap) pair from _allowed_selector.
+    The index's current nprobe / efSearch are carried over (SearchParameters
+    would otherwise reset them).
+    """
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = base.nprobe
+    elif isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = base.hnsw.efSearch
+    else:
+        params = faiss.SearchParameters()
+    params.sel = selector[1]
+    params.referenced_objects = list(selector)  # keep the bitmap alive for the C++ side
+    return params
+
+
+def _allowed_selector(allowed: np.ndarray):
+    """(bitmap, IDSelectorBitmap) accepting the rows set in `allowed`."""
+    bitmap = np.packbits(np.asarray(allowed, dtype=bool), bitorder='little')
+    return bitmap, faiss.IDSelectorBitmap(bitmap)
+
+
+def _filter_key(filters: dict, exclude_toc: bool):
+    filters = filters or {}
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown filter(s) {sorted(unknown)}, expected {FILTER_KEYS}")
+    books = filters.get('book')
+    if isinstance(books, str):
+        books = [books]
+    para_range = filters.get('para_range')
+    return (tuple(sorted(books)) if books is not None else None,
+            tuple(para_range) if para_range is not None else None,
+            bool(exclude_toc))
+
+
+def hit_matches(hit: Dict, filters: dict = None) -> bool:
+    """
+    Evaluate structured filters on one hydrated hit.
+
+    Filters:
+        book: Book name or list of names
+        para_range: (first, last) paragraph indices; a chunk matches when its
+            paragraphs overlap the range (None leaves that side open)
+    """
+    books, para_range, _ = _filter_key(filters, False)
+    meta = hit.get('meta', {})
+    if books is not None and meta.get('book') not in books:
+        return False
+    if para_range is not None:
+        first, last = para_range
+        if first is not None and meta.get('para_idx_end', -1) < first:
+            return False
+        if last is not None and meta.get('para_idx_start', -1) > last:
+            return False
+    return True
+
+
+def _filter_mask(key, n_rows: int, book_mask: Callable, para_idx_start, para_idx_end, is_toc) -> Optional[np.ndarray]:
+    """Evaluate a _filter_key over metadata columns; None when every row passes."""
+    books, para_range, exclude_toc = key
+    mask = np.ones(n_rows, dtype=bool)
+    if books is not None:
+        mask &= book_mask(books)
+    if para_range is not None:
+        first, last = para_range
+        if first is not None:
+            mask &= np.asarray(para_idx_end) >= first
+        if last is not None:
+            mask &= np.asarray(para_idx_start) <= last
+    if exclude_toc and is_toc is not None:
+        mask &= ~np.asarray(is_toc, dtype=bool)
+    return None if mask.all() else mask
+
+
+# Guards every MetadataStore's filter cache (searches run on batcher and request threads at once)
+_FILTER_CACHE_LOCK = threading.Lock()
+_FILTER_CACHE_SIZE = 32
+
+
+def _store_filter(store: MetadataStore, filters: dict, exclude_toc: bool):
+    """(mask, selector) for a filter set on a store, computed once and cached on the store."""
+    key = _filter_key(filters, exclude_toc)
+    with _FILTER_CACHE_LOCK:
+        cache = store.__dict__.setdefault('_filter_cache', {})
+        entry = cache.get(key)
+        if entry is None:
+            mask = _filter_mask(
+                key, len(store),
+                lambda books: np.isin(store.book_codes,
+                                      [code for code, book in enumerate(store.books) if book in books]),
+                store.para_idx_start, store.para_idx_end, store.is_toc)
+            entry = (mask, _allowed_selector(mask) if mask is not None else None)
+            if len(cache) >= _FILTER_CACHE_SIZE:
+                cache.pop(next(iter(cache)))  # oldest filter set; readers keep their own entry tuple
+            cache[key] = entry
+    return entry
+
+
+def allowed_rows(metadata, filters: dict = None, exclude_toc: bool = False) -> Optional[np.ndarray]:
+    """
+    Boolean mask of rows passing `filters` (and not flagged is_toc when exclude_toc).
+
+    For a MetadataStore the mask is evaluated once per distinct filter set and
+    cached on the store; a DataFrame's columns are evaluated on each call.
+    Returns None when nothing is filtered out (or the metadata has no columns).
+    """
+    if hasattr(metadata, 'shards'):  # ShardedIndex snapshot: concatenate per-shard masks
+        masks = [allowed_rows(shard.store, filters, exclude_toc) for shard in metadata.shards]
+        if all(mask is None for mask in masks):
+            return None
+        return np.concatenate([
+            np.ones(shard.index.ntotal, dtype=bool) if mask is None else mask
+            for shard, mask in zip(metadata.shards, masks)
+        ])
+    if isinstance(metadata, MetadataStore):
+        return _store_filter(metadata, filters, exclude_toc)[0]
+    if hasattr(metadata, 'iloc'):  # DataFrame
+        return _filter_mask(
+            _filter_key(filters, exclude_toc), len(metadata),
+            lambda books: np.isin(np.asarray(metadata['book']).astype(str), list(books)),
+            metadata['para_idx_start'], metadata['para_idx_end'],
+            metadata['is_toc'] if 'is_toc' in metadata.columns else None)
+    return None
+
+
+def filtered_search_params(index, store, filters: dict = None, exclude_toc: bool = False):
+    """SearchParameters restricting `index` to the metadata's allowed rows, or None when unfiltered."""
+    if isinstance(store, MetadataStore):
+        mask, selector = _store_filter(store, filters, exclude_toc)
+    else:
+        mask = allowed_rows(store, filters, exclude_toc)
+        selector = _allowed_selector(mask) if mask is not None else None
+    if mask is None:
+        return None
+    return search_params_with_selector(index, selector)
+
+
+def _dense_search(index, query_embeddings: np.ndarray, k: int, metadata=None,
+                  filters: dict = None, exclude_toc: bool = False):
+    """index.search restricted to rows passing the filters (ID selector inside FAISS)."""
+    if isinstance(index, faiss.Index):
+        params = filtered_search_params(index, metadata, filters, exclude_toc)
+        if params is None:
+            return index.search(query_embeddings, k)
+        return index.search(query_embeddings, k, params=params)
+    if filters or exclude_toc:
+        return index.search(query_embeddings, k, filters=filters, exclude_toc=exclude_toc)  # ShardedIndex
+    return index.search(query_embeddings, k)
+
+
+def _search(query_embeddings: np.ndarray, queries: List[str], index, k: int, sparse_index=None,
+            fusion: str = 'rrf', candidates: int = 50, rrf_k: int = 60, dense_weight: float = 0.5,
+            metadata=None, filters: dict = None, exclude_toc: bool = False):
+    """Dense search, or dense + BM25 candidates fused into top-k when a sparse index is given."""
+    if sparse_index is None:
+        return _dense_search(index, query_embeddings, k, metadata, filters, exclude_toc)
+    n_candidates = max(k, candidates)
+    dense_scores, dense_ids = _dense_search(index, query_embeddings, n_candidates, metadata, filters, exclude_toc)
+    sparse_hits = sparse_index.search_batch(queries, n_candidates)
+    mask = allowed_rows(metadata, filters, exclude_toc)
+    if mask is not None:
+        sparse_hits = [(scores[mask[ids]], ids[mask[ids]]) for scores, ids in sparse_hits]
+    return fuse_rankings(dense_scores, dense_ids, sparse_hits, k, fusion=fusion,
+                         rrf_k=rrf_k, dense_weight=dense_weight)
+
+
+def _retrieve_embedded(query_embeddings: np.ndarray, queries: List[str], index, metadata_df,
+                       chunks_lookup: dict, k: int, filters: dict = None, exclude_toc: bool = False,
+                       predicate: Callable = None, max_candidates: int = 1024, **search_options) -> List[List[Dict]]:
+    """
+    Search, hydrate and filter; guarantees k survivors whenever the index holds them.
+
+    Filters (and exclude_toc) are evaluated on the metadata columns and become
+    a FAISS ID selector, so one search returns k matching rows. A custom
+    `predicate` is applied to hydrated hits
+    with adaptive oversampling: queries short of k survivors are searched
+    again with twice as many candidates, up to `max_candidates`.
+    """
+    if hasattr(index, 'snapshot'):
+        # ShardedIndex: search, filter masks, BM25 and hydration all use one shard set,
+        # so a shard added or removed meanwhile can't remap this query's ids
+        snapshot = index.snapshot()
+        if metadata_df is index:
+            metadata_df = snapshot
+        if search_options.get('sparse_index') is not None:
+            search_options['sparse_index'] = snapshot.sparse
+        index = snapshot
+
+    in_search = (isinstance(index, faiss.Index) and
+                 (isinstance(metadata_df, MetadataStore) or hasattr(metadata_df, 'iloc'))) or \
+        hasattr(metadata_df, 'shards')
+    checks = []
+    if filters and not in_search:
+        checks.append(lambda hit: hit_matches(hit, filters))
+    if predicate is not None:
+        checks.append(predicate)
+
+    def search(rows: List[int], n: int) -> List[List[Dict]]:
+        scores, indices = _search(query_embeddings[rows], [queries[r] for r in rows], index, n,
+                                  metadata=metadata_df, filters=filters if in_search else None,
+                                  exclude_toc=exclude_toc, **search_options)
+        return _hydrate_results(scores, indices, metadata_df, chunks_lookup)
+
+    if not checks:
+        return search(list(range(len(queries))), k)
+
+    results: List[List[Dict]] = [[] for _ in queries]
+    pending = list(range(len(queries)))
+    n = min(2 * k, max_candidates)
+    while pending:
+        hits_per_query = search(pending, n)
+        still_short = []
+        for row, hits in zip(pending, hits_per_query):
+            results[row] = [hit for hit in hits if all(check(hit) for check in checks)][:k]
+            # A short candidate list means the index has no more rows to offer
+            if len(results[row]) < k and len(hits) == n and n < max_candidates:
+                still_short.append(row)
+        pending = still_short
+        n = min(2 * n, max_candidates)
+    return results
+
+
+def retrieve(query: str, index, embed_fn: Callable, metadata_df, chunks_lookup: dict = None, k: int = 5,
+             sparse_index=None, fusion: str = 'rrf', candidates: int = 50, rrf_k: int = 60,
+             dense_weight: float = 0.5, exclude_toc: bool = False, filters: dict = None,
+             predicate: Callable = None, max_candidates: int = 1024) -> List[Dict]:
     """
     Return top-k results with text and metadata.
 
     Args:
         query: Query string
-        index: FAISS index
+        index: FAISS index (or a ShardedIndex, passed as metadata_df too)
         embed_fn: Function that takes a string and returns a normalized embedding (numpy array)
-        metadata_df: DataFrame with metadata (chunk_id, book, para_idx_start, para_idx_end, char_count)
+        metadata_df: MetadataStore (from load_index) or DataFrame with metadata
+            (chunk_id, book, para_idx_start, para_idx_end, char_count)
         chunks_lookup: Optional dict mapping chunk_id to chunk dict with 'text' field
+            (only needed when the metadata carries no text)
         k: Number of results to return
+        sparse_index: Optional BM25Index (or ShardedIndex.sparse) for hybrid retrieval;
+            the top `candidates` of each leg are fused and 'score' is the fused score
+            (not a cosine similarity; RRF scores are sums of 1 / (rrf_k + rank))
+        fusion: 'rrf' or 'weighted' (see fuse_rankings)
+        candidates: Candidates taken from each leg before fusion
+        rrf_k: RRF rank offset
+        dense_weight: Dense-leg weight for weighted fusion
+        exclude_toc: Skip chunks flagged is_toc in the metadata inside the search,
+            so k clean results come back (no effect without the flags)
+        filters: Optional structured filters, {'book': name or [names],
+            'para_range': (first, last)}; applied inside the FAISS search
+            (see allowed_rows / hit_matches)
+        predicate: Optional function hit -> bool for arbitrary conditions;
+            candidates are oversampled adaptively until k hits pass
+        max_candidates: Upper bound on candidates fetched per query when oversampling
 
     Returns:
-        List of dicts: {score, text, meta:{...}, chunk_id} length == k.
+        List of dicts: {score, text, meta:{...}, chunk_id} length == k
+        (fewer only when fewer than k chunks pass the filters).
     """
     # Embed the query using the provided function
-    query_embedding = embed_fn(query)
-    
-    # Ensure query embedding is the right shape and type
-    if len(query_embedding.shape) == 1:
-        query_embedding = query_embedding.reshape(1, -1)
-    if query_embedding.dtype != np.float32:
-        query_embedding = query_embedding.astype(np.float32)
-    
-    # Search FAISS index
-    scores, indices = index.search(query_embedding, k)
+    query_embedding = _as_query_matrix(embed_fn(query))
     
-    # Map indices to metadata and return results
-    results = []
-    for score, idx in zip(scores[0], indices[0]):
-        if idx < 0 or idx >= len(metadata_df):
-            continue  # Skip invalid indices
-        
-        row = metadata_df.iloc[idx]
-        chunk_id = row['chunk_id']
-        
-        # Get text from chunks_lookup if available, otherwise use placeholder
-        text = ""
-        if chunks_lookup and chunk_id in chunks_lookup:
-            text = chunks_lookup[chunk_id].get('text', '')
-        elif 'text' in row:
-            text = row['text']
-        else:
-            text = f"[Chunk {chunk_id} - text not available]"
-        
-        results.append({
-            'score': float(score),
-            'text': text,
-            'chunk_id': chunk_id,
-            'meta': {
-                'book': row['book'],
-                'para_idx_start': int(row['para_idx_start']),
-                'para_idx_end': int(row['para_idx_end']),
-                'char_count': int(row['char_count'])
-            }
-        })
-    
-    return results
+    # Search FAISS index (fused with BM25 when a sparse index is given), then map to metadata
+    return _retrieve_embedded(query_embedding, [query], index, metadata_df, chunks_lookup, k,
+                              filters=filters, exclude_toc=exclude_toc, predicate=predicate,
+                              max_candidates=max_candidates, sparse_index=sparse_index, fusion=fusion,
+                              candidates=candidates, rrf_k=rrf_k, dense_weight=dense_weight)[0]
+
+
+def retrieve_batch(queries: List[str], index, embed_fn: Callable, metadata_df, chunks_lookup: dict = None, k: int = 5,
+                   sparse_index=None, fusion: str = 'rrf', candidates: int = 50, rrf_k: int = 60,
+                   dense_weight: float = 0.5, exclude_toc: bool = False, filters: dict = None,
+                   predicate: Callable = None, max_candidates: int = 1024) -> List[List[Dict]]:
+    """
+    Return top-k results for many queries at once.
+
+    The whole batch is embedded with one call to `embed_fn` and searched with
+    one matrix `index.search`, so per-query overhead is amortized across the batch.
+
+    Args:
+        queries: List of query strings
+        index: FAISS index (or a ShardedIndex, passed as metadata_df too)
+        embed_fn: Function that takes a list of strings and returns an (n, d) matrix of normalized embeddings
+        metadata_df: MetadataStore (from load_index) or DataFrame with metadata
+            (chunk_id, book, para_idx_start, para_idx_end, char_count)
+        chunks_lookup: Optional dict mapping chunk_id to chunk dict with 'text' field
+            (only needed when the metadata carries no text)
+        k: Number of results per query
+        sparse_index / fusion / candidates / rrf_k / dense_weight: Hybrid retrieval options (see retrieve)
+        exclude_toc / filters / predicate / max_candidates: Filtering options (see retrieve)
+
+    Returns:
+        List (one entry per query, in input order) of result lists shaped like `retrieve()` output.
+    """
+    queries = list(queries)
+    if not queries:
+        return []
+
+    query_embeddings = _as_query_matrix(embed_fn(queries))
+    if query_embeddings.shape[0] != len(queries):
+        raise ValueError(
+            f"embed_fn returned {query_embeddings.shape[0]} embeddings for {len(queries)} queries"
+        )
 
+    return _retrieve_embedded(query_embeddings, queries, index, metadata_df, chunks_lookup, k,
+                              filters=filters, exclude_toc=exclude_toc, predicate=predicate,
+                              max_candidates=max_candidates, sparse_index=sparse_index, fusion=fusion,
+                              candidates=candidates, rrf_k=rrf_k, dense_weight=dense_weight)
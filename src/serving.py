@@ -0,0 +1,160 @@
+"""
+Async request micro-batching for the serving path.
+
+Concurrent callers `await batcher.submit(query)`; queries arriving within a
+few milliseconds of each other are handed to one `batch_fn(queries)` call
+(one `model.encode` + one `index.search` via `predict_batch`), and each
+caller gets its own result back.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+import asyncio
+import time
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent async calls into batched calls of `batch_fn`.
+
+    The first queued item opens a batch; the batcher then waits up to
+    `max_wait_ms` for more (or until `max_batch_size` items are queued) and
+    runs `batch_fn` on a worker thread so the event loop keeps accepting
+    requests. Items arriving while a batch runs form the next batch, so batch
+    size grows with load while a lone request only pays `max_wait_ms`.
+
+    Args:
+        batch_fn: Function list of items -> list of results (same length and order)
+        max_batch_size: Upper bound on items per batch_fn call
+        max_wait_ms: How long an open batch waits for more items
+        executor: Executor for batch_fn (default: one dedicated thread)
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, executor=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='micro-batch')
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result (exceptions from batch_fn are re-raised)."""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            if self.max_wait > 0 and queue.qsize() < self.max_batch_size - 1:
+                await asyncio.sleep(self.max_wait)
+            while len(batch) < self.max_batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            # Callers that gave up (cancelled) are dropped before doing any work
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = await self._loop.run_in_executor(self._executor, self.batch_fn, items)
+                if len(results) != len(items):
+                    raise ValueError(f"batch_fn returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+        }
+
+
+async def _load_test(call: Callable, queries: List[str], concurrency: int) -> Dict[str, float]:
+    """Fire `queries` at an async `call` with `concurrency` in flight; latency percentiles in ms."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(query):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(q) for q in queries))
+    elapsed = time.perf_counter() - start
+    ms = np.asarray(latencies) * 1000.0
+    return {
+        'qps': round(len(queries) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(ms, 95)), 2),
+        'p99_ms': round(float(np.percentile(ms, 99)), 2),
+    }
+
+
+def benchmark_batching(batch_fn: Callable[[List[str]], List[Any]], queries: List[str],
+                       concurrency: int = 32, max_batch_size: int = 32, max_wait_ms: float = 5.0) -> Dict:
+    """
+    Compare one-at-a-time serving with micro-batched serving under concurrent load.
+
+    The unbatched mode calls `batch_fn([query])` per request on a single
+    worker thread (one forward pass at a time, like a synchronous handler);
+    the batched mode goes through a MicroBatcher.
+
+    Args:
+        batch_fn: e.g. functools.partial(predict_batch, index=..., metadata_df=..., model=..., config=...)
+        queries: Requests to replay
+        concurrency: Requests in flight at once
+        max_batch_size / max_wait_ms: MicroBatcher settings
+
+    Returns:
+        {'unbatched': {...}, 'batched': {...}, 'mean_batch_size': float}, rows with qps / p50 / p95 / p99
+    """
+    async def run():
+        executor = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+
+        async def unbatched(query):
+            return (await loop.run_in_executor(executor, batch_fn, [query]))[0]
+
+        batcher = MicroBatcher(batch_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        report = {
+            'unbatched': await _load_test(unbatched, queries, concurrency),
+            'batched': await _load_test(batcher.submit, queries, concurrency),
+        }
+        report['mean_batch_size'] = round(batcher.stats()['mean_batch_size'], 1)
+        return report
+
+    report = asyncio.run(run())
+    print(f"{'mode':<10} {'QPS':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for mode in ('unbatched', 'batched'):
+        row = report[mode]
+        print(f"{mode:<10} {row['qps']:>8.1f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+    print(f"📊 Mean batch size: {report['mean_batch_size']} (concurrency {concurrency})")
+    return report
@@ -0,0 +1,433 @@
+"""
+Multi-book sharded index: one FAISS index + metadata store per shard, searched in parallel.
+
+Layout (each shard directory is a regular save_index / build_index_streaming output):
+
+    data/index/
+        shards.json              # {"shards": {name: {"path": ..., "books": [...]}}}
+        shards/dorian/index.faiss, metadata.parquet, chunk_text.bin, ...
+        shards/iliad-20260101120000/...
+
+A rebuilt shard goes into a fresh versioned directory (new_shard_dir) and is
+then registered, which swaps shards.json atomically; serving processes keep
+the old directory's files until they switch (ShardedIndex.refresh), and the
+old directory is deleted afterwards (prune_shard_dirs).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+import heapq
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from src.embed_index import load_index
+from src.retrieve import filtered_search_params
+from src.sparse import tokenize, bm25_idf, bm25_doc_norm
+
+MANIFEST_FILE = 'shards.json'
+
+
+def read_manifest(root_dir: str) -> Dict:
+    """Return the shard manifest of `root_dir` ({'shards': {}} when there is none)."""
+    manifest_path = Path(root_dir) / MANIFEST_FILE
+    if not manifest_path.exists():
+        return {'shards': {}}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(root_dir: str, manifest: Dict):
+    """Atomically replace the shard manifest of `root_dir`."""
+    root_path = Path(root_dir)
+    root_path.mkdir(parents=True, exist_ok=True)
+    tmp_path = root_path / (MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    tmp_path.replace(root_path / MANIFEST_FILE)
+
+
+def shard_dir(root_dir: str, name: str) -> Path:
+    """Default directory for a shard's index files."""
+    return Path(root_dir) / 'shards' / name
+
+
+def new_shard_dir(root_dir: str, name: str) -> Path:
+    """
+    Fresh versioned directory for a (re)build of shard `name`: <root>/shards/<name>-<timestamp>.
+
+    Building into a new directory never overwrites files that serving
+    processes have memory-mapped, and the half-built shard stays invisible
+    until register_shard points the manifest at it.
+    """
+    stamp = time.strftime('%Y%m%d%H%M%S')
+    path = shard_dir(root_dir, f"{name}-{stamp}")
+    n = 1
+    while path.exists():
+        n += 1
+        path = shard_dir(root_dir, f"{name}-{stamp}-{n}")
+    return path
+
+
+def register_shard(root_dir: str, name: str, path: str = None, books: List[str] = None) -> Path:
+    """
+    Add (or replace) a shard entry in the manifest without touching other shards.
+
+    Args:
+        root_dir: Sharded index root
+        name: Shard name
+        path: Shard index directory (default: <root>/shards/<name>)
+        books: Books contained in the shard (default: [name])
+
+    Returns:
+        The directory the entry pointed to before, if it was a different one
+        (delete it once no process serves it any more), else None.
+    """
+    path = Path(path) if path else shard_dir(root_dir, name)
+    if not (path / 'index.faiss').exists():
+        raise FileNotFoundError(f"Shard index not found: {path / 'index.faiss'}")
+    manifest = read_manifest(root_dir)
+    try:
+        stored_path = os.path.relpath(path, root_dir)
+    except ValueError:  # different drive on Windows
+        stored_path = str(path)
+    previous = manifest['shards'].get(name)
+    manifest['shards'][name] = {'path': stored_path, 'books': books or [name]}
+    write_manifest(root_dir, manifest)
+    if previous is None or previous['path'] == stored_path:
+        return None
+    return Path(root_dir) / previous['path']
+
+
+def unregister_shard(root_dir: str, name: str, delete_files: bool = False):
+    """Remove a shard from the manifest (and optionally delete its files)."""
+    manifest = read_manifest(root_dir)
+    entry = manifest['shards'].pop(name, None)
+    if entry is None:
+        raise KeyError(f"Unknown shard: {name}")
+    write_manifest(root_dir, manifest)
+    if delete_files:
+        shutil.rmtree(Path(root_dir) / entry['path'], ignore_errors=True)
+
+
+def prune_shard_dirs(root_dir: str) -> List[Path]:
+    """
+    Delete shard directories under <root>/shards that the manifest no longer references.
+
+    Run it after every serving process has switched to the current manifest
+    (ShardedIndex.refresh or a restart): until then they may still read the
+    files of a replaced shard. Staging directories of builds in progress
+    (hidden, see embed_index.staging_dir) are left alone.
+
+    Returns:
+        The deleted directories.
+    """
+    root_path = Path(root_dir)
+    shards_path = root_path / 'shards'
+    if not shards_path.is_dir():
+        return []
+    live = {(root_path / entry['path']).resolve() for entry in read_manifest(root_dir)['shards'].values()}
+    removed = []
+    for path in sorted(shards_path.iterdir()):
+        if path.is_dir() and not path.name.startswith('.') and path.resolve() not in live:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+    return removed
+
+
+class Shard:
+    """One loaded shard: its FAISS index and MetadataStore."""
+
+    def __init__(self, name: str, path: Path, index, store, books: List[str]):
+        self.name = name
+        self.path = path
+        self.index = index
+        self.store = store
+        self.books = books
+
+
+class ShardSnapshot:
+    """
+    Immutable view of the served shard set: shards, global id offsets and TOC flags.
+
+    ShardedIndex swaps in a new snapshot on every add/remove instead of
+    mutating the current one, so a query that searches and hydrates against
+    one snapshot never maps its ids onto a different set of shards.
+    """
+
+    def __init__(self, shards: List[Shard], pool: ThreadPoolExecutor):
+        self.shards = tuple(shards)
+        self._pool = pool
+        sizes = [shard.index.ntotal for shard in self.shards]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]).astype(np.int64)
+        flags = [getattr(shard.store, 'is_toc', None) for shard in self.shards]
+        self.is_toc = np.concatenate(flags) if flags and all(f is not None for f in flags) else None
+        self._sparse = None
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.offsets[-1])
+
+    @property
+    def d(self) -> int:
+        return self.shards[0].index.d if self.shards else 0
+
+    @property
+    def text(self):
+        """Non-None when every shard carries chunk text (mirrors MetadataStore.text)."""
+        if self.shards and all(shard.store.text is not None for shard in self.shards):
+            return True
+        return None
+
+    @property
+    def sparse(self):
+        """BM25 search across shards (ids global), or None unless every shard has a BM25 index."""
+        if not self.shards or any(getattr(shard.store, 'sparse', None) is None for shard in self.shards):
+            return None
+        if self._sparse is None:  # global statistics are computed once per snapshot
+            self._sparse = ShardedBM25([shard.store.sparse for shard in self.shards], self.offsets)
+        return self._sparse
+
+    def __len__(self) -> int:
+        return self.ntotal
+
+    def search(self, queries: np.ndarray, k: int, filters: Dict = None, exclude_toc: bool = False):
+        """
+        Search every shard in parallel and merge into one ranked top-k per query.
+
+        With filters / exclude_toc (see retrieve.allowed_rows), each shard skips
+        non-matching vectors inside the search.
+
+        Returns:
+            (scores, ids) arrays of shape (n_queries, k); ids are global, -1 pads missing hits.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        n_queries = queries.shape[0]
+        scores_out = np.full((n_queries, k), -np.inf, dtype=np.float32)
+        ids_out = np.full((n_queries, k), -1, dtype=np.int64)
+        if not self.shards:
+            return scores_out, ids_out
+
+        futures = [self._pool.submit(self._search_shard, shard, queries, min(k, max(1, shard.index.ntotal)),
+                                     filters, exclude_toc)
+                   for shard in self.shards]
+        per_shard = [future.result() for future in futures]
+
+        for q in range(n_queries):
+            # Each shard's list is already sorted by descending score: k-way heap merge
+            runs = []
+            for s, (scores, ids) in enumerate(per_shard):
+                valid = ids[q] >= 0
+                runs.append(zip(scores[q][valid].tolist(), (ids[q][valid] + self.offsets[s]).tolist()))
+            for rank, (score, global_id) in enumerate(
+                    heapq.merge(*runs, key=lambda hit: hit[0], reverse=True)):
+                if rank >= k:
+                    break
+                scores_out[q, rank] = score
+                ids_out[q, rank] = global_id
+        return scores_out, ids_out
+
+    @staticmethod
+    def _search_shard(shard: Shard, queries: np.ndarray, k: int, filters: Dict, exclude_toc: bool):
+        params = filtered_search_params(shard.index, shard.store, filters, exclude_toc)
+        if params is None:
+            return shard.index.search(queries, k)
+        return shard.index.search(queries, k, params=params)
+
+    def gather(self, ids: np.ndarray) -> List[Dict]:
+        """Hydrate global ids into hit dicts (same shape as MetadataStore.gather), in order."""
+        ids = np.asarray(ids, dtype=np.int64)
+        shard_of = np.searchsorted(self.offsets, ids, side='right') - 1
+        hits = [None] * len(ids)
+        for s in np.unique(shard_of).tolist():
+            positions = np.flatnonzero(shard_of == s)
+            for pos, hit in zip(positions.tolist(),
+                                self.shards[s].store.gather(ids[positions] - self.offsets[s])):
+                hits[pos] = hit
+        return hits
+
+
+class ShardedIndex:
+    """
+    Query coordinator over many shards.
+
+    Exposes the same `search(queries, k)` -> (scores, ids) interface as a FAISS
+    index and the same `gather(ids)` interface as a MetadataStore, with ids
+    global across shards, so it can be passed to `retrieve()` / `retrieve_batch()`
+    as both `index` and `metadata_df`. Shards are searched in parallel on a
+    thread pool (FAISS releases the GIL during search) and the per-shard top-k
+    lists are merged with a heap.
+
+    Shards can be added and removed while queries run: each change publishes a
+    new ShardSnapshot, and retrieve() searches and hydrates a query against the
+    single snapshot it took (see snapshot()). The search pool lives as long as
+    the index and is shared by all snapshots, so a change never shuts down a
+    pool an in-flight search is using.
+
+    Args:
+        root_dir: Sharded index root containing shards.json
+        max_workers: Search threads (default 32; threads are started on demand)
+        nprobe / ef_search: Optional query-time overrides applied to every shard
+        mmap: Memory-map shard index files (see load_index)
+    """
+
+    def __init__(self, root_dir: str, max_workers: int = None, nprobe: int = None, ef_search: int = None,
+                 mmap: bool = False):
+        self.root_dir = Path(root_dir)
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.mmap = mmap
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or 32, thread_name_prefix='shard-search')
+
+        shards = [self._load_shard(name, self.root_dir / entry['path'], entry.get('books'))
+                  for name, entry in read_manifest(root_dir)['shards'].items()]
+        self._snapshot = ShardSnapshot(shards, self._pool)
+        print(f"✅ Loaded {len(shards)} shards, {self.ntotal} vectors total")
+
+    def _load_shard(self, name: str, path: Path, books: List[str] = None) -> Shard:
+        index, store = load_index(str(path), nprobe=self.nprobe, ef_search=self.ef_search, mmap=self.mmap)
+        return Shard(name, path, index, store, books or [name])
+
+    def snapshot(self) -> ShardSnapshot:
+        """The current shard set; use one snapshot for both search and gather of a query."""
+        with self._lock:
+            return self._snapshot
+
+    def add_shard(self, name: str, path: str = None, books: List[str] = None, delete_replaced: bool = False):
+        """
+        Register a built shard directory and start serving it; other shards are untouched.
+
+        When `name` replaces a shard served from another directory, that
+        directory is deleted with `delete_replaced` once the new shard is
+        being served (searches still running on the old snapshot keep their
+        open files). Leave it False if other processes serve the same root.
+        """
+        replaced = register_shard(self.root_dir, name, path=path, books=books)
+        entry = read_manifest(self.root_dir)['shards'][name]
+        shard = self._load_shard(name, self.root_dir / entry['path'], entry['books'])
+        with self._lock:
+            shards = [s for s in self._snapshot.shards if s.name != name] + [shard]
+            self._snapshot = ShardSnapshot(shards, self._pool)
+        if delete_replaced and replaced is not None:
+            shutil.rmtree(replaced, ignore_errors=True)
+
+    def refresh(self) -> bool:
+        """
+        Re-read shards.json and serve the shard set it lists now.
+
+        Picks up shards added, replaced or removed by another process (e.g.
+        `python -m src.pipeline --shard-root`). Shards whose entry is unchanged
+        keep their loaded index; new or moved ones are loaded before the
+        snapshot is swapped.
+
+        Returns:
+            True if the served shard set changed.
+        """
+        entries = read_manifest(self.root_dir)['shards']
+        current = {shard.name: shard for shard in self.snapshot().shards}
+        shards, changed = [], set(current) != set(entries)
+        for name, entry in entries.items():
+            path = self.root_dir / entry['path']
+            shard = current.get(name)
+            if shard is None or shard.path != path:
+                shard = self._load_shard(name, path, entry.get('books'))
+                changed = True
+            shards.append(shard)
+        if changed:
+            with self._lock:
+                self._snapshot = ShardSnapshot(shards, self._pool)
+            print(f"🔄 Reloaded shard manifest: {len(shards)} shards, {self.ntotal} vectors total")
+        return changed
+
+    def remove_shard(self, name: str, delete_files: bool = False):
+        """Stop serving a shard and remove it from the manifest."""
+        unregister_shard(self.root_dir, name, delete_files=delete_files)
+        with self._lock:
+            shards = [s for s in self._snapshot.shards if s.name != name]
+            self._snapshot = ShardSnapshot(shards, self._pool)
+
+    def close(self):
+        """Shut down the search pool (after the last query)."""
+        self._pool.shutdown()
+
+    @property
+    def shards(self):
+        return self.snapshot().shards
+
+    @property
+    def ntotal(self) -> int:
+        return self.snapshot().ntotal
+
+    @property
+    def d(self) -> int:
+        return self.snapshot().d
+
+    @property
+    def text(self):
+        """Non-None when every shard carries chunk text (mirrors MetadataStore.text)."""
+        return self.snapshot().text
+
+    @property
+    def is_toc(self):
+        """Global TOC/header flags (mirrors MetadataStore.is_toc), or None if any shard lacks them."""
+        return self.snapshot().is_toc
+
+    @property
+    def sparse(self):
+        """BM25 search across shards (ids global), or None unless every shard has a BM25 index."""
+        return self.snapshot().sparse
+
+    def __len__(self) -> int:
+        return self.ntotal
+
+    def search(self, queries: np.ndarray, k: int, filters: Dict = None, exclude_toc: bool = False):
+        """ShardSnapshot.search on the current shard set (ids are only valid for that snapshot)."""
+        return self.snapshot().search(queries, k, filters=filters, exclude_toc=exclude_toc)
+
+    def gather(self, ids: np.ndarray) -> List[Dict]:
+        """ShardSnapshot.gather on the current shard set."""
+        return self.snapshot().gather(ids)
+
+
+class ShardedBM25:
+    """
+    BM25 over many shards with global ids, scored as if the shards were one index.
+
+    Each shard's own idf and avgdl come from its book alone, so raw per-shard
+    scores aren't comparable. Here every shard is scored with corpus-wide
+    statistics instead: document frequencies summed over shards, the total
+    chunk count and the pooled average chunk length. The per-shard top-k
+    lists are then merged by score.
+    """
+
+    def __init__(self, indexes: List, offsets: np.ndarray):
+        self.indexes = indexes
+        self.offsets = offsets
+        self.n_docs = sum(index.n_docs for index in indexes)
+        total_len = sum(float(np.sum(index.doc_len)) for index in indexes)
+        avgdl = total_len / max(self.n_docs, 1)
+        self.doc_norms = [bm25_doc_norm(index.doc_len, avgdl, index.k1, index.b) for index in indexes]
+
+    def search(self, query: str, k: int):
+        terms = sorted(set(tokenize(query)))
+        shard_terms = [[(term, index.term_ids[term]) for term in terms if term in index.term_ids]
+                       for index in self.indexes]
+        df = {}
+        for index, pairs in zip(self.indexes, shard_terms):
+            for term, term_id in pairs:
+                df[term] = df.get(term, 0) + index.df(term_id)
+
+        per_shard = []
+        for index, pairs, doc_norm in zip(self.indexes, shard_terms, self.doc_norms):
+            idf = bm25_idf(self.n_docs, [df[term] for term, _ in pairs])
+            per_shard.append(index.top_k([term_id for _, term_id in pairs], idf, doc_norm, k))
+        scores = np.concatenate([scores for scores, _ in per_shard])
+        ids = np.concatenate([ids + self.offsets[s] for s, (_, ids) in enumerate(per_shard)])
+        top = np.lexsort((ids, -scores))[:k]
+        return scores[top], ids[top]
+
+    def search_batch(self, queries: List[str], k: int):
+        return [self.search(query, k) for query in queries]
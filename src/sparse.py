@@ -0,0 +1,282 @@
+"""
+BM25 inverted index over chunk text (the sparse leg of hybrid retrieval).
+
+Postings are stored in CSR form, one row per vocabulary term, as plain NumPy
+arrays written next to index.faiss and memory-mapped at load time:
+
+    bm25_vocab.txt        one term per line, sorted (term id = line number)
+    bm25_indptr.npy       int64 (n_terms + 1): postings of term t are [indptr[t], indptr[t + 1])
+    bm25_doc_ids.npy      int32 row ids (aligned with the FAISS index)
+    bm25_tfs.npy          uint16 term frequencies
+    bm25_doc_len.npy      int32 tokens per chunk
+    bm25.json             {n_docs, avgdl, k1, b}
+"""
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+import json
+import re
+import shutil
+import tempfile
+import numpy as np
+
+VOCAB_FILE = 'bm25_vocab.txt'
+INDPTR_FILE = 'bm25_indptr.npy'
+DOC_IDS_FILE = 'bm25_doc_ids.npy'
+TFS_FILE = 'bm25_tfs.npy'
+DOC_LEN_FILE = 'bm25_doc_len.npy'
+META_FILE = 'bm25.json'
+
+_TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens (same tokenization as compose's lexical scoring)."""
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Builder:
+    """
+    Accumulate postings chunk by chunk, then write the CSR arrays.
+
+    Only (term id, doc id, tf) triples are kept in memory, never the text,
+    so it can run inside a streaming index build. Once `run_postings`
+    postings (10 bytes each) have accumulated they are spilled to a run file
+    under `spill_dir`, and save() merges the runs straight into the output
+    arrays. Memory then stays bounded by the run size plus the vocabulary
+    and 4 bytes per chunk (document lengths), whatever the corpus size.
+    """
+
+    def __init__(self, spill_dir: str = None, run_postings: int = 2_000_000):
+        self.spill_dir = spill_dir
+        self.run_postings = run_postings
+        self._term_ids: Dict[str, int] = {}
+        self._df = array('q')  # chunks per builder term id, for the CSR row pointers
+        self._post_terms = array('i')
+        self._post_docs = array('i')
+        self._post_tfs = array('H')
+        self._doc_len = array('i')
+        self._runs: List[Path] = []
+        self._runs_dir = None
+
+    def add(self, texts: Iterable[str]):
+        for text in texts:
+            doc_id = len(self._doc_len)
+            tokens = tokenize(text)
+            self._doc_len.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_id = self._term_ids.setdefault(term, len(self._term_ids))
+                if term_id == len(self._df):
+                    self._df.append(0)
+                self._df[term_id] += 1
+                self._post_terms.append(term_id)
+                self._post_docs.append(doc_id)
+                self._post_tfs.append(min(tf, 65535))
+            if len(self._post_terms) >= self.run_postings:
+                self._spill()
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def _buffered_run(self):
+        return (np.frombuffer(self._post_terms, dtype=np.int32).copy(),
+                np.frombuffer(self._post_docs, dtype=np.int32).copy(),
+                np.frombuffer(self._post_tfs, dtype=np.uint16).copy())
+
+    def _spill(self):
+        """Write the buffered postings to a run file and clear the buffers."""
+        if self._runs_dir is None:
+            self._runs_dir = Path(tempfile.mkdtemp(prefix='bm25-runs-', dir=self.spill_dir))
+        terms, docs, tfs = self._buffered_run()
+        path = self._runs_dir / f"run_{len(self._runs):05d}.npz"
+        np.savez(path, terms=terms, docs=docs, tfs=tfs)
+        self._runs.append(path)
+        self._post_terms = array('i')
+        self._post_docs = array('i')
+        self._post_tfs = array('H')
+
+    def _iter_runs(self):
+        """Postings runs in document order: the spilled ones, then the buffer."""
+        for path in self._runs:
+            with np.load(path) as run:
+                yield run['terms'], run['docs'], run['tfs']
+        yield self._buffered_run()
+
+    def save(self, out_dir: str, k1: float = 1.5, b: float = 0.75):
+        """Sort postings by (term, doc) and write the index files to `out_dir`."""
+        out_path = Path(out_dir)
+        out_path.mkdir(parents=True, exist_ok=True)
+
+        vocab = sorted(self._term_ids)
+        # Builder term ids -> sorted vocabulary ids
+        remap = np.empty(len(vocab), dtype=np.int32)
+        for new_id, term in enumerate(vocab):
+            remap[self._term_ids[term]] = new_id
+
+        counts = np.zeros(len(vocab), dtype=np.int64)
+        counts[remap] = np.frombuffer(self._df, dtype=np.int64)
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        n_postings = int(indptr[-1])
+        doc_len = np.frombuffer(self._doc_len, dtype=np.int32)
+
+        if n_postings:
+            doc_ids = np.lib.format.open_memmap(out_path / DOC_IDS_FILE, mode='w+', dtype=np.int32,
+                                                shape=(n_postings,))
+            tfs = np.lib.format.open_memmap(out_path / TFS_FILE, mode='w+', dtype=np.uint16,
+                                            shape=(n_postings,))
+            # Runs cover consecutive documents, so appending each run's postings to
+            # their term's CSR row keeps every row sorted by doc id
+            filled = indptr[:-1].copy()
+            for terms, docs, run_tfs in self._iter_runs():
+                terms = remap[terms]
+                order = np.argsort(terms, kind='stable')  # docs already ascending within a run
+                terms = terms[order]
+                run_counts = np.bincount(terms, minlength=len(vocab))
+                run_starts = np.concatenate([[0], np.cumsum(run_counts)[:-1]])
+                positions = filled[terms] + np.arange(len(terms)) - run_starts[terms]
+                doc_ids[positions] = docs[order]
+                tfs[positions] = run_tfs[order]
+                filled += run_counts
+            doc_ids.flush()
+            tfs.flush()
+            del doc_ids, tfs
+        else:
+            np.save(out_path / DOC_IDS_FILE, np.zeros(0, dtype=np.int32))
+            np.save(out_path / TFS_FILE, np.zeros(0, dtype=np.uint16))
+        if self._runs_dir is not None:
+            shutil.rmtree(self._runs_dir, ignore_errors=True)
+            self._runs, self._runs_dir = [], None
+
+        with open(out_path / VOCAB_FILE, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(vocab))
+        np.save(out_path / INDPTR_FILE, indptr)
+        np.save(out_path / DOC_LEN_FILE, doc_len)
+        with open(out_path / META_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'n_docs': len(doc_len), 'avgdl': float(doc_len.mean()) if len(doc_len) else 0.0,
+                       'k1': k1, 'b': b}, f)
+        print(f"✅ Saved BM25 index: {len(vocab)} terms, {n_postings} postings")
+
+
+def build_bm25(texts: Iterable[str], out_dir: str, k1: float = 1.5, b: float = 0.75):
+    """Build and save a BM25 index for row-aligned chunk texts."""
+    builder = BM25Builder()
+    builder.add(texts)
+    builder.save(out_dir, k1=k1, b=b)
+
+
+def bm25_idf(n_docs: int, df) -> np.ndarray:
+    """BM25 (Lucene-style, always positive) idf of terms with document frequency `df`."""
+    df = np.asarray(df, dtype=np.float64)
+    return np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+
+def bm25_doc_norm(doc_len: np.ndarray, avgdl: float, k1: float, b: float) -> np.ndarray:
+    """Per-document part of the BM25 denominator: k1 * (1 - b + b * len / avgdl)."""
+    return (k1 * (1.0 - b + b * np.asarray(doc_len, dtype=np.float32) / max(avgdl, 1e-9))).astype(np.float32)
+
+
+class BM25Index:
+    """
+    Memory-mapped BM25 index.
+
+    A query touches only the postings of its own terms: their contributions
+    are concatenated and summed per document with one bincount, so cost grows
+    with the postings length of the query terms (queries made of very common
+    terms use a dense per-row accumulator instead of sorting their hits).
+    """
+
+    def __init__(self, vocab: List[str], indptr: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_len: np.ndarray, avgdl: float, k1: float = 1.5, b: float = 0.75):
+        self.term_ids = {term: i for i, term in enumerate(vocab)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.k1 = k1
+        self.b = b
+        self.doc_len = doc_len
+        self.n_docs = len(doc_len)
+        self.idf = bm25_idf(self.n_docs, np.diff(indptr))
+        # Per-document part of the BM25 denominator, precomputed once
+        self.doc_norm = bm25_doc_norm(doc_len, avgdl, k1, b)
+
+    @classmethod
+    def exists(cls, in_dir: str) -> bool:
+        return (Path(in_dir) / META_FILE).exists()
+
+    @classmethod
+    def open(cls, in_dir: str) -> "BM25Index":
+        in_path = Path(in_dir)
+        with open(in_path / META_FILE, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(in_path / VOCAB_FILE, 'r', encoding='utf-8') as f:
+            contents = f.read()
+        vocab = contents.split('\n') if contents else []
+        return cls(
+            vocab,
+            np.load(in_path / INDPTR_FILE, mmap_mode='r'),
+            np.load(in_path / DOC_IDS_FILE, mmap_mode='r'),
+            np.load(in_path / TFS_FILE, mmap_mode='r'),
+            np.load(in_path / DOC_LEN_FILE),
+            meta['avgdl'], k1=meta['k1'], b=meta['b'],
+        )
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k chunks by BM25 score.
+
+        Returns:
+            (scores, ids) 1D arrays, best first; shorter than k when fewer chunks match.
+        """
+        term_ids = sorted({self.term_ids[t] for t in tokenize(query) if t in self.term_ids})
+        return self.top_k(term_ids, self.idf[term_ids], self.doc_norm, k)
+
+    def df(self, term_id: int) -> int:
+        """Number of chunks containing a term."""
+        return int(self.indptr[term_id + 1] - self.indptr[term_id])
+
+    def top_k(self, term_ids: List[int], idf: np.ndarray, doc_norm: np.ndarray,
+              k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k chunks for the given term ids, scored with the given idf (one per term) and doc_norm.
+
+        search() passes this index's own statistics; ShardedBM25 passes
+        statistics of all shards together so scores are comparable across shards.
+        """
+        if not len(term_ids) or k <= 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        docs, contributions = [], []
+        k1 = self.k1
+        for t, term_idf in zip(term_ids, idf):
+            start, end = self.indptr[t], self.indptr[t + 1]
+            term_docs = np.asarray(self.doc_ids[start:end])
+            tf = np.asarray(self.tfs[start:end], dtype=np.float32)
+            docs.append(term_docs)
+            contributions.append(term_idf * tf * (k1 + 1.0) / (tf + doc_norm[term_docs]))
+
+        docs = np.concatenate(docs)
+        contributions = np.concatenate(contributions)
+        if len(docs) * 8 >= self.n_docs:
+            # Long postings: a dense accumulator over all rows beats sorting the hits
+            dense = np.bincount(docs, weights=contributions, minlength=self.n_docs)
+            unique_docs = np.flatnonzero(dense)
+            scores = dense[unique_docs].astype(np.float32)
+        else:
+            unique_docs, inverse = np.unique(docs, return_inverse=True)
+            scores = np.bincount(inverse, weights=contributions).astype(np.float32)
+
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        # Best first; ties broken by row id for determinism
+        top = top[np.lexsort((unique_docs[top], -scores[top]))]
+        return scores[top], unique_docs[top].astype(np.int64)
+
+    def search_batch(self, queries: List[str], k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        return [self.search(query, k) for query in queries]
@@ -0,0 +1,90 @@
+"""
+Start-up profiler: wall-clock time and imported modules per start-up phase.
+
+Usage:
+    python -m src.startup --config configs/app.yaml --index-dir data/index [--no-model]
+
+Phases reported by load_resources(): imports, config, index, metadata,
+chunks, model. Only the standard library is imported here, so the profiler
+itself adds nothing to the numbers it reports.
+"""
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List
+import argparse
+import json
+import sys
+import time
+
+
+class StartupProfiler:
+    """Record how long each named start-up phase takes and how many modules it imported."""
+
+    def __init__(self):
+        self.phases: List[Dict] = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        modules_before = len(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append({
+                'phase': name,
+                'seconds': round(time.perf_counter() - start, 4),
+                'modules_imported': len(sys.modules) - modules_before,
+            })
+
+    @property
+    def total_seconds(self) -> float:
+        return round(sum(row['seconds'] for row in self.phases), 4)
+
+    def report(self) -> List[Dict]:
+        """Print the phase table and return its rows."""
+        print(f"{'phase':<12} {'seconds':>9} {'modules':>8}")
+        for row in self.phases:
+            print(f"{row['phase']:<12} {row['seconds']:>9.3f} {row['modules_imported']:>8}")
+        print(f"{'total':<12} {self.total_seconds:>9.3f}")
+        return self.phases
+
+
+def phase(profiler: StartupProfiler, name: str):
+    """profiler.phase(name), or a no-op context when profiling is off."""
+    return profiler.phase(name) if profiler is not None else nullcontext()
+
+
+def profile_startup(config_path: str = "configs/app.yaml", index_dir: str = "data/index",
+                    load_model: bool = True) -> Dict:
+    """
+    Load serving resources once with every phase timed.
+
+    Call in a fresh interpreter (or use the CLI): modules already imported
+    by the caller don't show up in the imports phase.
+
+    Returns:
+        {'phases': [...], 'total_seconds': float, 'resources': load_resources() output}
+    """
+    profiler = StartupProfiler()
+    with profiler.phase('imports'):
+        from src.app import load_resources
+    resources = load_resources(config_path, index_dir, load_model=load_model, profiler=profiler)
+    return {'phases': profiler.report(), 'total_seconds': profiler.total_seconds, 'resources': resources}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each start-up phase of the serving app.")
+    parser.add_argument("--config", default="configs/app.yaml", help="Config YAML")
+    parser.add_argument("--index-dir", default="data/index", help="Index directory or sharded index root")
+    parser.add_argument("--no-model", action="store_true", help="Skip loading the embedding model")
+    parser.add_argument("--json", default=None, help="Also write the phase table to this JSON file")
+    args = parser.parse_args()
+
+    result = profile_startup(args.config, args.index_dir, load_model=not args.no_model)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'phases': result['phases'], 'total_seconds': result['total_seconds']}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
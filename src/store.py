@@ -0,0 +1,365 @@
+"""
+Compact column store for chunk metadata and text (replaces per-hit DataFrame lookups).
+"""
+from typing import List, Dict, Iterable, Sequence
+from pathlib import Path
+from array import array
+import mmap
+import numpy as np
+from src.compose import sentence_spans
+from src.chunk import is_toc_or_header_chunk
+
+# Chunk text store written next to index.faiss at build time
+TEXT_DATA_FILE = 'chunk_text.bin'
+TEXT_OFFSETS_FILE = 'chunk_text_offsets.npy'
+# Sentence spans of each chunk's text (CSR: row pointers + (start, end) pairs)
+SENTENCE_INDPTR_FILE = 'chunk_sentence_indptr.npy'
+SENTENCE_SPANS_FILE = 'chunk_sentence_spans.npy'
+# Optional sentence embeddings, row-aligned with the sentence spans (float32, memory-mapped)
+SENTENCE_VECTORS_FILE = 'chunk_sentence_vectors.f32'
+SENTENCE_VECTORS_META_FILE = 'chunk_sentence_vectors.json'
+
+
+class StringColumn:
+    """
+    Variable-length strings packed as one UTF-8 byte buffer plus an offsets array.
+
+    String i is `data[offsets[i]:offsets[i + 1]]`, so the column costs one byte
+    per UTF-8 byte plus 8 bytes per row instead of one Python object per row.
+    """
+
+    def __init__(self, data, offsets: np.ndarray):
+        self.data = data
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_strings(cls, strings: Sequence[str]) -> "StringColumn":
+        """Pack a sequence of strings into a single buffer."""
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(b''.join(encoded), offsets)
+
+    def save(self, data_path, offsets_path):
+        """Write the byte buffer and offsets array to disk."""
+        with open(data_path, 'wb') as f:
+            f.write(self.data)
+        np.save(offsets_path, self.offsets)
+
+    @classmethod
+    def open(cls, data_path, offsets_path) -> "StringColumn":
+        """
+        Open a saved column with `mmap` instead of reading it into memory.
+
+        Processes opening the same files share one copy in the page cache, and
+        only pages holding strings that are actually accessed get read.
+        """
+        offsets = np.load(offsets_path, mmap_mode='r')
+        with open(data_path, 'rb') as f:
+            if Path(data_path).stat().st_size == 0:
+                data = b''
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def take(self, ids: np.ndarray) -> List[str]:
+        """Return the strings at `ids` (one offsets gather, then one slice per row)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = self.offsets[ids].tolist()
+        ends = self.offsets[ids + 1].tolist()
+        data = self.data
+        return [bytes(data[s:e]).decode('utf-8') for s, e in zip(starts, ends)]
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + self.offsets.nbytes
+
+
+class StringColumnWriter:
+    """
+    Append strings to an on-disk StringColumn incrementally (for streaming builds).
+
+    Only the offsets (8 bytes per row) are kept in memory until close().
+    """
+
+    def __init__(self, data_path, offsets_path):
+        self.offsets_path = offsets_path
+        self._file = open(data_path, 'wb')
+        self._offsets = array('q', [0])
+
+    def append(self, strings: Iterable[str]):
+        for s in strings:
+            encoded = s.encode('utf-8')
+            self._file.write(encoded)
+            self._offsets.append(self._offsets[-1] + len(encoded))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def close(self):
+        self._file.close()
+        np.save(self.offsets_path, np.frombuffer(self._offsets, dtype=np.int64))
+
+
+class SpanColumn:
+    """
+    Variable-length lists of (start, end) character spans per row, in CSR layout.
+
+    The spans of row i are `spans[indptr[i]:indptr[i + 1]]`; used for the
+    sentence boundaries of each chunk's text.
+    """
+
+    def __init__(self, indptr: np.ndarray, spans: np.ndarray):
+        self.indptr = indptr
+        self.spans = spans
+
+    @classmethod
+    def from_lists(cls, span_lists: Sequence[Sequence]) -> "SpanColumn":
+        indptr = np.zeros(len(span_lists) + 1, dtype=np.int64)
+        np.cumsum([len(spans) for spans in span_lists], out=indptr[1:])
+        spans = np.array([span for spans in span_lists for span in spans], dtype=np.int32).reshape(-1, 2)
+        return cls(indptr, spans)
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str]) -> "SpanColumn":
+        """Segment each text into sentences (compose.sentence_spans) and pack the spans."""
+        return cls.from_lists([sentence_spans(text) for text in texts])
+
+    def save(self, indptr_path, spans_path):
+        np.save(indptr_path, self.indptr)
+        np.save(spans_path, self.spans)
+
+    @classmethod
+    def open(cls, indptr_path, spans_path) -> "SpanColumn":
+        """Open a saved column memory-mapped."""
+        return cls(np.load(indptr_path, mmap_mode='r'), np.load(spans_path, mmap_mode='r'))
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def take(self, ids: np.ndarray) -> List[List[List[int]]]:
+        """Return the [start, end] span lists of the rows at `ids`."""
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = self.indptr[ids].tolist()
+        ends = self.indptr[ids + 1].tolist()
+        spans = self.spans
+        return [spans[s:e].tolist() for s, e in zip(starts, ends)]
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.spans.nbytes
+
+
+class SpanColumnWriter:
+    """Append span lists to an on-disk SpanColumn incrementally (for streaming builds)."""
+
+    def __init__(self, indptr_path, spans_path):
+        self.indptr_path = indptr_path
+        self.spans_path = spans_path
+        self._indptr = array('q', [0])
+        self._spans = array('i')
+
+    def append(self, span_lists: Iterable[Sequence]):
+        for spans in span_lists:
+            for start, end in spans:
+                self._spans.append(start)
+                self._spans.append(end)
+            self._indptr.append(self._indptr[-1] + len(spans))
+
+    def close(self):
+        np.save(self.indptr_path, np.frombuffer(self._indptr, dtype=np.int64))
+        np.save(self.spans_path, np.frombuffer(self._spans, dtype=np.int32).reshape(-1, 2))
+
+
+class MetadataStore:
+    """
+    Columnar view of index metadata, row-aligned with the FAISS index.
+
+    Numeric columns are NumPy arrays, `book` is dictionary-encoded, and
+    `chunk_id` / `text` are `StringColumn`s, so hydrating the hits of a query is
+    one vectorized gather per column. When chunk text is present, `sentences`
+    holds the sentence spans of each chunk and hits carry them as 'sentence_spans';
+    with `sentence_vectors` (one embedding per span) hits also carry a zero-copy
+    view of their sentence embeddings as 'sentence_vectors'. `sparse` holds the
+    BM25 index saved with the FAISS index, if any (see src/sparse.py).
+    `is_toc` flags TOC/header chunks (computed at index time) so retrieval can
+    exclude them inside the FAISS search.
+    """
+
+    # Metadata columns read by from_frame
+    FRAME_COLUMNS = ('chunk_id', 'book', 'para_idx_start', 'para_idx_end', 'char_count', 'text', 'is_toc')
+
+    def __init__(self, chunk_id: StringColumn, book_codes: np.ndarray, books: List[str],
+                 para_idx_start: np.ndarray, para_idx_end: np.ndarray, char_count: np.ndarray,
+                 text: StringColumn = None, sentences: SpanColumn = None,
+                 sentence_vectors: np.ndarray = None, is_toc: np.ndarray = None):
+        self.chunk_id = chunk_id
+        self.book_codes = book_codes
+        self.books = list(books)
+        self.para_idx_start = para_idx_start
+        self.para_idx_end = para_idx_end
+        self.char_count = char_count
+        self.text = text
+        self.sentences = sentences
+        self.sentence_vectors = sentence_vectors
+        self.is_toc = is_toc
+        self.sparse = None
+
+    @classmethod
+    def from_frame(cls, meta_df, chunks_lookup: dict = None) -> "MetadataStore":
+        """
+        Build a store from a metadata DataFrame (or a dict of column arrays).
+
+        Args:
+            meta_df: DataFrame with chunk_id, book, para_idx_start, para_idx_end, char_count
+                (and optionally text, is_toc), or a {column: array} dict with those columns
+            chunks_lookup: Optional dict mapping chunk_id to chunk dict with 'text' field
+        """
+        chunk_ids = np.asarray(meta_df['chunk_id']).astype(str).tolist()
+
+        text = None
+        if 'text' in meta_df:
+            text = StringColumn.from_strings(np.asarray(meta_df['text']).astype(str).tolist())
+
+        books, book_codes = np.unique(np.asarray(meta_df['book']).astype(str), return_inverse=True)
+
+        store = cls(
+            chunk_id=StringColumn.from_strings(chunk_ids),
+            book_codes=book_codes.astype(np.uint16 if len(books) < 2 ** 16 else np.uint32),
+            books=books.tolist(),
+            para_idx_start=np.asarray(meta_df['para_idx_start'], dtype=np.int32),
+            para_idx_end=np.asarray(meta_df['para_idx_end'], dtype=np.int32),
+            char_count=np.asarray(meta_df['char_count'], dtype=np.int32),
+            text=text,
+            is_toc=np.asarray(meta_df['is_toc'], dtype=bool) if 'is_toc' in meta_df else None,
+        )
+        if text is not None:
+            store.index_sentences()
+            if store.is_toc is None:
+                store.flag_toc_chunks()
+        if chunks_lookup:
+            store.attach_text(chunks_lookup)
+        return store
+
+    def attach_text(self, chunks_lookup: dict):
+        """Pack chunk text from a chunk_id -> chunk dict lookup into the text column."""
+        self.text = StringColumn.from_strings([
+            chunks_lookup[cid].get('text', '') if cid in chunks_lookup
+            else f"[Chunk {cid} - text not available]"
+            for cid in self.chunk_id.take(np.arange(len(self)))
+        ])
+        self.index_sentences()
+        self.flag_toc_chunks()
+
+    def index_sentences(self):
+        """Compute sentence spans for the text column (for indexes built without them)."""
+        self.sentences = SpanColumn.from_texts(self.text.take(np.arange(len(self))))
+        self.sentence_vectors = None  # embeddings belong to the previous spans
+
+    def flag_toc_chunks(self):
+        """Compute the is_toc column from the text column (for indexes built without it)."""
+        all_ids = np.arange(len(self))
+        self.is_toc = np.array([
+            is_toc_or_header_chunk({'text': text, 'chunk_id': cid, 'meta': {'para_idx_start': start}})
+            for text, cid, start in zip(self.text.take(all_ids), self.chunk_id.take(all_ids),
+                                        self.para_idx_start.tolist())
+        ], dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.chunk_id)
+
+    @property
+    def shape(self):
+        return (len(self), len(self.columns))
+
+    @property
+    def columns(self) -> List[str]:
+        cols = ['chunk_id', 'book', 'para_idx_start', 'para_idx_end', 'char_count']
+        if self.is_toc is not None:
+            cols.append('is_toc')
+        if self.text is not None:
+            cols.append('text')
+        return cols
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate resident size of all columns in bytes."""
+        total = self.chunk_id.nbytes + self.book_codes.nbytes
+        total += self.para_idx_start.nbytes + self.para_idx_end.nbytes + self.char_count.nbytes
+        if self.is_toc is not None:
+            total += self.is_toc.nbytes
+        if self.text is not None:
+            total += self.text.nbytes
+        if self.sentences is not None:
+            total += self.sentences.nbytes
+        return total
+
+    def gather(self, ids: np.ndarray) -> List[Dict]:
+        """
+        Return hit dicts ({text, chunk_id, meta:{...}}, plus sentence_spans) for row ids, in order.
+
+        Args:
+            ids: 1D array of valid row ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        chunk_ids = self.chunk_id.take(ids)
+        if self.text is not None:
+            texts = self.text.take(ids)
+        else:
+            texts = [f"[Chunk {cid} - text not available]" for cid in chunk_ids]
+        books = [self.books[c] for c in self.book_codes[ids].tolist()]
+        starts = self.para_idx_start[ids].tolist()
+        ends = self.para_idx_end[ids].tolist()
+        counts = self.char_count[ids].tolist()
+
+        hits = [
+            {
+                'text': text,
+                'chunk_id': cid,
+                'meta': {
+                    'book': book,
+                    'para_idx_start': start,
+                    'para_idx_end': end,
+                    'char_count': count
+                }
+            }
+            for text, cid, book, start, end, count in zip(texts, chunk_ids, books, starts, ends, counts)
+        ]
+        if self.sentences is not None:
+            for hit, spans in zip(hits, self.sentences.take(ids)):
+                hit['sentence_spans'] = spans
+            if self.sentence_vectors is not None:
+                indptr = self.sentences.indptr
+                for hit, start, end in zip(hits, indptr[ids].tolist(), indptr[ids + 1].tolist()):
+                    hit['sentence_vectors'] = self.sentence_vectors[start:end]
+        return hits
+
+    def to_frame(self):
+        """Materialize the store as a pandas DataFrame (for notebooks and debugging)."""
+        import pandas as pd
+        all_ids = np.arange(len(self))
+        data = {
+            'chunk_id': self.chunk_id.take(all_ids),
+            'book': [self.books[c] for c in self.book_codes.tolist()],
+            'para_idx_start': np.asarray(self.para_idx_start),
+            'para_idx_end': np.asarray(self.para_idx_end),
+            'char_count': np.asarray(self.char_count),
+        }
+        if self.is_toc is not None:
+            data['is_toc'] = np.asarray(self.is_toc)
+        if self.text is not None:
+            data['text'] = self.text.take(all_ids)
+        return pd.DataFrame(data)
+
+
+def as_store(metadata, chunks_lookup: dict = None) -> MetadataStore:
+    """Return `metadata` as a MetadataStore, converting a DataFrame if needed."""
+    if isinstance(metadata, MetadataStore):
+        return metadata
+    return MetadataStore.from_frame(metadata, chunks_lookup)
@@ -0,0 +1,55 @@
+"""
+chunk_paragraphs (offset-based windows) must produce the chunks of the original
+paragraph-accumulating implementation; iter_chunks must match chunk_paragraphs.
+
+Expected windows below were produced by the original implementation.
+
+    python -m pytest tests/test_chunk.py -q
+"""
+import pytest
+
+from src.chunk import chunk_paragraphs, iter_chunks, split_into_paragraphs
+
+PARAGRAPHS = ["CHAPTER I.", "a" * 30, "b" * 50, "c" * 10, "d" * 45, "e" * 5, "f" * 60, "g" * 20]
+
+# (size, overlap) -> [(para_idx_start, para_idx_end, char_span), ...]
+EXPECTED = {
+    (60, 20): [(0, 2, [0, 94]), (3, 5, [96, 160]), (4, 6, [108, 222]), (7, 7, [224, 244])],
+    (60, 0): [(0, 2, [0, 94]), (3, 5, [96, 160]), (6, 6, [162, 222]), (7, 7, [224, 244])],
+    (60, 200): [(0, 2, [0, 94]), (3, 5, [96, 160]), (6, 6, [162, 222]), (7, 7, [224, 244])],
+    (100, 0): [(0, 3, [0, 106]), (4, 6, [108, 222]), (7, 7, [224, 244])],
+    (40, 30): [(0, 1, [0, 42]), (2, 2, [44, 94]), (3, 4, [96, 153]), (5, 6, [155, 222]), (7, 7, [224, 244])],
+    (1000, 100): [(0, 7, [0, 244])],
+    (1, 0): [(0, 0, [0, 10]), (1, 1, [12, 42]), (2, 2, [44, 94]), (3, 3, [96, 106]),
+             (4, 4, [108, 153]), (5, 5, [155, 160]), (6, 6, [162, 222]), (7, 7, [224, 244])],
+}
+
+
+@pytest.mark.parametrize("size, overlap", sorted(EXPECTED))
+def test_chunk_windows(size, overlap):
+    chunks = chunk_paragraphs(PARAGRAPHS, size, overlap, "bk")
+    joined = "\n\n".join(PARAGRAPHS)
+
+    windows = [(c['meta']['para_idx_start'], c['meta']['para_idx_end'], c['meta']['char_span']) for c in chunks]
+    assert windows == EXPECTED[(size, overlap)]
+    for n, chunk in enumerate(chunks):
+        start, end = chunk['meta']['para_idx_start'], chunk['meta']['para_idx_end']
+        assert chunk['id'] == f"bk_chunk_{n}"
+        assert chunk['text'] == "\n\n".join(PARAGRAPHS[start:end + 1])
+        assert chunk['text'] == joined[chunk['meta']['char_span'][0]:chunk['meta']['char_span'][1]]
+        assert chunk['meta']['char_count'] == len(chunk['text'])
+        assert chunk['meta']['book'] == "bk"
+
+
+@pytest.mark.parametrize("size, overlap", sorted(EXPECTED))
+def test_iter_chunks_matches_chunk_paragraphs(size, overlap):
+    assert list(iter_chunks(iter(PARAGRAPHS), size, overlap, "bk")) == chunk_paragraphs(PARAGRAPHS, size, overlap, "bk")
+
+
+def test_empty_input():
+    assert chunk_paragraphs([], 800, 120, "bk") == []
+    assert list(iter_chunks([], 800, 120, "bk")) == []
+
+
+def test_split_into_paragraphs():
+    assert split_into_paragraphs("First.\n\n  \n\nSecond\nline.\n\n\n\nThird. ") == ["First.", "Second\nline.", "Third."]
@@ -0,0 +1,93 @@
+"""
+clean_text must return exactly what the original multi-pass cleaner returns.
+
+_clean_text_reference in src/clean.py is the original implementation; these
+samples cover the cases the single-pass rewrite handles differently inside:
+CRLF line endings, a table of contents, tabs, non-breaking spaces, and
+missing or alternative Gutenberg markers.
+
+    python -m pytest tests/test_clean.py -q
+"""
+import pytest
+
+from src.clean import clean_text, _clean_text_reference, iter_clean_paragraphs
+from src.chunk import split_into_paragraphs
+
+BODY = (
+    "Dorian Gray\n"
+    "\n"
+    "by Oscar Wilde\n"
+    "\n"
+    "Contents\n"
+    "\n"
+    "CHAPTER I.\n"
+    "CHAPTER II.\n"
+    "CHAPTER III\n"
+    "\n"
+    "THE PREFACE\n"
+    "\n"
+    "The artist is the creator of beautiful things.  To reveal art and\n"
+    "conceal the artist is art's aim.\n"
+    "\n"
+    "CHAPTER I.\n"
+    "\n"
+    "The studio was filled with the rich odour of roses,\tand when the light\n"
+    "summer wind stirred amidst the trees of the garden,   there came through\n"
+    "the open door the heavy scent of the lilac.\n"
+    "\n"
+    "\n"
+    "\n"
+    "From the corner of the divan of Persian saddle-bags on which he was lying.\n"
+)
+
+SAMPLES = {
+    "lf": "Header\n*** START OF THE PROJECT GUTENBERG EBOOK 174 ***\n" + BODY
+          + "*** END OF THE PROJECT GUTENBERG EBOOK 174 ***\nLicense text\n",
+    "crlf": ("Header\n*** START OF THE PROJECT GUTENBERG EBOOK 174 ***\n" + BODY
+             + "*** END OF THE PROJECT GUTENBERG EBOOK 174 ***\n").replace("\n", "\r\n"),
+    "tabs_and_nbsp": ("*** START OF THE PROJECT GUTENBERG EBOOK 1 ***\n"
+                      + BODY.replace("  ", "\t ").replace(" the ", "\xa0the\xa0")
+                      + "\t\n   \n*** END OF THE PROJECT GUTENBERG EBOOK 1 ***\n"),
+    "alt_markers": ("*** START OF THIS PROJECT GUTENBERG EBOOK ***\n" + BODY
+                    + "*** END OF THIS PROJECT GUTENBERG EBOOK ***\n"),
+    "lowercase_markers": ("*** start of the project gutenberg ebook 6130 ***\n" + BODY
+                          + "*** end of the project gutenberg ebook 6130 ***\n"),
+    "no_markers": BODY,
+    "toc_only": "*** START OF THE PROJECT GUTENBERG EBOOK 2 ***\nContents\n\nCHAPTER I.\nCHAPTER II.\n",
+    "empty": "",
+}
+
+
+@pytest.mark.parametrize("name", sorted(SAMPLES))
+def test_clean_text_matches_reference(tmp_path, name):
+    raw_path = tmp_path / f"{name}.txt"
+    raw_path.write_bytes(SAMPLES[name].encode("utf-8"))
+
+    assert clean_text(str(raw_path)) == _clean_text_reference(str(raw_path))
+
+
+@pytest.mark.parametrize("name", ["lf", "crlf", "tabs_and_nbsp"])
+def test_streamed_paragraphs_match_clean_text(tmp_path, name):
+    raw_path = tmp_path / f"{name}.txt"
+    raw_path.write_bytes(SAMPLES[name].encode("utf-8"))
+
+    assert list(iter_clean_paragraphs(str(raw_path))) == split_into_paragraphs(clean_text(str(raw_path)))
+
+
+def test_clean_text_output(tmp_path):
+    raw_path = tmp_path / "book.txt"
+    raw_path.write_text(SAMPLES["lf"], encoding="utf-8")
+
+    # Title, byline and contents dropped, spaces and tabs collapsed, blank-line runs cut to one
+    assert clean_text(str(raw_path)) == (
+        "The artist is the creator of beautiful things. To reveal art and\n"
+        "conceal the artist is art's aim.\n"
+        "\n"
+        "CHAPTER I.\n"
+        "\n"
+        "The studio was filled with the rich odour of roses, and when the light\n"
+        "summer wind stirred amidst the trees of the garden, there came through\n"
+        "the open door the heavy scent of the lilac.\n"
+        "\n"
+        "From the corner of the divan of Persian saddle-bags on which he was lying."
+    )
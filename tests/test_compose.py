@@ -0,0 +1,77 @@
+"""
+select_quotes (bulk scoring, partial ranking) must pick the quotes of the
+original score-every-sentence-and-sort implementation, in the same order,
+including ties and the same-chunk duplicate rule.
+
+Expected quotes below were produced by the original implementation.
+
+    python -m pytest tests/test_compose.py -q
+"""
+import pytest
+
+from src.compose import select_quotes, sentence_spans, segment_sentences
+
+RETRIEVED = [
+    {'chunk_id': 'dorian_chunk_3', 'meta': {'book': 'dorian', 'para_idx_start': 10, 'para_idx_end': 12},
+     'text': "Lord Henry spoke of influence. Influence is immoral, he said. "
+             "To influence a person is to give him one's own soul. The portrait hung in the studio."},
+    {'chunk_id': 'dorian_chunk_7', 'meta': {'book': 'dorian', 'para_idx_start': 30, 'para_idx_end': 31},
+     'text': "Basil painted the portrait. Lord Henry spoke of influence. Nothing else mattered!"},
+    # The repeated sentence is a same-chunk duplicate and is picked once
+    {'chunk_id': 'dorian_chunk_9', 'meta': {'book': 'dorian', 'para_idx_start': 40, 'para_idx_end': 40},
+     'text': "Lord Henry spoke of influence. Lord Henry spoke of influence. Was it true?"},
+    {'chunk_id': 'dorian_chunk_11', 'meta': {'book': 'dorian', 'para_idx_start': 50, 'para_idx_end': 50},
+     'text': ""},
+]
+
+EXPECTED = {
+    "What does Lord Henry say about influence?": [
+        ('dorian_chunk_3', "Lord Henry spoke of influence.", 0.5285714285714286),
+        ('dorian_chunk_7', "Lord Henry spoke of influence.", 0.5285714285714286),
+        ('dorian_chunk_9', "Lord Henry spoke of influence.", 0.5285714285714286),
+        ('dorian_chunk_3', "Influence is immoral, he said.", 0.24285714285714285),
+        ('dorian_chunk_3', "To influence a person is to give him one's own soul.", 0.24285714285714285),
+    ],
+    "portrait": [
+        ('dorian_chunk_3', "The portrait hung in the studio.", 1.0),
+        ('dorian_chunk_7', "Basil painted the portrait.", 1.0),
+        ('dorian_chunk_3', "Lord Henry spoke of influence.", 0.1),
+    ],
+}
+
+
+def as_tuples(quotes):
+    return [(quote['chunk_id'], quote['text'], quote['score']) for quote in quotes]
+
+
+@pytest.mark.parametrize("query", sorted(EXPECTED))
+def test_select_quotes_matches_original(query):
+    expected = EXPECTED[query]
+    quotes = select_quotes(query, RETRIEVED, n=len(expected))
+
+    assert [(chunk_id, text) for chunk_id, text, _ in as_tuples(quotes)] == \
+        [(chunk_id, text) for chunk_id, text, _ in expected]
+    assert [score for _, _, score in as_tuples(quotes)] == pytest.approx([score for _, _, score in expected])
+    assert quotes[0]['cite'] == RETRIEVED[0]['meta']
+
+
+@pytest.mark.parametrize("query", sorted(EXPECTED))
+def test_precomputed_sentence_spans_give_the_same_quotes(query):
+    with_spans = [{**item, 'sentence_spans': sentence_spans(item['text'])} for item in RETRIEVED]
+
+    assert select_quotes(query, with_spans, n=5) == select_quotes(query, RETRIEVED, n=5)
+
+
+def test_sentence_spans_match_segment_sentences():
+    for item in RETRIEVED:
+        text = item['text']
+        assert [text[start:end] for start, end in sentence_spans(text)] == segment_sentences(text)
+
+
+def test_select_quotes_edge_cases():
+    assert select_quotes("influence", RETRIEVED, n=0) == []
+    assert select_quotes("influence", [], n=3) == []
+    # Fewer distinct sentences than requested: the duplicate is still returned only once
+    # ("Was it true?" is too short to count as a sentence)
+    assert as_tuples(select_quotes("influence", RETRIEVED[2:], n=10)) == \
+        [('dorian_chunk_9', "Lord Henry spoke of influence.", 1.0)]
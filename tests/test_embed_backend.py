@@ -0,0 +1,70 @@
+"""
+ONNX / int8 embedding backends must match PyTorch on cosine similarity.
+
+Runs offline: a tiny randomly initialised BERT sentence-transformer is built
+in a temp directory, exported through load_embedding_model and compared with
+check_backend_parity. Skipped when the ONNX extras are not installed
+(pip install "sentence-transformers[onnx]").
+
+    python -m pytest tests/test_embed_backend.py -q
+"""
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("optimum")
+
+from src.embed_backend import load_embedding_model, check_backend_parity, embedding_model_id
+
+WORDS = ["the", "portrait", "of", "dorian", "gray", "achilles", "wrath", "sing", "goddess",
+         "beauty", "youth", "soul", "painting", "hector", "troy", "ships", "lord", "henry"]
+
+TEXTS = [
+    "the portrait of dorian gray",
+    "sing goddess the wrath of achilles",
+    "youth and beauty of the soul",
+    "hector of troy",
+    "lord henry and the painting",
+    "the ships of troy",
+]
+
+
+@pytest.fixture(scope="module")
+def tiny_model_dir(tmp_path_factory):
+    """Save a 2-layer, 32-dim BERT sentence-transformer (random weights) and return its path."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+    from sentence_transformers import SentenceTransformer, models
+
+    root = tmp_path_factory.mktemp("tiny-st")
+    base_dir = root / "base"
+    base_dir.mkdir()
+    vocab_path = root / "vocab.txt"
+    vocab_path.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS) + "\n")
+
+    config = BertConfig(vocab_size=5 + len(WORDS), hidden_size=32, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=64, max_position_embeddings=64)
+    BertModel(config).save_pretrained(str(base_dir))
+    BertTokenizerFast(vocab_file=str(vocab_path)).save_pretrained(str(base_dir))
+
+    transformer = models.Transformer(str(base_dir), max_seq_length=32)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension())
+    model_dir = root / "model"
+    SentenceTransformer(modules=[transformer, pooling, models.Normalize()], device="cpu").save(str(model_dir))
+    return model_dir
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx_int8"])
+def test_backend_parity(tiny_model_dir, tmp_path, backend):
+    backend_config = {'type': backend, 'export_dir': str(tmp_path / "exports")}
+    reference = load_embedding_model(str(tiny_model_dir), 'torch')
+    model = load_embedding_model(str(tiny_model_dir), backend_config)
+
+    result = check_backend_parity(reference, model, TEXTS, min_cosine=0.99)
+
+    assert result['passed']
+    assert result['min_cosine'] >= 0.99
+
+
+def test_int8_vectors_get_their_own_cache_id():
+    assert embedding_model_id("m", "torch") == embedding_model_id("m", "onnx") == "m"
+    assert embedding_model_id("m", {'type': 'onnx_int8', 'quantization': 'avx2'}) == "m@int8-avx2"